@@ -1,11 +1,18 @@
 import os
+import time
 import streamlit as st
 import pandas as pd
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
+
+from metrics import record_error, record_tier, record_tokens, stage
+from preprocess import clean_ticket
+from streaming import LLM_STREAMING, stream_answer
+from taxonomy import TAXONOMY_DIR, WORKBOOK_PATH, compile_workbook, publish_taxonomy
+from ticket_classifier import (
+    classify_without_llm, get_chain, get_classification_log, get_result_cache, get_taxonomy_watcher,
+    parse_classification, store_result,
+)
+from tokens import record_saved_tokens
 
 # ---------- Setup ----------
 st.set_page_config(page_title="🎫 IT Ticket Classifier", layout="centered")
@@ -13,91 +20,126 @@ st.title("🎫 IT Support Ticket Classifier")
 load_dotenv()
 
 # ---------- Constants ----------
-CATEGORY_FILE = "categories_fixed.xlsx"
+# "full" sends the whole taxonomy with every ticket; "shortlist" only the top-k candidates
+PROMPT_MODE = os.getenv("PROMPT_MODE", "full")
 
-# ---------- Step 1: Handle Missing Excel Upload ----------
-if not os.path.exists(CATEGORY_FILE):
-    st.warning("⚠️ 'categories_fixed.xlsx' not found. Please upload it to proceed.")
+# ---------- Step 1: Load Compiled Taxonomy (or ask for an upload) ----------
+try:
+    taxonomy, taxonomy_index = get_taxonomy_watcher().current()
+except FileNotFoundError:
+    st.warning("⚠️ No category file found. Please upload 'categories_fixed.xlsx' to proceed.")
     uploaded_file = st.file_uploader("📁 Upload Category & Subcategory Excel File", type=["xlsx"])
     if uploaded_file is not None:
-        with open(CATEGORY_FILE, "wb") as f:
-            f.write(uploaded_file.read())
-        st.success("✅ File uploaded. Please reload the app manually (Ctrl + R).")
+        try:
+            publish_taxonomy(compile_workbook(uploaded_file))
+            os.makedirs(TAXONOMY_DIR, exist_ok=True)
+            with open(WORKBOOK_PATH, "wb") as f:
+                f.write(uploaded_file.getvalue())
+            st.rerun()
+        except ValueError as e:
+            st.error(f"❌ {e}")
     st.stop()
-
-# ---------- Step 2: Load Category/Subcategory Data ----------
-try:
-    df = pd.read_excel(CATEGORY_FILE)
-    if "Category" not in df.columns or "Subcategory" not in df.columns:
-        st.error("❌ Excel must have 'Category' and 'Subcategory' columns.")
-        st.stop()
-    category_str = "\n".join(sorted(df["Category"].unique()))
-    subcategory_str = "\n".join([f"{row['Category']} - {row['Subcategory']}" for _, row in df.iterrows()])
 except Exception as e:
-    st.error(f"❌ Failed to read the Excel file. Error: {e}")
+    st.error(f"❌ Failed to load the category taxonomy. Error: {e}")
     st.stop()
 
-# ---------- Step 3: Setup LLM Chain ----------
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3)
-
-system_message = f"""You are an expert at classifying IT support tickets.
-Classify each ticket into one of the following categories and subcategories.
-
-Categories:
-{category_str}
+# ---------- Step 2: Category/Subcategory Data ----------
+category_str = taxonomy["category_str"]
+subcategory_str = taxonomy["subcategory_str"]
 
-Subcategories:
-{subcategory_str}
+# ---------- Step 3: LLM Chain ----------
+# Built once per taxonomy version and shared by every session, so reruns do no setup;
+# history is off unless CHAT_HISTORY=on, and bounded when on (see ticket_classifier.py)
+chain = get_chain(taxonomy)
 
-Respond in this format:
-Category: <category>
-Subcategory: <subcategory>
-Use only the provided values.
-"""
-
-prompt = ChatPromptTemplate.from_messages([
-    ("system", system_message),
-    ("human", "{ticket_description}")
-])
-
-chat_history = StreamlitChatMessageHistory(key="ticket_chat")
-chain = RunnableWithMessageHistory(
-    prompt | llm,
-    lambda session_id: chat_history,
-    input_messages_key="ticket_description",
-    history_messages_key="history"
-)
+result_cache = get_result_cache()
+# Every result is appended to the columnar log behind pages/Classification_Log.py
+classification_log = get_classification_log()
+taxonomy_version = taxonomy["version"]
 
 # ---------- Step 4: User Input ----------
+prompt_mode = st.sidebar.radio(
+    "Prompt taxonomy", ["full", "shortlist"],
+    index=1 if PROMPT_MODE == "shortlist" else 0,
+    help="Shortlist sends only the closest candidate subcategories to the LLM.",
+)
 ticket_description = st.text_area("📝 Enter Ticket Description")
 
 if st.button("🔍 Classify"):
     if ticket_description.strip():
         with st.spinner("Classifying..."):
             try:
-                response = chain.invoke(
-                    {"ticket_description": ticket_description},
-                    config={"configurable": {"session_id": "ticket_session"}}
-                )
-                 # Extract tokens
-                usage = response.usage_metadata
-                input_tokens = usage.get("input_tokens", "N/A")
-                output_tokens = usage.get("output_tokens", "N/A")
-                content = getattr(response, "content", str(response))
-
-                # Extract result
-                category, subcategory = "", ""
-                for line in content.splitlines():
-                    if line.lower().startswith("category:"):
-                        category = line.split(":", 1)[1].strip()
-                    elif line.lower().startswith("subcategory:"):
-                        subcategory = line.split(":", 1)[1].strip()
-
-                st.success("✅ Classification Complete")
+                started = time.perf_counter()
+                # Quoted replies, signatures and pasted logs are stripped first (see preprocess.py)
+                ticket = clean_ticket(ticket_description)
+                ticket_text = ticket["text"]
+                result, tier, confidence = classify_without_llm(ticket_text, taxonomy, taxonomy_index)
+                if result is not None:
+                    category, subcategory = result["category"], result["subcategory"]
+                    input_tokens, output_tokens = 0, 0
+                else:
+                    shortlist = taxonomy_index.shortlist(ticket_text) if prompt_mode == "shortlist" else None
+                    # The chain has the full taxonomy bound; shortlist mode overrides it per call
+                    inputs = {"ticket_description": ticket_text}
+                    if shortlist:
+                        categories, subcategories = shortlist
+                        inputs.update(categories=categories, subcategories=subcategories)
+                    config = {"configurable": {"session_id": "ticket_session"}}
+                    # Prompt building happens inside the chain, so it is part of the llm stage here
+                    with stage("llm"):
+                        if LLM_STREAMING:
+                            # Stops reading once both lines are in; any explanation is never generated
+                            response = stream_answer(chain, inputs, config)["message"]
+                        else:
+                            response = chain.invoke(inputs, config=config)
+                    record_tokens(response, taxonomy_version)
+                    record_tier("llm", taxonomy_version)
+                    if shortlist:
+                        record_saved_tokens(response, category_str + subcategory_str, categories + subcategories)
+                    # Extract tokens
+                    usage = response.usage_metadata
+                    input_tokens = usage.get("input_tokens", "N/A")
+                    output_tokens = usage.get("output_tokens", "N/A")
+                    content = getattr(response, "content", str(response))
+
+                    # Extract result
+                    with stage("parse"):
+                        label = parse_classification(content, taxonomy)
+                    category, subcategory = label.category, label.subcategory
+                    if label.match != "rejected":
+                        store_result(ticket_text, taxonomy, label.as_dict())
+                    result = label.as_dict()
+
+                if classification_log is not None:
+                    classification_log.record(ticket_text, result, tier, taxonomy_version, "home",
+                                              time.perf_counter() - started, usage if tier == "llm" else None)
+
+                if tier == "llm" and label.match == "rejected":
+                    st.warning(f"⚠️ The model answered '{label.raw}', which is not in the taxonomy.")
+                else:
+                    st.success("✅ Classification Complete")
+                    if tier == "llm" and label.match == "snapped":
+                        st.caption(f"Model answered '{label.raw}'; snapped to the closest taxonomy label "
+                                   f"(similarity {label.similarity:.2f}).")
+                    if tier == "llm" and label.match == "subcategory":
+                        st.caption(f"Model answered '{label.raw}'; the category was taken from the subcategory.")
+                    if tier == "semantic":
+                        match = result["semantic_match"]
+                        st.caption(f"Label reused from a similar earlier ticket (similarity {match['similarity']:.2f}): "
+                                   f"\"{match['ticket']}\"")
                 st.table(pd.DataFrame([{"Category": category, "Subcategory": subcategory}]))
                 st.markdown(f"**Input Tokens:** {input_tokens}")
                 st.markdown(f"**Output Tokens:** {output_tokens}")
+                if ticket["tokens_removed"]:
+                    st.markdown(f"**Tokens Removed by Pre-processing:** ~{ticket['tokens_removed']} "
+                                f"of {ticket['tokens_before']}")
+                if tier == "llm" and usage.get("shortlist_saved_tokens"):
+                    st.markdown(f"**Input Tokens Saved by Shortlist:** ~{usage['shortlist_saved_tokens']}")
+                st.markdown(f"**Answered by:** {tier}" + (f" (confidence {confidence:.2f})" if confidence is not None else ""))
+                cache_stats = result_cache.stats()
+                st.caption(f"Cache hits: {cache_stats['hits']} · misses: {cache_stats['misses']} · hit rate: {cache_stats['hit_rate']:.0%}")
             except Exception as e:
+                record_error("llm")
                 st.error(f"❌ Classification failed: {e}")
     else:
         st.warning("Please enter a ticket description.")
@@ -1,11 +1,14 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
 from dotenv import load_dotenv
 import streamlit as st
 import pandas as pd
 import os
 
+from labels import LabelIndex
+from preprocess import clean_ticket
+from ticket_classifier import get_llm
+
 # Load environment variables
 load_dotenv()
 
@@ -18,12 +21,10 @@ categories = {
     "Services": ["Printing Services", "Database Services", "Web Services"],
     "General": ["Training and Guidance", "Policy and Procedure Enquiries"]
 }
+# Valid (category, subcategory) pairs; near-miss answers are snapped to the closest one
+labels = LabelIndex([{"category": c, "subcategory": s} for c, subs in categories.items() for s in subs])
 
-# Function to get LLM response
-def get_llm_response(ticket_description):
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3)
-
-    prompt_template = """
+prompt_template = """
     You are an expert at classifying IT support tickets.
     Based on the following ticket description, identify the most appropriate category and subcategory from the lists provided.
 
@@ -35,27 +36,23 @@ def get_llm_response(ticket_description):
     Subcategories:
     {subcategories}
 
-    Provide the answer in the following format:
-    Category: <category>
-    Subcategory: <subcategory>
+    Provide the answer as only a JSON object:
+    {{"category": "<category>", "subcategory": "<subcategory>"}}
     """
 
-    prompt = PromptTemplate(
-        input_variables=["ticket_description", "categories", "subcategories"],
-        template=prompt_template
+# Built once per process and shared by every session and rerun, on the same
+# Gemini client as the other apps (see ticket_classifier.get_llm)
+@st.cache_resource
+def get_classifier():
+    prompt = PromptTemplate.from_template(prompt_template).partial(
+        categories="\n".join([f"- {c}" for c in categories.keys()]),
+        subcategories="\n".join([f"- {s}" for subs in categories.values() for s in subs]),
     )
+    return prompt | get_llm() | StrOutputParser()
 
-    category_list = "\n".join([f"- {c}" for c in categories.keys()])
-    subcategory_list = "\n".join([f"- {s}" for subs in categories.values() for s in subs])
-
-    chain = LLMChain(llm=llm, prompt=prompt)
-    response = chain.run({
-        "ticket_description": ticket_description,
-        "categories": category_list,
-        "subcategories": subcategory_list
-    })
-    print(response)
-    return response
+# Function to get LLM response
+def get_llm_response(ticket_description):
+    return get_classifier().invoke({"ticket_description": ticket_description})
 
 # Streamlit UI
 st.title("🛠️ IT Support Ticket Classifier")
@@ -65,23 +62,17 @@ ticket_description = st.text_area("Enter the ticket description:")
 if st.button("Classify Ticket"):
     if ticket_description:
         with st.spinner("Classifying..."):
-            response = get_llm_response(ticket_description)
+            # Quoted replies, signatures and pasted logs are stripped first (see preprocess.py)
+            response = get_llm_response(clean_ticket(ticket_description)["text"])
 
-            # Parse response
-            category = ""
-            subcategory = ""
-            for line in response.splitlines():
-                if line.lower().startswith("category:"):
-                    category = line.split(":", 1)[1].strip()
-                elif line.lower().startswith("subcategory:"):
-                    subcategory = line.split(":", 1)[1].strip()
+            # Parse response and check it against the categories above
+            label = labels.parse(response)
+            category, subcategory = label.category, label.subcategory
+            if label.match == "rejected":
+                st.warning(f"The model answered '{label.raw}', which is not one of the categories.")
 
             # Display as a table
             df = pd.DataFrame([{"Category": category, "Subcategory": subcategory}])
             st.table(df)
     else:
         st.warning("Please enter a ticket description.")
-        
-        
-get_llm_response("Example ticket description for testing purposes.")  # Example call to test the function
-st.write("This is an example call to test the function. You can ignore this in the actual application.")    
@@ -2,57 +2,44 @@ import os
 import streamlit as st
 import pandas as pd
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
 
+from preprocess import clean_ticket
+from ticket_classifier import get_chain, get_taxonomy_watcher, parse_classification
+from tokens import record_saved_tokens
 
 # Load environment variables
 load_dotenv()
 
-# ---------- Fixed Category/Subcategory Data ----------
-@st.cache_data
-def load_fixed_category_data():
-    df = pd.read_excel("categories_fixed.xlsx")  # Your full category/subcategory file
-    category_list = "\n".join(sorted(df["Category"].unique()))
-    subcategory_list = "\n".join([f"{row['Category']} - {row['Subcategory']}" for _, row in df.iterrows()])
-    return df, category_list, subcategory_list
+# "full" sends the whole taxonomy with every ticket; "shortlist" only the top-k candidates
+PROMPT_MODE = os.getenv("PROMPT_MODE", "full")
 
-category_df, category_str, subcategory_str = load_fixed_category_data()
+# ---------- Fixed Category/Subcategory Data ----------
+# Compiled at upload time by pages/Upload_Categories.py (see taxonomy.py); the watcher is
+# shared with Home.py, so reruns pay only an os.stat to notice a newly published taxonomy
+taxonomy, taxonomy_index = get_taxonomy_watcher().current()
+category_str, subcategory_str = taxonomy["category_str"], taxonomy["subcategory_str"]
 
 # ---------- LLM and Prompt Setup ----------
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3)
-
-system_message = f"""You are an expert at classifying IT support tickets. 
+# Shortlist mode overrides the taxonomy bound into the chain with only the candidates
+system_message = """You are an expert at classifying IT support tickets. 
 Classify each incoming ticket into the most appropriate category and subcategory.
 Use only the following:
 
 Categories:
-{category_str}
+{categories}
 
 Subcategories:
-{subcategory_str}
+{subcategories}
 
-Respond in this format:
-Category: <category>
-Subcategory: <subcategory>
+Respond with only a JSON object:
+{{"category": "<category>", "subcategory": "<subcategory>"}}
 stricly use the provided categories and subcategories only.
 """
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", system_message),
-    ("human", "{ticket_description}")
-])
-
 # ---------- Memory with Runnable ----------
-chat_history = StreamlitChatMessageHistory(key="ticket_chat")
-chain = RunnableWithMessageHistory(
-    prompt | llm,
-    lambda session_id: chat_history,
-    input_messages_key="ticket_description",
-    history_messages_key="history"
-)
+# Pooled per taxonomy version with the process-wide client, so reruns do no setup;
+# history is off unless CHAT_HISTORY=on, and bounded when on (see ticket_classifier.py)
+chain = get_chain(taxonomy, system_message)
 
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title="IT Ticket Classifier", layout="centered")
@@ -63,10 +50,16 @@ ticket_description = st.text_area("📝 Enter Ticket Description")
 if st.button("🔍 Classify"):
     if ticket_description.strip():
         with st.spinner("Classifying..."):
-            response = chain.invoke(
-                {"ticket_description": ticket_description},
-                config={"configurable": {"session_id": "ticket_session"}}
-            )
+            # Quoted replies, signatures and pasted logs are stripped first (see preprocess.py)
+            ticket = clean_ticket(ticket_description)
+            shortlist = taxonomy_index.shortlist(ticket["text"]) if PROMPT_MODE == "shortlist" else None
+            inputs = {"ticket_description": ticket["text"]}
+            if shortlist:
+                categories, subcategories = shortlist
+                inputs.update(categories=categories, subcategories=subcategories)
+            response = chain.invoke(inputs, config={"configurable": {"session_id": "ticket_session"}})
+            if shortlist:
+                record_saved_tokens(response, category_str + subcategory_str, categories + subcategories)
 
             # Extract response content
             if hasattr(response, "content"):
@@ -74,17 +67,24 @@ if st.button("🔍 Classify"):
             else:
                 content = str(response)
 
-            # Parse and display result
-            category, subcategory = "", ""
-            for line in content.splitlines():
-                if line.lower().startswith("category:"):
-                    category = line.split(":", 1)[1].strip()
-                elif line.lower().startswith("subcategory:"):
-                    subcategory = line.split(":", 1)[1].strip()
-
-            df = pd.DataFrame([{"Category": category, "Subcategory": subcategory}])
-            st.success("✅ Classification Complete")
+            # Parse, then check against the taxonomy: near misses snap to a valid label
+            label = parse_classification(content, taxonomy)
+            df = pd.DataFrame([{"Category": label.category, "Subcategory": label.subcategory}])
+            if label.match == "rejected":
+                st.warning(f"⚠️ The model answered '{label.raw}', which is not in the taxonomy.")
+            else:
+                st.success("✅ Classification Complete")
+                if label.match == "snapped":
+                    st.caption(f"Model answered '{label.raw}'; snapped to the closest taxonomy label "
+                               f"(similarity {label.similarity:.2f}).")
+                if label.match == "subcategory":
+                    st.caption(f"Model answered '{label.raw}'; the category was taken from the subcategory.")
             st.table(df)
+            usage = getattr(response, "usage_metadata", None) or {}
+            if usage.get("shortlist_saved_tokens"):
+                st.caption(f"Input tokens: {usage.get('input_tokens')} · saved by shortlist: ~{usage['shortlist_saved_tokens']}")
+            if ticket["tokens_removed"]:
+                st.caption(f"Tokens removed by pre-processing: ~{ticket['tokens_removed']} of {ticket['tokens_before']}")
     else:
         st.warning("Please enter a ticket description.")
 
@@ -0,0 +1,258 @@
+"""
+Offline speed and accuracy benchmark for lambdaapp.py.
+
+Drives the FastAPI app in-process against fake_llm.FakeTicketChatModel, so no
+Gemini calls are made, using a labeled ticket set (description, category,
+subcategory). The fake answers labeled tickets correctly with probability
+--accuracy, so the accuracy column measures what the pipeline around the LLM
+(cache, local fast path, packing, parsing) does to quality.
+
+Scenarios, each starting from an empty result cache unless noted:
+
+  classify         POST /classify, one request per ticket
+  classify-cached  the same requests again, served from the cache of the run above
+  classify-reworded
+                   the tickets reworded ("Hi team, ...", "... Thanks in
+                   advance."), which miss the exact cache of the runs above
+                   but hit the near-duplicate cache
+  batch            POST /classify/batch with --batch-size tickets per request
+  batch-packed     the same with packed=true (several tickets per LLM call)
+
+For each scenario it reports p50/p95/p99 request latency, requests/sec,
+tickets/sec, LLM tokens per ticket (from the fake's usage counters), tokens
+removed per ticket by preprocess.py, accuracy, how many LLM answers labels.py
+snapped to a valid label or rejected, and how many tickets each tier answered.
+--noisy sends every ticket as an email thread (repeated line, signature,
+disclaimer, quoted reply) to measure what pre-processing saves and whether the
+classification survives it.
+
+Usage:
+    python benchmarks/classify_bench.py --latency 0.2 --distribution lognormal --clients 8
+    python benchmarks/classify_bench.py --error-rate 0.05 --accuracy 0.9 --fast-path-threshold 2
+    python benchmarks/classify_bench.py --noisy --scenarios classify batch-packed
+    python benchmarks/classify_bench.py --label-noise 0.2 --fast-path-threshold 2
+    LLM_STREAMING=off python benchmarks/classify_bench.py --explanation-tokens 150 --token-latency 0.005
+"""
+import argparse
+import asyncio
+import csv
+import math
+import os
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_LABELS = os.path.join(REPO_ROOT, "benchmarks", "labeled_tickets.csv")
+SCENARIOS = ("classify", "classify-cached", "classify-reworded", "batch", "batch-packed")
+# Scenarios that keep the caches filled by the scenario before them
+WARM_SCENARIOS = ("classify-cached", "classify-reworded")
+# Greetings and sign-offs that change the text but not the meaning of a ticket
+REWORDINGS = ("Hi team, {description}", "{description} Thanks in advance.",
+              "Hello, {description} Can someone help?", "Urgent: {description}")
+
+# Email noise appended by --noisy, all of which pre-processing should remove, so
+# accuracy shows whether the original ticket survives; {i} keeps tickets distinct
+NOISY_TEMPLATE = """{description}
+{description}
+
+Thanks,
+Alex Morgan
+Store Operations | Building {i} | +1 555 01{i:02d}
+CONFIDENTIALITY NOTICE: This e-mail and any attachments are confidential and intended solely for the
+addressee. If you have received it in error, please notify the sender and delete it.
+
+On Mon, May 6, 2024 at 9:12 AM IT Service Desk <servicedesk@example.com> wrote:
+> Hello, thanks for reaching out. Could you describe the problem in more detail and
+> attach any error messages or logs? Reference number: INC00{i:04d}
+>
+> Kind regards,
+> IT Service Desk
+"""
+
+
+def load_labels(path):
+    """Reads the labeled set as a list of (description, category, subcategory)."""
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row["description"], row["category"], row["subcategory"]) for row in csv.DictReader(f)]
+
+
+def noisy_ticket(description, i):
+    return NOISY_TEMPLATE.format(description=description, i=i)
+
+
+def reworded_ticket(description, i):
+    return REWORDINGS[i % len(REWORDINGS)].format(description=description)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def run_scenario(client, name, labels, clients, batch_size, noisy=False):
+    """Sends the labeled set through one scenario; returns (request latencies, results, elapsed)."""
+    descriptions = [reworded_ticket(d, i) if name == "classify-reworded" else d for i, (d, _, _) in enumerate(labels)]
+    descriptions = [noisy_ticket(d, i) if noisy else d for i, d in enumerate(descriptions)]
+    if name.startswith("batch"):
+        requests = [
+            {"tickets": [{"description": d} for d in descriptions[i:i + batch_size]],
+             "packed": name == "batch-packed"}
+            for i in range(0, len(descriptions), batch_size)
+        ]
+        path = "/classify/batch"
+    else:
+        requests = [{"description": d} for d in descriptions]
+        path = "/classify"
+
+    latencies, results = [], [None] * len(requests)
+    queue = iter(enumerate(requests))
+
+    async def worker():
+        for i, body in queue:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                results[i] = [{"category": None, "error": response.text}] * len(body.get("tickets", [body]))
+            elif name.startswith("batch"):
+                results[i] = response.json()["results"]
+            else:
+                results[i] = [response.json()]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return latencies, [item for batch in results for item in batch], elapsed
+
+
+def score(labels, results):
+    """Returns (accuracy, errors, tier counts, label match counts) for results aligned with labels."""
+    correct, errors, tiers, matches = 0, 0, Counter(), Counter()
+    for (_, category, subcategory), result in zip(labels, results):
+        if result.get("error") or "tier" not in result:
+            errors += 1
+            continue
+        tiers[result["tier"]] += 1
+        if result["tier"] == "llm":
+            matches[result["match"]] += 1
+        if (result["category"], result["subcategory"]) == (category, subcategory):
+            correct += 1
+    return correct / len(labels), errors, tiers, matches
+
+
+async def run_all(args, labels):
+    import lambdaapp
+    from classification_cache import ResultCache
+    from fake_llm import fake_llm_for_taxonomy
+    from taxonomy import load_taxonomy
+
+    fake = fake_llm_for_taxonomy(
+        load_taxonomy(),
+        # Reworded tickets that miss the near-duplicate cache still get their right label
+        labels={**{d: (c, s) for d, c, s in labels},
+                **{reworded_ticket(d, i): (c, s) for i, (d, c, s) in enumerate(labels)}},
+        latency=args.latency,
+        latency_distribution=args.distribution,
+        latency_spread=args.spread,
+        error_rate=args.error_rate,
+        accuracy=args.accuracy,
+        seed=args.seed,
+        explanation_tokens=args.explanation_tokens,
+        token_latency=args.token_latency,
+        label_noise=args.label_noise,
+    )
+    # Must be set before the first request builds the chains for the current taxonomy
+    lambdaapp.llm = fake
+    # Benchmark traffic stays out of the classification log
+    lambdaapp.classification_log = None
+
+    rows = []
+    # Unhandled errors become 500 responses, as behind a real server
+    transport = httpx.ASGITransport(app=lambdaapp.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in args.scenarios:
+            if name not in WARM_SCENARIOS:
+                lambdaapp.result_cache = ResultCache()
+                _, state = lambdaapp.taxonomy_watcher.current()
+                if state["semantic"] is not None:
+                    state["semantic"].clear()
+            fake.reset_stats()
+            latencies, results, elapsed = await run_scenario(client, name, labels, args.clients, args.batch_size,
+                                                             args.noisy)
+            accuracy, errors, tiers, matches = score(labels, results)
+            usage = fake.stats()
+            rows.append({
+                "scenario": name,
+                "requests": len(latencies),
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "rps": len(latencies) / elapsed,
+                "tps": len(labels) / elapsed,
+                "tokens": (usage["input_tokens"] + usage["output_tokens"]) / len(labels),
+                "removed": sum(r.get("tokens_removed") or 0 for r in results) / len(labels),
+                "llm_calls": usage["calls"],
+                "accuracy": accuracy,
+                "errors": errors,
+                "tiers": ", ".join(f"{tier} {count}" for tier, count in sorted(tiers.items())),
+                "snapped": matches["snapped"] + matches["subcategory"],
+                "rejected": matches["rejected"],
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", default=DEFAULT_LABELS, help="CSV with description,category,subcategory")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--batch-size", type=int, default=20, help="tickets per /classify/batch request")
+    parser.add_argument("--latency", type=float, default=0.2, help="median fake LLM latency in seconds")
+    parser.add_argument("--distribution", default="lognormal", help="fixed, uniform, lognormal or exponential")
+    parser.add_argument("--spread", type=float, default=0.5, help="width of the uniform/lognormal distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM calls that fail")
+    parser.add_argument("--accuracy", type=float, default=1.0, help="share of tickets the fake answers correctly")
+    parser.add_argument("--label-noise", type=float, default=0.0,
+                        help="share of fake answers with near-miss or invented labels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noisy", action="store_true", help="wrap tickets in email-thread noise")
+    parser.add_argument("--explanation-tokens", type=int, default=0,
+                        help="tokens of explanation the fake writes after its answer")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="fake LLM generation time per output token in seconds")
+    parser.add_argument("--fast-path-threshold", type=float, default=None,
+                        help="override FAST_PATH_THRESHOLD (2 sends every ticket to the LLM)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    # In-memory cache only, so runs do not read results persisted by earlier runs
+    os.environ.pop("CLASSIFY_CACHE_PATH", None)
+    if args.fast_path_threshold is not None:
+        os.environ["FAST_PATH_THRESHOLD"] = str(args.fast_path_threshold)
+
+    from streaming import LLM_STREAMING
+
+    labels = load_labels(args.labels)
+    rows = asyncio.run(run_all(args, labels))
+
+    print(f"{len(labels)} labeled tickets, {args.clients} clients, fake LLM {args.distribution} "
+          f"{args.latency:.3f}s + {args.token_latency * 1000:g}ms/token, streaming {'on' if LLM_STREAMING else 'off'}, "
+          f"error rate {args.error_rate:g}, accuracy {args.accuracy:g}, label noise {args.label_noise:g}, "
+          f"seed {args.seed}"
+          + (", noisy tickets" if args.noisy else ""))
+    print(f"{'scenario':<17} {'reqs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7} "
+          f"{'tickets/s':>9} {'tok/ticket':>10} {'removed':>7} {'llm calls':>9} {'accuracy':>8} {'errors':>6} {'snapped':>7} {'rejected':>8}  tiers")
+    for r in rows:
+        print(f"{r['scenario']:<17} {r['requests']:>5} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} "
+              f"{r['rps']:>7.1f} {r['tps']:>9.1f} {r['tokens']:>10.1f} {r['removed']:>7.1f} {r['llm_calls']:>9} "
+              f"{r['accuracy']:>8.1%} {r['errors']:>6} {r['snapped']:>7} {r['rejected']:>8}  {r['tiers']}")
+
+
+if __name__ == "__main__":
+    main()
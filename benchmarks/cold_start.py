@@ -0,0 +1,129 @@
+"""
+Cold-start benchmark for the Mangum/Lambda handler in lambdaapp.py.
+
+Every run starts a fresh Python process, as a Lambda cold start would, and
+measures:
+
+  process  - wall time of the whole child process (interpreter start included)
+  import   - time to import lambdaapp (module initialisation)
+  first    - time from the start of the import to the first /classify response
+             returned by the Mangum handler, with the LLM stubbed out
+             (TICKET_LLM=fake, so no network calls are made)
+
+It then runs `python -X importtime -c "import lambdaapp"` once and lists the
+imports with the highest cumulative cost, so regressions can be traced.
+
+Usage:
+    python benchmarks/cold_start.py --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in the child process: import the app, then send one request through Mangum
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import lambdaapp
+t1 = time.perf_counter()
+
+class Context:
+    function_name = "cold-start-benchmark"
+    aws_request_id = "benchmark"
+
+event = {
+    "version": "2.0",
+    "routeKey": "POST /classify",
+    "rawPath": "/classify",
+    "rawQueryString": "",
+    "headers": {"content-type": "application/json", "host": "localhost"},
+    "requestContext": {
+        "http": {"method": "POST", "path": "/classify", "protocol": "HTTP/1.1",
+                 "sourceIp": "127.0.0.1", "userAgent": "benchmark"},
+        "stage": "$default", "requestId": "benchmark", "accountId": "0",
+        "apiId": "benchmark", "domainName": "localhost", "domainPrefix": "localhost",
+        "time": "", "timeEpoch": 0,
+    },
+    "body": json.dumps({"description": "Teams meeting audio keeps dropping"}),
+    "isBase64Encoded": False,
+}
+response = lambdaapp.handler(event, Context())
+t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first": t2 - t0, "status": response["statusCode"]}))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.update({
+        "TICKET_LLM": "fake",
+        "GOOGLE_API_KEY": env.get("GOOGLE_API_KEY", "benchmark"),
+        # Force the request through the (stubbed) LLM path, not the local fast path
+        "FAST_PATH_THRESHOLD": "2",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    env.pop("CLASSIFY_CACHE_PATH", None)
+    return env
+
+
+def run_once():
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=REPO_ROOT, env=child_env(),
+        capture_output=True, text=True, check=True,
+    )
+    process = time.perf_counter() - start
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    if timings["status"] != 200:
+        raise RuntimeError(f"/classify returned {timings['status']}")
+    return {"process": process, **timings}
+
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_profile(top):
+    """Returns (total_seconds, [(cumulative_seconds, depth, module)]) from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import lambdaapp"],
+        cwd=REPO_ROOT, env=child_env(), capture_output=True, text=True, check=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            entries.append((int(cumulative) / 1e6, (len(indent) - 1) // 2, module))
+    total = next((c for c, _, m in entries if m == "lambdaapp"), 0.0)
+    # Direct imports of lambdaapp and their children are the actionable ones
+    shallow = [e for e in entries if e[1] <= 2 and e[2] != "lambdaapp"]
+    return total, sorted(shallow, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{args.runs} cold starts (median / min / max, seconds)")
+    for key in ("process", "import", "first"):
+        values = [r[key] for r in runs]
+        print(f"  {key:<8} {statistics.median(values):7.3f} {min(values):7.3f} {max(values):7.3f}")
+
+    total, slowest = import_profile(args.top)
+    print(f"\n-X importtime: import lambdaapp = {total:.3f}s; slowest imports (cumulative):")
+    for cumulative, depth, module in slowest:
+        print(f"  {cumulative:7.3f}s  {'  ' * depth}{module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Throttling and tail-latency benchmark for llm_client.py.
+
+Runs a burst of concurrent classification calls against fake_llm.FakeTicketChatModel
+configured with a provider quota (calls over it fail fast with a 429) or a
+heavy-tailed latency distribution, and compares:
+
+  throttling
+    raw            the model called directly: 429s surface as errors
+    client         RateLimitedChatModel with no configured limits: retries with
+                   jittered backoff while AIMD shrinks the concurrency limit
+    client+rpm     the same with LLM_RPM set to the quota: the token bucket paces
+                   calls so the provider rarely throttles
+
+  tail latency (no quota, lognormal latency with a long tail)
+    no hedge       RateLimitedChatModel without hedging
+    hedge          duplicate call after --hedge-after seconds, first answer wins
+
+Usage:
+    python benchmarks/rate_limit.py --calls 300 --concurrency 32 --quota-rpm 1200
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from fake_llm import FakeTicketChatModel  # noqa: E402
+from llm_client import AdaptiveConcurrency, RateLimitedChatModel, RateLimiter  # noqa: E402
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else float("nan")
+
+
+async def burst(model, calls, concurrency, tag):
+    """Sends `calls` distinct tickets with at most `concurrency` outstanding."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await model.ainvoke([HumanMessage(f"{tag} ticket {i}: VPN drops every few minutes")])
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def report(name, fake, limiter, result):
+    latencies, errors, elapsed = result
+    usage = fake.stats()
+    stats = limiter.stats() if limiter else {}
+    print(f"{name:<12} {len(latencies):>5} {errors:>6} {usage['calls']:>10} {usage['throttled']:>9} "
+          f"{percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 99) * 1000:>8.0f} "
+          f"{elapsed:>8.2f} {stats.get('concurrency_limit', '-'):>7} {stats.get('hedges', '-'):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=32, help="outstanding calls from the caller")
+    parser.add_argument("--latency", type=float, default=0.1, help="median fake LLM latency in seconds")
+    parser.add_argument("--quota-rpm", type=int, default=1200, help="simulated provider quota")
+    parser.add_argument("--quota-window", type=float, default=2.0, help="quota window in seconds")
+    parser.add_argument("--tail-spread", type=float, default=1.0, help="lognormal sigma for the tail test")
+    parser.add_argument("--hedge-after", type=float, default=0.2, help="seconds before a hedged duplicate")
+    args = parser.parse_args()
+
+    def quota_model():
+        return FakeTicketChatModel(latency=args.latency, latency_distribution="lognormal", latency_spread=0.3,
+                                   rate_limit_rpm=args.quota_rpm, rate_limit_window=args.quota_window)
+
+    def limiter(**kwargs):
+        # Short backoffs: the simulated quota window is seconds, not a minute
+        return RateLimiter(concurrency=AdaptiveConcurrency(maximum=args.concurrency), max_retries=8,
+                           backoff_base=0.1, backoff_max=2.0, **{"hedge_after": "off", **kwargs})
+
+    print(f"{args.calls} calls, {args.concurrency} concurrent, quota {args.quota_rpm} RPM "
+          f"({args.quota_rpm * args.quota_window / 60:g} per {args.quota_window:g}s window)")
+    print(f"{'mode':<12} {'ok':>5} {'errors':>6} {'llm calls':>10} {'throttled':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'elapsed':>8} {'limit':>7} {'hedges':>6}")
+
+    fake = quota_model()
+    report("raw", fake, None, asyncio.run(burst(fake, args.calls, args.concurrency, "raw")))
+    for name, kwargs in (("client", {}), ("client+rpm", {"rpm": args.quota_rpm})):
+        fake, rate_limiter = quota_model(), limiter(**kwargs)
+        if kwargs:
+            # Start with an empty bucket, as after a burst, so pacing shows from the first call
+            rate_limiter.requests.capacity = rate_limiter.requests.tokens = args.quota_rpm * args.quota_window / 60
+        model = RateLimitedChatModel(model=fake, limiter=rate_limiter)
+        report(name, fake, rate_limiter, asyncio.run(burst(model, args.calls, args.concurrency, name)))
+
+    print(f"\ntail latency: lognormal median {args.latency:g}s, sigma {args.tail_spread:g}, no quota")
+    for name, hedge_after in (("no hedge", "off"), ("hedge", args.hedge_after)):
+        fake = FakeTicketChatModel(latency=args.latency, latency_distribution="lognormal",
+                                   latency_spread=args.tail_spread, seed=1)
+        rate_limiter = limiter(hedge_after=hedge_after)
+        model = RateLimitedChatModel(model=fake, limiter=rate_limiter)
+        report(name, fake, rate_limiter, asyncio.run(burst(model, args.calls, args.concurrency, "tail")))
+
+
+if __name__ == "__main__":
+    main()
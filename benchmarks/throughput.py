@@ -0,0 +1,77 @@
+"""
+Throughput comparison for lambdaapp.py: blocking chain.invoke vs the async path.
+
+Runs the FastAPI app in-process against a fake chat model with a fixed latency,
+so no Gemini calls are made. For each number of concurrent clients it reports
+requests/sec for:
+
+  blocking - the old handler, which calls chain.invoke inside an async endpoint
+  async    - the current /classify endpoint, which awaits chain.ainvoke
+
+Usage:
+    python benchmarks/throughput.py --latency 0.2 --requests 40 --clients 1 2 4 8 16
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+# Send every ticket to the (fake) LLM; the local fast path would skip it
+os.environ.setdefault("FAST_PATH_THRESHOLD", "2")
+
+import lambdaapp  # noqa: E402
+from fake_llm import FakeTicketChatModel  # noqa: E402
+
+
+@lambdaapp.app.post("/classify_blocking")
+async def classify_blocking(req: lambdaapp.TicketRequest):
+    # Reproduces the previous handler: a sync call inside an async endpoint
+    _, state = lambdaapp.taxonomy_watcher.current()
+    response = state["chain"].invoke({"ticket_description": req.description})
+    return {"category": response.content}
+
+
+async def run(path, clients, total_requests):
+    """Sends total_requests split across `clients` concurrent clients; returns req/s."""
+    transport = httpx.ASGITransport(app=lambdaapp.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        per_client = max(1, total_requests // clients)
+
+        async def worker(worker_id):
+            for i in range(per_client):
+                # Unique descriptions keep the result cache out of the measurement
+                description = f"VPN not connecting ({worker_id}-{i}-{time.perf_counter_ns()})"
+                r = await client.post(path, json={"description": description})
+                r.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(clients)))
+        elapsed = time.perf_counter() - start
+    return per_client * clients / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency in seconds")
+    parser.add_argument("--requests", type=int, default=40, help="requests per measurement")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    # Must be set before the first request builds the chain for the current taxonomy
+    lambdaapp.llm = FakeTicketChatModel(latency=args.latency)
+
+    print(f"fake LLM latency: {args.latency:.3f}s, {args.requests} requests per run")
+    print(f"{'clients':>8} {'blocking req/s':>15} {'async req/s':>12} {'speedup':>8}")
+    for clients in args.clients:
+        blocking = asyncio.run(run("/classify_blocking", clients, args.requests))
+        concurrent = asyncio.run(run("/classify", clients, args.requests))
+        print(f"{clients:>8} {blocking:>15.1f} {concurrent:>12.1f} {concurrent / blocking:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
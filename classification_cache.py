@@ -0,0 +1,155 @@
+"""
+Exact-match cache for ticket classification results.
+
+Entries are keyed on the normalized ticket description plus a hash of the
+category taxonomy, so uploading a new taxonomy invalidates old results
+without an explicit flush. The in-process tier is an LRU with a TTL; an
+optional SQLite tier (CLASSIFY_CACHE_PATH) lets results survive restarts
+and Lambda warm starts when pointed at a persistent path such as /tmp.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+# Bumped when the shape of cached results changes, so older entries are never served
+RESULT_FORMAT = 2
+
+
+def normalize_description(text):
+    """Lowercases and collapses whitespace so trivially different tickets share a key."""
+    return _WHITESPACE.sub(" ", str(text)).strip().lower()
+
+
+def cache_key(description, taxonomy_version):
+    """Builds the cache key for a ticket under a given taxonomy version."""
+    raw = f"{RESULT_FORMAT}\n{taxonomy_version}\n{normalize_description(description)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SQLiteBackend:
+    """On-disk cache tier backed by a single SQLite table."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key, ttl):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if ttl and time.time() - created > ttl:
+            self.delete(key)
+            return None
+        return json.loads(value), created
+
+    def set(self, key, value, created):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value), created),
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+class ResultCache:
+    """LRU + TTL cache of classification results with an optional persistent backend."""
+
+    def __init__(self, max_size=10000, ttl=86400, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()  # key -> (value, created)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, description, taxonomy_version):
+        """Returns the cached result for a ticket, or None on a miss."""
+        key = cache_key(description, taxonomy_version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and now - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.backend is not None:
+            stored = self.backend.get(key, self.ttl)
+            if stored is not None:
+                with self._lock:
+                    self._insert(key, stored)
+                    self.hits += 1
+                    self.backend_hits += 1
+                return stored[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, description, taxonomy_version, value):
+        """Stores a JSON-serializable result for a ticket."""
+        key = cache_key(description, taxonomy_version)
+        entry = (value, time.time())
+        with self._lock:
+            self._insert(key, entry)
+        if self.backend is not None:
+            self.backend.set(key, value, entry[1])
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Returns hit/miss counters for reporting."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def cache_from_env():
+    """Builds a ResultCache configured from CLASSIFY_CACHE_* environment variables."""
+    path = os.getenv("CLASSIFY_CACHE_PATH")
+    return ResultCache(
+        max_size=int(os.getenv("CLASSIFY_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("CLASSIFY_CACHE_TTL_SECONDS", "86400")),
+        backend=SQLiteBackend(path) if path else None,
+    )
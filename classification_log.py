@@ -0,0 +1,228 @@
+"""
+Append-only columnar log of classification results, for analytics that never
+go back to the LLM.
+
+Every classified ticket (any tier) becomes one row: a hash of the ticket,
+the labels, the answering tier, LLM tokens, latency, taxonomy version and the
+entry point that classified it. Ticket text itself is not stored.
+
+Writes never block a request: record() only appends to an in-memory buffer,
+and a daemon thread writes the buffer out every CLASSIFICATION_LOG_FLUSH_SECONDS,
+or sooner once CLASSIFICATION_LOG_BATCH rows are waiting. Each flush adds a new
+zstd-compressed Parquet file under a hive-style day partition:
+
+    classification_log/date=2026-10-17/part-<time>-<pid>.parquet
+
+Files are written under a hidden temp name and renamed into place, so a reader
+never sees half a file, and existing files are never modified. If writes fall
+behind, rows past CLASSIFICATION_LOG_MAX_PENDING are dropped (and counted)
+rather than slowing classification down.
+
+open_dataset() reads the log back through memory-mapped files: a query only
+pages in the columns it selects, from the day partitions its filter keeps.
+pages/Classification_Log.py charts it.
+
+pyarrow is imported on first write, not at import, so lambdaapp.py cold starts
+don't pay for it. The log is off on Lambda (read-only filesystem, process
+frozen between invocations) unless CLASSIFICATION_LOG=on; set
+CLASSIFICATION_LOG=off to disable it anywhere.
+"""
+import atexit
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from classification_cache import normalize_description
+
+CLASSIFICATION_LOG = os.getenv(
+    "CLASSIFICATION_LOG", "off" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "on"
+).lower() not in ("0", "off", "false", "no")
+CLASSIFICATION_LOG_DIR = os.getenv("CLASSIFICATION_LOG_DIR", "classification_log")
+CLASSIFICATION_LOG_BATCH = int(os.getenv("CLASSIFICATION_LOG_BATCH", "1000"))
+# Also bounds the number of files: at most one per process per interval
+CLASSIFICATION_LOG_FLUSH_SECONDS = float(os.getenv("CLASSIFICATION_LOG_FLUSH_SECONDS", "30"))
+CLASSIFICATION_LOG_MAX_PENDING = int(os.getenv("CLASSIFICATION_LOG_MAX_PENDING", "100000"))
+
+PARTITION = "date"
+
+
+@lru_cache(maxsize=None)
+def schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("ticket_hash", pa.string()),
+        ("category", pa.string()),
+        ("subcategory", pa.string()),
+        # cache / semantic / local / llm
+        ("tier", pa.string()),
+        # How an LLM label matched the taxonomy (labels.py); null for other tiers
+        ("match", pa.string()),
+        ("input_tokens", pa.int32()),
+        ("output_tokens", pa.int32()),
+        ("latency_ms", pa.float32()),
+        ("taxonomy_version", pa.string()),
+        # api / home / bulk
+        ("source", pa.string()),
+    ])
+
+
+def ticket_hash(description):
+    """Stable hash of the normalized ticket text, so repeats can be counted without storing tickets."""
+    return hashlib.blake2b(normalize_description(description).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ClassificationLog:
+    """Buffers classification rows and appends them to day-partitioned Parquet files in the background."""
+
+    def __init__(self, directory=CLASSIFICATION_LOG_DIR, batch_size=CLASSIFICATION_LOG_BATCH,
+                 flush_seconds=CLASSIFICATION_LOG_FLUSH_SECONDS, max_pending=CLASSIFICATION_LOG_MAX_PENDING):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.files = 0
+        self.last_error = None
+        self._pending = []
+        self._lock = threading.Lock()
+        # Serializes flushes from the writer thread, flush() callers and close()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def record(self, description, result, tier, taxonomy_version, source, latency, usage=None):
+        """Queues one classified ticket; returns immediately.
+
+        result holds category/subcategory (and match for LLM answers), latency is
+        in seconds, usage is the LLM response's usage_metadata, if any.
+        """
+        usage = usage or {}
+        row = {
+            "ts": datetime.now(timezone.utc),
+            "ticket_hash": ticket_hash(description),
+            "category": result.get("category"),
+            "subcategory": result.get("subcategory"),
+            "tier": tier,
+            "match": result.get("match") if tier == "llm" else None,
+            "input_tokens": int(usage.get("input_tokens") or 0),
+            "output_tokens": int(usage.get("output_tokens") or 0),
+            "latency_ms": latency * 1000,
+            "taxonomy_version": taxonomy_version,
+            "source": source,
+        }
+        with self._lock:
+            if self._closed or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="classification-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes everything buffered so far; returns the number of rows written."""
+        with self._write_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            try:
+                self._write(rows)
+            except Exception as e:
+                # Analytics are best effort: a full disk must not take classification down
+                self.failed += len(rows)
+                self.last_error = str(e)
+                return 0
+            self.written += len(rows)
+            return len(rows)
+
+    def _write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        days = {}
+        for row in rows:
+            days.setdefault(row["ts"].strftime("%Y-%m-%d"), []).append(row)
+        for day, day_rows in days.items():
+            partition = os.path.join(self.directory, f"{PARTITION}={day}")
+            os.makedirs(partition, exist_ok=True)
+            name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+            # Names starting with "." are skipped by dataset discovery until renamed
+            tmp_path = os.path.join(partition, f".{name}.tmp")
+            pq.write_table(pa.Table.from_pylist(day_rows, schema=schema()), tmp_path, compression="zstd")
+            os.replace(tmp_path, os.path.join(partition, name))
+            self.files += 1
+
+    def close(self):
+        """Stops the writer thread and writes what is left."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "directory": self.directory,
+            "pending": pending,
+            "written": self.written,
+            "files": self.files,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+
+def log_from_env():
+    """Returns a ClassificationLog configured from the environment, or None when disabled."""
+    return ClassificationLog() if CLASSIFICATION_LOG else None
+
+
+def partitions(directory=CLASSIFICATION_LOG_DIR):
+    """Sorted day partitions ('YYYY-MM-DD') that have been written."""
+    if not os.path.isdir(directory):
+        return []
+    prefix = f"{PARTITION}="
+    return sorted(name[len(prefix):] for name in os.listdir(directory) if name.startswith(prefix))
+
+
+def open_dataset(directory=CLASSIFICATION_LOG_DIR):
+    """Opens the log as a pyarrow dataset over memory-mapped files, or None if nothing was written.
+
+    The day partition is exposed as a string `date` column; filtering on it
+    skips the other days' files entirely.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    if not partitions(directory):
+        return None
+    return ds.dataset(
+        os.path.abspath(directory),
+        schema=schema().append(pa.field(PARTITION, pa.string())),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([(PARTITION, pa.string())]), flavor="hive"),
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
@@ -0,0 +1,344 @@
+"""
+Deterministic stand-in for ChatGoogleGenerativeAI.
+
+Set TICKET_LLM=fake to make lambdaapp.py use it instead of Gemini, e.g. for
+benchmarks or local runs without an API key. No network calls are made; the
+model simulates what matters for performance work:
+
+  latency   - FAKE_LLM_LATENCY_SECONDS, drawn from FAKE_LLM_LATENCY_DISTRIBUTION
+              (fixed, uniform, lognormal or exponential; FAKE_LLM_LATENCY_SPREAD
+              sets the width of the first two)
+  errors    - FAKE_LLM_ERROR_RATE, the share of calls that raise FakeLLMError (503)
+  throttling - FAKE_LLM_RATE_LIMIT_RPM, a provider quota: calls beyond it within a
+              rolling FAKE_LLM_RATE_LIMIT_WINDOW_SECONDS window fail fast with
+              FakeRateLimitError (429); FAKE_LLM_THROTTLE_RATE adds random 429s
+  tokens    - usage_metadata on every reply, counted with tokens.count_tokens;
+              max_output_tokens cuts the reply short, and FAKE_LLM_EXPLANATION_TOKENS
+              appends a chatty explanation after the answer
+  streaming - replies stream a word at a time, FAKE_LLM_TOKEN_LATENCY_SECONDS apart
+              after the first (FAKE_LLM_LATENCY_SECONDS); closing the stream stops
+              the generation, and only delivered tokens are counted
+  quality   - given `answers` (ticket -> category, subcategory), FAKE_LLM_ACCURACY
+              is the share of tickets answered correctly; the rest, and unknown
+              tickets, get a pair drawn from `choices`; FAKE_LLM_LABEL_NOISE is the
+              share of answers whose labels come out slightly off (case, plurals,
+              the category repeated in the subcategory), one in five of them
+              invented outright, as for checking labels.py
+
+Every random draw is seeded from FAKE_LLM_SEED, the ticket text and how often
+that text was seen, so runs are reproducible regardless of request interleaving.
+Single-ticket prompts get a reply in the format they ask for: a JSON object
+with the fields the prompt lists, or "Category: ..." / "Subcategory: ..."
+lines; packed prompts (a JSON array of tickets, see packing.py) get a JSON
+array back.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from classification_cache import normalize_description
+from tokens import count_tokens
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+# lambdaapp.py's prompt embeds the ticket between these markers
+_TICKET_DESCRIPTION = re.compile(r"Ticket Description:\s*(.*?)\s*\n\s*Respond\b", re.DOTALL)
+# Streamed a word (about one token) at a time
+_CHUNK = re.compile(r"\s*\S+")
+_EXPLANATION = ("The", "ticket", "describes", "symptoms", "that", "match", "this", "subcategory", "more", "closely",
+                "than", "any", "other", "option", "in", "the", "list.")
+
+
+def _garble(pair, rng):
+    """A near miss of a (category, subcategory) label, or an invented one."""
+    category, subcategory = pair
+    kind = rng.randrange(5)
+    if kind == 0:
+        return category.lower(), subcategory.lower()
+    if kind == 1:
+        return category, subcategory[:-1] if subcategory.endswith("s") else subcategory + "s"
+    if kind == 2:
+        # As listed in the Streamlit prompts
+        return category, f"{category} - {subcategory}"
+    if kind == 3:
+        return category, subcategory.replace("/", " and ").replace(" Issues", " Problem")
+    return "Miscellaneous", "Other Issue"
+
+
+class FakeLLMError(RuntimeError):
+    """Simulated transient provider failure."""
+
+    status_code = 503
+
+
+class FakeRateLimitError(FakeLLMError):
+    """Simulated provider throttling."""
+
+    status_code = 429
+
+
+class FakeTicketChatModel(BaseChatModel):
+    """Chat model that answers ticket classification prompts locally."""
+
+    latency: float = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0"))
+    latency_distribution: str = os.getenv("FAKE_LLM_LATENCY_DISTRIBUTION", "fixed")
+    latency_spread: float = float(os.getenv("FAKE_LLM_LATENCY_SPREAD", "0.5"))
+    error_rate: float = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+    rate_limit_rpm: int = int(os.getenv("FAKE_LLM_RATE_LIMIT_RPM", "0"))
+    # Shorter windows let benchmarks hit the quota in seconds rather than minutes
+    rate_limit_window: float = float(os.getenv("FAKE_LLM_RATE_LIMIT_WINDOW_SECONDS", "60"))
+    throttle_rate: float = float(os.getenv("FAKE_LLM_THROTTLE_RATE", "0"))
+    accuracy: float = float(os.getenv("FAKE_LLM_ACCURACY", "1"))
+    label_noise: float = float(os.getenv("FAKE_LLM_LABEL_NOISE", "0"))
+    seed: int = int(os.getenv("FAKE_LLM_SEED", "0"))
+    # Normalized ticket description -> (category, subcategory)
+    answers: Dict[str, Tuple[str, str]] = {}
+    # Pairs used for wrong answers and tickets missing from `answers`
+    choices: List[Tuple[str, str]] = []
+    default_answer: Tuple[str, str] = ("Network", "VPN Issues")
+    # Fixed completion size; None counts the tokens of the reply text
+    output_tokens: Optional[int] = None
+    # Chatty models explain their answer; this many tokens follow the answer lines
+    explanation_tokens: int = int(os.getenv("FAKE_LLM_EXPLANATION_TOKENS", "0"))
+    # Generation time per output chunk (about one token) after the first
+    token_latency: float = float(os.getenv("FAKE_LLM_TOKEN_LATENCY_SECONDS", "0"))
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _seen: Counter = PrivateAttr(default_factory=Counter)
+    _stats: Counter = PrivateAttr(default_factory=Counter)
+    _accepted: deque = PrivateAttr(default_factory=deque)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ticket-classifier"
+
+    def stats(self):
+        """Returns call, error and token counters since creation or the last reset."""
+        with self._lock:
+            return {key: self._stats[key] for key in ("calls", "errors", "throttled", "input_tokens", "output_tokens")}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _rng(self, *parts):
+        return random.Random("|".join(str(p) for p in (self.seed, *parts)))
+
+    def _sample_latency(self, rng):
+        if self.latency <= 0 or self.latency_distribution == "fixed":
+            return max(self.latency, 0.0)
+        if self.latency_distribution == "uniform":
+            return self.latency * rng.uniform(max(0.0, 1 - self.latency_spread), 1 + self.latency_spread)
+        if self.latency_distribution == "lognormal":
+            # Median is `latency`; a long right tail like real API latencies
+            return self.latency * rng.lognormvariate(0, self.latency_spread)
+        if self.latency_distribution == "exponential":
+            return rng.expovariate(1 / self.latency)
+        raise ValueError(
+            f"Unknown latency distribution {self.latency_distribution!r}; "
+            f"expected one of {', '.join(LATENCY_DISTRIBUTIONS)}"
+        )
+
+    def _pick(self, ticket):
+        """Returns the (category, subcategory) this model 'believes' for a ticket."""
+        rng = self._rng("answer", normalize_description(ticket))
+        correct = self.answers.get(normalize_description(ticket))
+        if correct is not None and rng.random() < self.accuracy:
+            answer = correct
+        else:
+            wrong = [pair for pair in self.choices if tuple(pair) != correct]
+            answer = tuple(rng.choice(wrong)) if wrong else self.default_answer
+        return _garble(answer, rng) if rng.random() < self.label_noise else answer
+
+    def _reply(self, messages):
+        """Builds the reply text and returns (reply, key identifying the request)."""
+        prompt = messages[-1].content if messages else ""
+        tickets = _packed_tickets(prompt)
+        if tickets is not None:
+            items = []
+            for ticket in tickets:
+                category, subcategory = self._pick(ticket["text"])
+                items.append({"id": ticket["id"], "category": category, "subcategory": subcategory})
+            return json.dumps(items), prompt
+
+        match = _TICKET_DESCRIPTION.search(prompt)
+        ticket = match.group(1) if match else prompt.strip()
+        category, subcategory = self._pick(ticket)
+        # Answers in the format the prompt asks for, so a prompt that forgets the
+        # subcategory gets a reply without one, as from a real model
+        instructions = "\n".join(str(m.content) for m in messages)
+        if '"category": "<category>"' in instructions:
+            answer = {"category": category}
+            if '"subcategory": "<subcategory>"' in instructions:
+                answer["subcategory"] = subcategory
+            reply = json.dumps(answer)
+        elif "Subcategory: <subcategory>" in instructions:
+            reply = f"Category: {category}\nSubcategory: {subcategory}"
+        else:
+            reply = f"Category: {category}"
+        if self.explanation_tokens > 0:
+            words = (_EXPLANATION * (self.explanation_tokens // len(_EXPLANATION) + 1))[:self.explanation_tokens]
+            reply += "\n\nExplanation: " + " ".join(words)
+        return reply, ticket
+
+    def _over_quota(self):
+        """Counts the call against the rolling quota; True if it is over the limit."""
+        if not self.rate_limit_rpm:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._accepted and now - self._accepted[0] > self.rate_limit_window:
+                self._accepted.popleft()
+            if len(self._accepted) >= self.rate_limit_rpm * self.rate_limit_window / 60:
+                return True
+            self._accepted.append(now)
+            return False
+
+    def _call(self, messages, max_output_tokens=None):
+        """Decides the outcome of one call.
+
+        Returns (delay before the first chunk, reply chunks or an exception).
+        """
+        reply, key = self._reply(messages)
+        with self._lock:
+            attempt = self._seen[key]
+            self._seen[key] += 1
+        rng = self._rng("call", key, attempt)
+        delay = self._sample_latency(rng)
+        if rng.random() < self.throttle_rate or self._over_quota():
+            with self._lock:
+                self._stats["calls"] += 1
+                self._stats["throttled"] += 1
+            # Providers reject over-quota calls quickly
+            return delay * 0.1, FakeRateLimitError("429 Resource has been exhausted (simulated quota)")
+        failed = rng.random() < self.error_rate
+
+        input_tokens = count_tokens("\n".join(str(m.content) for m in messages))
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["errors"] += failed
+            self._stats["input_tokens"] += input_tokens
+        if failed:
+            return delay, FakeLLMError("503 Simulated LLM failure (FAKE_LLM_ERROR_RATE)")
+
+        # Roughly one token per chunk; the cap cuts the reply like a provider would
+        chunks, budget = [], max_output_tokens
+        for text in _CHUNK.findall(reply):
+            tokens = count_tokens(text)
+            if budget is not None:
+                if budget <= 0:
+                    break
+                budget -= tokens
+            chunks.append((text, tokens))
+        if self.output_tokens is not None and chunks:
+            chunks = [(chunks[0][0], self.output_tokens)] + [(text, 0) for text, _ in chunks[1:]]
+        return delay, (input_tokens, chunks)
+
+    def _count_output(self, tokens):
+        with self._lock:
+            self._stats["output_tokens"] += tokens
+
+    def _message(self, input_tokens, chunks):
+        output_tokens = sum(tokens for _, tokens in chunks)
+        self._count_output(output_tokens)
+        message = AIMessage(content="".join(text for text, _ in chunks), usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _chunk(text, input_tokens, output_tokens):
+        # Usage per chunk as deltas, like Gemini, so a stream closed early still reports what it used
+        return ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }))
+
+    def _generation_time(self, delay, chunks):
+        return delay + self.token_latency * max(0, len(chunks) - 1)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        delay, result = self._call(messages, kwargs.get("max_output_tokens"))
+        if isinstance(result, Exception):
+            if delay:
+                time.sleep(delay)
+            raise result
+        input_tokens, chunks = result
+        if self._generation_time(delay, chunks):
+            time.sleep(self._generation_time(delay, chunks))
+        return self._message(input_tokens, chunks)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        delay, result = self._call(messages, kwargs.get("max_output_tokens"))
+        if isinstance(result, Exception):
+            if delay:
+                await asyncio.sleep(delay)
+            raise result
+        input_tokens, chunks = result
+        if self._generation_time(delay, chunks):
+            await asyncio.sleep(self._generation_time(delay, chunks))
+        return self._message(input_tokens, chunks)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        delay, result = self._call(messages, kwargs.get("max_output_tokens"))
+        if delay:
+            time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        input_tokens, chunks = result
+        for i, (text, tokens) in enumerate(chunks):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            # Counted as delivered: generation stops when the caller closes the stream
+            self._count_output(tokens)
+            yield self._chunk(text, input_tokens if i == 0 else 0, tokens)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        delay, result = self._call(messages, kwargs.get("max_output_tokens"))
+        if delay:
+            await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        input_tokens, chunks = result
+        for i, (text, tokens) in enumerate(chunks):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            self._count_output(tokens)
+            yield self._chunk(text, input_tokens if i == 0 else 0, tokens)
+
+
+def _packed_tickets(content):
+    """Returns the [{"id", "text"}] tickets of a packed prompt, or None for a single ticket."""
+    if not isinstance(content, str) or not content.lstrip().startswith("["):
+        return None
+    try:
+        tickets = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(tickets, list) or not all(isinstance(t, dict) and "text" in t for t in tickets):
+        return None
+    return tickets
+
+
+def fake_llm_for_taxonomy(taxonomy, labels=None, **kwargs):
+    """Builds a fake whose answers are drawn from a taxonomy's (category, subcategory) pairs.
+
+    labels maps ticket descriptions to their correct (category, subcategory).
+    """
+    answers = {normalize_description(text): tuple(pair) for text, pair in (labels or {}).items()}
+    choices = [(row["category"], row["subcategory"]) for row in taxonomy["rows"]]
+    return FakeTicketChatModel(answers=answers, choices=choices, **kwargs)
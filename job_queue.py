@@ -0,0 +1,251 @@
+"""
+Durable classification job queue on a single SQLite file.
+
+Large backlogs do not fit in one /classify/batch request, so lambdaapp.py
+accepts them as jobs: POST /jobs stores every ticket as an item row and
+returns a job id, workers in the app process classify the items in chunks,
+and clients poll GET /jobs/{id} and page through GET /jobs/{id}/results.
+
+  - Checkpointing: each chunk's results are committed as soon as it finishes,
+    so a restart loses at most the chunks in flight.
+  - Leases: a claimed item belongs to its worker for JOB_LEASE_SECONDS; items
+    of a crashed worker become claimable again once the lease runs out.
+  - Retries: a failed item is retried after a backoff, JOB_MAX_ATTEMPTS times
+    in total, then recorded as failed with its error.
+  - Idempotency: the job id is derived from the tickets and options (or the
+    client's idempotency_key), so re-submitting the same job returns the
+    existing one instead of classifying everything again.
+
+No broker is involved; several processes on one box can share JOB_DB_PATH.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from itertools import groupby
+
+from classification_cache import normalize_description
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs/jobs.sqlite3")
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "25"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "5"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    total INTEGER NOT NULL,
+    packed INTEGER NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+CREATE INDEX IF NOT EXISTS items_job_status ON items (job_id, status);
+"""
+
+
+def job_id_for(descriptions, packed, idempotency_key=None):
+    """Stable job id: the same tickets and options always map to the same job."""
+    digest = hashlib.sha256()
+    if idempotency_key:
+        digest.update(f"key\n{idempotency_key}".encode("utf-8"))
+    else:
+        digest.update(f"packed={bool(packed)}".encode("utf-8"))
+        for description in descriptions:
+            digest.update(b"\n" + normalize_description(description).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class JobQueue:
+    """Jobs and their items in SQLite; every method is safe to call from any thread."""
+
+    def __init__(self, path=JOB_DB_PATH, max_attempts=JOB_MAX_ATTEMPTS,
+                 lease_seconds=JOB_LEASE_SECONDS, retry_delay=JOB_RETRY_DELAY_SECONDS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def submit(self, descriptions, packed=False, idempotency_key=None):
+        """Queues a job; returns (job_id, created). created is False for a re-submission."""
+        job_id = job_id_for(descriptions, packed, idempotency_key)
+        now = time.time()
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, total, packed, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (job_id, len(descriptions), int(bool(packed)), now, now),
+            ).rowcount
+            if inserted:
+                self._conn.executemany(
+                    "INSERT INTO items (job_id, idx, description) VALUES (?, ?, ?)",
+                    ((job_id, i, d) for i, d in enumerate(descriptions)),
+                )
+        return job_id, bool(inserted)
+
+    def claim(self, limit=JOB_CHUNK_SIZE):
+        """Leases up to `limit` ready items, oldest first.
+
+        Returns [{"job_id", "idx", "description", "attempts", "packed"}].
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # Items whose worker died are handed out again
+            self._conn.execute(
+                "UPDATE items SET status = 'pending' WHERE status = 'running' AND lease_until < ?", (now,)
+            )
+            rows = self._conn.execute(
+                "SELECT rowid, job_id, idx, description, attempts FROM items "
+                "WHERE status = 'pending' AND available_at <= ? ORDER BY rowid LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            if not rows:
+                return []
+            self._conn.executemany(
+                "UPDATE items SET status = 'running', attempts = attempts + 1, lease_until = ? WHERE rowid = ?",
+                ((now + self.lease_seconds, row[0]) for row in rows),
+            )
+            job_ids = sorted({row[1] for row in rows})
+            packed = dict(self._conn.execute(
+                f"SELECT id, packed FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})", job_ids
+            ).fetchall())
+        return [
+            {"job_id": job_id, "idx": idx, "description": description,
+             "attempts": attempts + 1, "packed": bool(packed.get(job_id))}
+            for _, job_id, idx, description, attempts in rows
+        ]
+
+    def finish(self, items, results):
+        """Checkpoints a processed chunk: results are dicts, or exceptions for failed items."""
+        now = time.time()
+        done, retry, failed = [], [], []
+        for item, result in zip(items, results):
+            key = (item["job_id"], item["idx"])
+            if not isinstance(result, BaseException):
+                done.append((json.dumps(result), *key))
+            elif item["attempts"] < self.max_attempts:
+                # Backoff grows with each attempt
+                retry.append((str(result), now + self.retry_delay * 2 ** (item["attempts"] - 1), *key))
+            else:
+                failed.append((str(result) or type(result).__name__, *key))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE items SET status = 'done', result = ?, error = NULL, lease_until = NULL "
+                "WHERE job_id = ? AND idx = ?", done,
+            )
+            self._conn.executemany(
+                "UPDATE items SET status = 'pending', error = ?, available_at = ?, lease_until = NULL "
+                "WHERE job_id = ? AND idx = ?", retry,
+            )
+            self._conn.executemany(
+                "UPDATE items SET status = 'failed', error = ?, lease_until = NULL "
+                "WHERE job_id = ? AND idx = ?", failed,
+            )
+            self._conn.executemany(
+                "UPDATE jobs SET updated = ? WHERE id = ?",
+                ((now, job_id) for job_id in {item["job_id"] for item in items}),
+            )
+
+    def status(self, job_id):
+        """Returns the job's progress, or None for an unknown id."""
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT total, packed, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        total, packed, created, updated = job
+        counts = {key: counts.get(key, 0) for key in ("pending", "running", "done", "failed")}
+        finished = counts["done"] + counts["failed"]
+        if finished == total:
+            state = "completed"
+        elif finished or counts["running"]:
+            state = "running"
+        else:
+            state = "queued"
+        return {
+            "job_id": job_id,
+            "status": state,
+            "total": total,
+            **counts,
+            "progress": round(finished / total, 4) if total else 1.0,
+            "packed": bool(packed),
+            "created": created,
+            "updated": updated,
+        }
+
+    def results(self, job_id, offset=0, limit=100):
+        """Returns one page of items in ticket order (finished or not)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, status, result, error FROM items WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        page = []
+        for idx, status, result, error in rows:
+            item = {"index": idx, "status": status}
+            if result is not None:
+                item.update(json.loads(result))
+            # Errors of items still being retried are not final, so only failures report one
+            item["error"] = error if status == "failed" else None
+            page.append(item)
+        return page
+
+
+async def run_worker(queue, process, wakeup=None, chunk_size=JOB_CHUNK_SIZE, poll_interval=JOB_POLL_SECONDS):
+    """Claims and processes chunks until cancelled.
+
+    process(descriptions, packed) is awaited per job in the chunk and returns one
+    result dict or exception per description. SQLite calls run in a thread so
+    the event loop keeps serving requests.
+    """
+    while True:
+        items = await asyncio.to_thread(queue.claim, chunk_size)
+        if not items:
+            if wakeup is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            # Not asyncio.wait_for: it can swallow a cancel that arrives as the event is set,
+            # which kept workers running through shutdown right after a submission
+            try:
+                async with asyncio.timeout(poll_interval):
+                    await wakeup.wait()
+            except TimeoutError:
+                pass
+            wakeup.clear()
+            continue
+
+        for (_, packed), group in groupby(items, key=lambda item: (item["job_id"], item["packed"])):
+            group = list(group)
+            try:
+                results = await process([item["description"] for item in group], packed)
+            except Exception as e:
+                results = [e] * len(group)
+            await asyncio.to_thread(queue.finish, group, results)
@@ -0,0 +1,194 @@
+"""
+Validation of model answers against the taxonomy.
+
+Models answer with labels that are almost right more often than not: a
+different case, a missing plural, "Network - VPN Issues" copied from the
+prompt list, or the subcategory under the wrong category. Asking again costs a
+full LLM round trip, so answers are instead checked against a LabelIndex built
+once per taxonomy version:
+
+  exact       the (category, subcategory) pair is in the taxonomy (dict lookup)
+  normalized  equal after lowercasing and dropping punctuation (dict lookup)
+  subcategory the subcategory alone names one valid pair; the category was wrong
+              or missing (dict lookup)
+  snapped     close enough to one valid pair: trigram candidates ranked with
+              difflib, accepted at LABEL_SNAP_THRESHOLD similarity or above
+  rejected    nothing close; category and subcategory are None
+
+Every answer is returned as a Classification and counted in
+ticket_label_validations_total, which gives the snap and reject rates (the
+snap rate counts both kinds of correction, subcategory and snapped).
+"""
+import difflib
+import os
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+
+from metrics import record_label
+
+# Minimum difflib similarity for snapping a near miss to a valid pair
+LABEL_SNAP_THRESHOLD = float(os.getenv("LABEL_SNAP_THRESHOLD", "0.8"))
+# Trigram candidates scored with difflib per near miss
+SNAP_CANDIDATES = 8
+# Validated answers remembered per index; models repeat the same near misses
+MEMO_SIZE = 4096
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+# "Category: Network -> VPN Issues" and "Network - VPN Issues" put both labels in one field
+_PAIR_SEPARATOR = re.compile(r"\s*(?:->|→|\s-\s)\s*")
+
+
+class Classification(NamedTuple):
+    """A validated answer; category and subcategory are None when it was rejected."""
+
+    category: Optional[str]
+    subcategory: Optional[str]
+    # "exact", "normalized", "subcategory", "snapped" or "rejected"
+    match: str
+    # difflib similarity of the answer to the returned pair (to the closest pair when rejected)
+    similarity: float
+    # What the model answered, as "category -> subcategory"
+    raw: str = ""
+
+    def as_dict(self):
+        return self._asdict()
+
+
+def normalize_label(text):
+    return _NON_WORD.sub(" ", str(text or "").lower().replace("&", " and ")).strip()
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LabelIndex:
+    """Valid (category, subcategory) pairs of one taxonomy, indexed for O(1) checks and fuzzy snapping."""
+
+    def __init__(self, rows, snap_threshold=LABEL_SNAP_THRESHOLD):
+        self.snap_threshold = snap_threshold
+        self.pairs = []
+        self.exact = {}
+        self.normalized = {}
+        self.by_subcategory = {}
+        self.keys = []
+        self.trigrams = {}
+        for row in rows:
+            pair = (row["category"], row["subcategory"])
+            if pair in self.exact:
+                continue
+            i = self.exact[pair] = len(self.pairs)
+            self.pairs.append(pair)
+            category, subcategory = normalize_label(pair[0]), normalize_label(pair[1])
+            self.normalized.setdefault((category, subcategory), i)
+            self.by_subcategory.setdefault(subcategory, []).append(i)
+            key = f"{category} {subcategory}"
+            self.keys.append(key)
+            for trigram in _trigrams(key):
+                self.trigrams.setdefault(trigram, []).append(i)
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def validate(self, category, subcategory=None):
+        """Checks a model's (category, subcategory) against the taxonomy; returns a Classification."""
+        category, subcategory = (category or "").strip(), (subcategory or "").strip()
+        if not subcategory:
+            # Both labels in the category field ("Network -> VPN Issues")
+            parts = _PAIR_SEPARATOR.split(category, maxsplit=1)
+            if len(parts) == 2:
+                category, subcategory = parts
+        raw = f"{category} -> {subcategory}" if subcategory else category
+
+        i = self.exact.get((category, subcategory))
+        if i is not None:
+            result = Classification(*self.pairs[i], "exact", 1.0, raw)
+        else:
+            memo_key = (category, subcategory)
+            result = self._memo.get(memo_key)
+            if result is None:
+                result = self._match(category, subcategory, raw)
+                if len(self._memo) >= MEMO_SIZE:
+                    self._memo.clear()
+                self._memo[memo_key] = result
+        record_label(result.match)
+        return result
+
+    def parse(self, text):
+        """Parses a {"category", "subcategory"} reply (or 'Category: ...' lines) and validates it."""
+        from streaming import ClassificationParser
+
+        parser = ClassificationParser()
+        parser.feed(str(text or ""))
+        parser.finish()
+        if parser.category is None and parser.subcategory is None:
+            # No field labels at all: the whole first line may be the answer
+            first_line = next((line for line in str(text or "").splitlines() if line.strip()), "")
+            return self.validate(first_line)
+        return self.validate(parser.category, parser.subcategory)
+
+    def _match(self, category, subcategory, raw):
+        norm_category, norm_subcategory = normalize_label(category), normalize_label(subcategory)
+        # "Subcategory: Network - VPN Issues" repeats the category, as in the prompt list
+        if norm_category and norm_subcategory.startswith(norm_category + " "):
+            norm_subcategory = norm_subcategory[len(norm_category) + 1:]
+
+        i = self.normalized.get((norm_category, norm_subcategory))
+        if i is not None:
+            return Classification(*self.pairs[i], "normalized", 1.0, raw)
+
+        # The subcategory alone is unambiguous: the category was wrong or missing
+        candidates = self.by_subcategory.get(norm_subcategory) or ()
+        if len(candidates) == 1:
+            similarity = self._similarity(f"{norm_category} {norm_subcategory}".strip(), candidates[0])
+            return Classification(*self.pairs[candidates[0]], "subcategory", round(similarity, 4), raw)
+
+        query = f"{norm_category} {norm_subcategory}".strip()
+        shared = Counter()
+        for trigram in _trigrams(query):
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        # difflib indexes the second sequence, so the query is indexed once for all candidates
+        matcher = difflib.SequenceMatcher(None, "", query, autojunk=False)
+        best, best_similarity = None, 0.0
+        for candidate, _ in shared.most_common(SNAP_CANDIDATES):
+            matcher.set_seq1(self.keys[candidate])
+            # Cheap upper bounds first; most candidates cannot beat the best so far
+            if matcher.real_quick_ratio() <= best_similarity or matcher.quick_ratio() <= best_similarity:
+                continue
+            similarity = matcher.ratio()
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is not None and best_similarity >= self.snap_threshold:
+            return Classification(*self.pairs[best], "snapped", round(best_similarity, 4), raw)
+        return Classification(None, None, "rejected", round(best_similarity, 4), raw)
+
+    def _similarity(self, query, i):
+        return difflib.SequenceMatcher(None, query, self.keys[i], autojunk=False).ratio()
+
+
+_indexes = {}
+
+
+def label_index(taxonomy):
+    """Returns the LabelIndex for a compiled taxonomy, built once per version."""
+    index = _indexes.get(taxonomy["version"])
+    if index is None:
+        if len(_indexes) >= 4:
+            _indexes.clear()
+        index = _indexes[taxonomy["version"]] = LabelIndex(taxonomy["rows"])
+    return index
+
+
+def label_rates(counts):
+    """Adds the total and snap / reject rates to {match: count}."""
+    total = sum(counts.values())
+    return {
+        **counts,
+        "total": total,
+        "snap_rate": round((counts.get("snapped", 0) + counts.get("subcategory", 0)) / total, 4) if total else 0.0,
+        "reject_rate": round(counts.get("rejected", 0) / total, 4) if total else 0.0,
+    }
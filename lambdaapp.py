@@ -1,28 +1,52 @@
 # app.py
+#
+# Heavy dependencies (langchain, the Gemini SDK, NumPy) are imported on the first
+# request that needs them rather than at module import, to keep Lambda cold
+# starts short. benchmarks/cold_start.py tracks the cost.
 
-from fastapi import FastAPI
-from pydantic import BaseModel
-from langchain.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.runnables import RunnableSequence
+import asyncio
+import json
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from mangum import Mangum  # for AWS Lambda
 import os
 from dotenv import load_dotenv
 
+from classification_cache import cache_from_env
+from classification_log import log_from_env
+from labels import label_index, label_rates
+from preprocess import clean_ticket
+from metrics import (
+    RequestLatencyMiddleware, record_cache_lookup, record_error, record_fallback, record_stream, record_tier,
+    record_tokens, registry, stage,
+)
+from streaming import LLM_MAX_OUTPUT_TOKENS, LLM_STREAMING, astream_answer
+from taxonomy import TaxonomyWatcher
+
 load_dotenv()
 
-# Dummy fixed categories for demo
-category_map = """
-Hardware -> Laptop/Desktop Issues: Slow performance, blue screen
-Software -> Application Issues: App crashes, login failure
-Network -> VPN Issues: VPN not connecting
-Access Management -> Password Reset: Forgot password, locked account
-"""
+# Upper bound on concurrent LLM calls for a single /classify/batch request
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_TICKETS = int(os.getenv("BATCH_MAX_TICKETS", "1000"))
+# Per-ticket LLM timeout; the in-flight call is cancelled when it expires
+CLASSIFY_TIMEOUT_SECONDS = float(os.getenv("CLASSIFY_TIMEOUT_SECONDS", "30"))
+# Background workers for /jobs (see job_queue.py); 0 disables them, as does Lambda,
+# which freezes the process between invocations
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_TICKETS = int(os.getenv("JOB_MAX_TICKETS", "100000"))
+JOB_RESULTS_PAGE_MAX = int(os.getenv("JOB_RESULTS_PAGE_MAX", "1000"))
+# How long shutdown waits for cancelled workers before moving on
+JOB_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("JOB_SHUTDOWN_TIMEOUT_SECONDS", "10"))
 
 # Prompt Template
-prompt_template = PromptTemplate(
-    input_variables=["ticket_description", "category_map"],
-    template="""
+PROMPT_TEMPLATE = """
 You are an expert IT ticket classifier.
 
 Given a ticket description and the known categories, classify it.
@@ -32,24 +56,447 @@ Categories and Examples:
 
 Ticket Description: {ticket_description}
 
-Respond in this format:
-Category: <category>
+Respond with only a JSON object:
+{{"category": "<category>", "subcategory": "<subcategory>"}}
 """
-)
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.2)
-chain: RunnableSequence = prompt_template | llm
+# Results are cached per taxonomy version, so a new upload invalidates them
+result_cache = cache_from_env()
+# How many tickets each tier (cache / semantic / local / llm) answered
+tier_counts = Counter()
+# How LLM answers matched the taxonomy (exact / normalized / subcategory / snapped / rejected)
+label_counts = Counter()
+# Every result, appended to Parquet in the background for pages/Classification_Log.py (None when disabled)
+classification_log = log_from_env()
+
+# Built on first use; benchmarks may assign their own chat model before the first request
+llm = None
+
+def get_llm():
+    """Returns the chat model, constructing the client on first use.
+
+    TICKET_LLM=fake swaps in the network-free stand-in from fake_llm.py.
+    """
+    global llm
+    if llm is None:
+        if os.getenv("TICKET_LLM") == "fake":
+            from fake_llm import FakeTicketChatModel
+            llm = FakeTicketChatModel()
+        else:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            # Retries happen in llm_client, where 429s also adjust the concurrency limit.
+            # JSON mode: replies are the object (or, packed, the array) the prompts ask for
+            llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.2, max_retries=1,
+                                         response_mime_type="application/json")
+    return llm
+
+def _build_state(taxonomy):
+    """Prebuilds everything that depends on the taxonomy; runs once per published version."""
+    from langchain_core.prompts import PromptTemplate
+    from llm_client import rate_limited
+    from packing import packed_prompt
+    from semantic_cache import semantic_cache_for
+    from taxonomy_index import load_or_build_index
+
+    prompt_template = PromptTemplate(
+        input_variables=["ticket_description", "category_map"],
+        template=PROMPT_TEMPLATE,
+    ).partial(category_map=taxonomy["category_map"])
+    # Several tickets per request, sharing one copy of the taxonomy prompt
+    packed_template = packed_prompt.partial(category_map=taxonomy["category_map"])
+    # Request/token budgets, adaptive concurrency, retries and hedging (see llm_client.py)
+    llm = rate_limited(get_llm())
+    # Prompt and model are kept apart so each stage can be timed separately
+    return {
+        "version": taxonomy["version"],
+        # Local fast path: confidently easy tickets are answered without the LLM
+        "index": load_or_build_index(taxonomy),
+        # Valid (category, subcategory) pairs that LLM answers are checked and snapped against
+        "labels": label_index(taxonomy),
+        # Near-duplicates of tickets the LLM already labeled (None when SEMANTIC_CACHE=off)
+        "semantic": semantic_cache_for(taxonomy["version"]),
+        "llm": llm,
+        "prompt": prompt_template,
+        "packed_prompt": packed_template,
+        "chain": prompt_template | llm,
+        "packed_chain": packed_template | llm,
+    }
+
+# Taxonomy compiled at upload time (see taxonomy.py), shared with the Streamlit apps.
+# New uploads are picked up without a redeploy; in-flight requests keep their state.
+taxonomy_watcher = TaxonomyWatcher(build=_build_state)
+
+@lru_cache(maxsize=None)
+def get_job_queue():
+    """Opens the job database on first use."""
+    from job_queue import JobQueue
+    return JobQueue()
+
+# Set on submission so idle workers start without waiting for their next poll
+job_wakeup = asyncio.Event()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    workers = []
+    if JOB_WORKERS > 0 and not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+        from job_queue import run_worker
+        queue = get_job_queue()
+        workers = [
+            asyncio.create_task(run_worker(queue, _classify_many, wakeup=job_wakeup))
+            for _ in range(JOB_WORKERS)
+        ]
+    yield
+    for worker in workers:
+        worker.cancel()
+    # Chunks cut short here keep their lease and are picked up again after a restart;
+    # a worker stuck in a blocking call must not hold shutdown up indefinitely
+    if workers:
+        await asyncio.wait(workers, timeout=JOB_SHUTDOWN_TIMEOUT_SECONDS)
+    # Persists the near-duplicate caches when SEMANTIC_CACHE_DIR is set
+    from semantic_cache import save_all
+    save_all()
+    if classification_log is not None:
+        classification_log.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestLatencyMiddleware)
 handler = Mangum(app)  # for AWS Lambda
 
 class TicketRequest(BaseModel):
     description: str
 
+async def _with_timeout(coro, timeout=CLASSIFY_TIMEOUT_SECONDS):
+    """Awaits an LLM call, cancelling it if it outlives the timeout."""
+    try:
+        return await asyncio.wait_for(coro, timeout=max(timeout, 0))
+    except asyncio.TimeoutError:
+        record_error("timeout")
+        raise TimeoutError(f"Classification timed out after {timeout:g}s")
+    except Exception:
+        record_error("llm")
+        raise
+
+async def _ainvoke_llm(prompt, inputs, state, **kwargs):
+    """Builds the prompt and awaits the model, timing each stage and recording token usage."""
+    with stage("prompt"):
+        prompt_value = prompt.invoke(inputs)
+    with stage("llm"):
+        response = await _with_timeout(state["llm"].ainvoke(prompt_value, **kwargs))
+    record_tokens(response, state["version"])
+    return response
+
+async def _ainvoke_chain(description: str, state):
+    """Runs the chain without blocking the event loop, bounded by the timeout."""
+    return await _ainvoke_llm(state["prompt"], {"ticket_description": description}, state,
+                              max_output_tokens=LLM_MAX_OUTPUT_TOKENS)
+
+async def _astream_chain(description: str, state):
+    """Streams the answer for one ticket, closing the stream once both fields are in (see streaming.py).
+
+    Yields ("category" | "subcategory", value) as they are parsed, then ("done", answer).
+    """
+    with stage("prompt"):
+        prompt_value = state["prompt"].invoke({"ticket_description": description})
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CLASSIFY_TIMEOUT_SECONDS
+    events = astream_answer(state["llm"], prompt_value, max_output_tokens=LLM_MAX_OUTPUT_TOKENS)
+    try:
+        with stage("llm"):
+            while True:
+                # One deadline for the whole stream, not per chunk
+                field, value = await _with_timeout(events.__anext__(), deadline - loop.time())
+                if field == "done":
+                    break
+                yield field, value
+    finally:
+        await events.aclose()
+    record_tokens(value["message"], state["version"])
+    record_stream(value["early_exit"])
+    yield "done", value
+
+def _classify_without_llm(description: str, state):
+    """Tries the cache, near-duplicate and local index tiers; returns (result or None, local confidence)."""
+    cached = result_cache.get(description, state["version"])
+    record_cache_lookup(cached is not None)
+    if cached is not None:
+        tier_counts["cache"] += 1
+        record_tier("cache", state["version"])
+        return {**cached, "cached": True, "tier": "cache"}, None
+
+    match = state["semantic"].lookup(description) if state["semantic"] is not None else None
+    if match is not None:
+        cached, similarity, ticket = match
+        tier_counts["semantic"] += 1
+        record_tier("semantic", state["version"])
+        return {
+            **cached,
+            "cached": True,
+            "tier": "semantic",
+            "semantic_match": {"similarity": similarity, "ticket": ticket},
+        }, None
+
+    row, confidence = state["index"].classify(description)
+    if row is not None:
+        tier_counts["local"] += 1
+        record_tier("local", state["version"])
+        return {
+            "category": row["category"],
+            "subcategory": row["subcategory"],
+            "cached": False,
+            "tier": "local",
+            "confidence": confidence,
+        }, confidence
+    record_fallback("low_confidence")
+    return None, confidence
+
+def _llm_result(description: str, state, label, confidence, packed=False):
+    """Turns a validated LLM answer into a result; rejected answers are not cached."""
+    result = label.as_dict()
+    if label.match != "rejected":
+        result_cache.set(description, state["version"], result)
+        if state["semantic"] is not None:
+            state["semantic"].add(description, result)
+    label_counts[label.match] += 1
+    tier_counts["llm"] += 1
+    record_tier("llm", state["version"])
+    return {**result, "cached": False, "tier": "llm", "confidence": confidence, "packed": packed}
+
+def _log_result(description: str, state, result, started, usage=None):
+    """Queues a result for the classification log; never blocks the request."""
+    if classification_log is not None:
+        classification_log.record(description, result, result["tier"], state["version"], "api",
+                                  time.perf_counter() - started, usage)
+
+async def _classify_events(description: str, state=None):
+    """Classifies via the cheapest tier that can answer: cache, near-duplicate, local index, then LLM.
+
+    Yields ("category" | "subcategory", value) as a streamed LLM answer arrives,
+    then ("result", result). The streamed fields are the model's own words; the
+    result holds the validated `category` and `subcategory` (None when the answer
+    matched nothing in the taxonomy), how they `match`ed (see labels.py), the
+    answering `tier`, a `cached` flag and the `tokens_removed` by pre-processing.
+    A near-duplicate hit also carries `semantic_match`: the similarity and the
+    start of the earlier ticket whose label was reused.
+    """
+    if state is None:
+        _, state = taxonomy_watcher.current()
+    started = time.perf_counter()
+    # Quoted history, signatures and logs are stripped before any tier sees the text
+    ticket = clean_ticket(description)
+    description = ticket["text"]
+    result, confidence = _classify_without_llm(description, state)
+    usage = None
+    if result is None:
+        if LLM_STREAMING:
+            async for field, value in _astream_chain(description, state):
+                if field != "done":
+                    yield field, value
+            response = value["message"]
+            with stage("parse"):
+                label = state["labels"].validate(value["category"], value["subcategory"])
+        else:
+            response = await _ainvoke_chain(description, state)
+            with stage("parse"):
+                label = state["labels"].parse(response.content)
+        usage = getattr(response, "usage_metadata", None)
+        result = _llm_result(description, state, label, confidence)
+    _log_result(description, state, result, started, usage)
+    yield "result", {**result, "tokens_removed": ticket["tokens_removed"]}
+
+async def _classify(description: str, state=None):
+    """Classifies one ticket; returns the result dict of _classify_events()."""
+    async for _, value in _classify_events(description, state):
+        pass
+    return value
+
+async def _classify_packed(descriptions: List[str], concurrency: int):
+    """Classifies a batch, packing the tickets that need the LLM into shared requests.
+
+    Returns one result or exception per description, in input order. Tickets the
+    model skipped or answered malformed are retried one at a time.
+    """
+    from packing import format_tickets, pack_tickets, parse_packed_response
+
+    _, state = taxonomy_watcher.current()
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    results = [None] * len(descriptions)
+    tickets = [clean_ticket(description) for description in descriptions]
+    descriptions = [ticket["text"] for ticket in tickets]
+    confidences = {}
+
+    pending = []
+    for index, description in enumerate(descriptions):
+        result, confidence = _classify_without_llm(description, state)
+        if result is not None:
+            results[index] = result
+            _log_result(description, state, result, started)
+        else:
+            confidences[index] = confidence
+            pending.append((index, description))
+
+    async def run_pack(pack):
+        usage = {}
+        async with semaphore:
+            try:
+                response = await _ainvoke_llm(state["packed_prompt"], {"tickets": format_tickets(pack)}, state)
+                usage = getattr(response, "usage_metadata", None) or {}
+                with stage("parse"):
+                    answers = parse_packed_response(response.content, [index for index, _ in pack])
+            except Exception:
+                answers = {}
+        # The pack's tokens are logged split evenly across its tickets
+        share = {key: round(usage.get(key, 0) / len(pack)) for key in ("input_tokens", "output_tokens")}
+        retry = []
+        for index, description in pack:
+            answer = answers.get(str(index))
+            if answer is None:
+                record_fallback("packed_retry")
+                retry.append((index, description))
+                continue
+            label = state["labels"].validate(answer["category"], answer["subcategory"])
+            results[index] = _llm_result(description, state, label, confidences[index], packed=True)
+            _log_result(description, state, results[index], started, share)
+        return retry
+
+    retries = await asyncio.gather(*(run_pack(pack) for pack in pack_tickets(pending)))
+
+    async def run_single(index, description):
+        async with semaphore:
+            try:
+                response = await _ainvoke_chain(description, state)
+                with stage("parse"):
+                    label = state["labels"].parse(response.content)
+                results[index] = _llm_result(description, state, label, confidences[index])
+                _log_result(description, state, results[index], started, getattr(response, "usage_metadata", None))
+            except Exception as e:
+                results[index] = e
+
+    await asyncio.gather(*(run_single(index, description) for retry in retries for index, description in retry))
+    return [
+        result if isinstance(result, Exception) else {**result, "tokens_removed": ticket["tokens_removed"]}
+        for result, ticket in zip(results, tickets)
+    ]
+
+async def _classify_many(descriptions: List[str], packed: bool = False, concurrency: int = BATCH_MAX_CONCURRENCY):
+    """Classifies a list of tickets; returns one result or exception per description, in order."""
+    if packed:
+        return await _classify_packed(descriptions, concurrency)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # One taxonomy version for the whole batch, even if a new one is published mid-way
+    _, state = taxonomy_watcher.current()
+
+    async def classify_one(description: str):
+        async with semaphore:
+            return await _classify(description, state)
+
+    # return_exceptions keeps one failing ticket from failing the whole batch
+    return await asyncio.gather(
+        *(classify_one(description) for description in descriptions),
+        return_exceptions=True,
+    )
+
 @app.post("/classify")
 async def classify_ticket(req: TicketRequest):
-    response = chain.invoke({
-        "ticket_description": req.description,
-        "category_map": category_map
-    })
-    return {"category": response}
+    try:
+        return await _classify(req.description)
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+@app.post("/classify/stream")
+async def classify_ticket_stream(req: TicketRequest):
+    """Streams NDJSON events: each field as soon as the model has produced it, then the full result."""
+    async def events():
+        try:
+            async for event, value in _classify_events(req.description):
+                body = {"event": event, **value} if event == "result" else {"event": event, "value": value}
+                yield json.dumps(body) + "\n"
+        except Exception as e:
+            # The 200 status is already sent, so failures are reported in the stream
+            status = 504 if isinstance(e, TimeoutError) else 500
+            yield json.dumps({"event": "error", "status": status, "detail": str(e)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+class BatchTicketRequest(BaseModel):
+    tickets: List[TicketRequest] = Field(..., max_length=BATCH_MAX_TICKETS)
+    max_concurrency: Optional[int] = Field(None, ge=1)
+    # Pack several tickets into each LLM request (see packing.py)
+    packed: bool = False
+
+@app.post("/classify/batch")
+async def classify_batch(req: BatchTicketRequest):
+    concurrency = min(req.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    descriptions = [ticket.description for ticket in req.tickets]
+    responses = await _classify_many(descriptions, req.packed, concurrency)
+
+    results = []
+    for index, response in enumerate(responses):
+        if isinstance(response, Exception):
+            results.append({"index": index, "category": None, "subcategory": None, "error": str(response)})
+        else:
+            results.append({"index": index, **response, "error": None})
+    return {"results": results}
+
+class JobRequest(BaseModel):
+    tickets: List[TicketRequest] = Field(..., min_length=1, max_length=JOB_MAX_TICKETS)
+    packed: bool = False
+    # Re-submitting with the same key (or the same tickets) returns the existing job
+    idempotency_key: Optional[str] = Field(None, max_length=200)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(req: JobRequest):
+    queue = get_job_queue()
+    descriptions = [ticket.description for ticket in req.tickets]
+    job_id, created = await asyncio.to_thread(queue.submit, descriptions, req.packed, req.idempotency_key)
+    job_wakeup.set()
+    status = await asyncio.to_thread(queue.status, job_id)
+    return {**status, "resubmitted": not created}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    status = await asyncio.to_thread(get_job_queue().status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return status
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1)):
+    """Pages through a job's tickets in order; items not finished yet are included with their status."""
+    queue = get_job_queue()
+    status = await asyncio.to_thread(queue.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    limit = min(limit, JOB_RESULTS_PAGE_MAX)
+    results = await asyncio.to_thread(queue.results, job_id, offset, limit)
+    next_offset = offset + limit if offset + limit < status["total"] else None
+    return {"job_id": job_id, "status": status["status"], "results": results, "next_offset": next_offset}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    taxonomy, state = taxonomy_watcher.current()
+    semantic = state["semantic"].stats() if state["semantic"] is not None else None
+    return {"taxonomy_version": taxonomy["version"], **result_cache.stats(), "semantic": semantic}
+
+@app.get("/stats")
+async def stats():
+    from llm_client import default_limiter
+
+    taxonomy, state = taxonomy_watcher.current()
+    return {
+        "taxonomy_version": taxonomy["version"],
+        "taxonomy_reloads": taxonomy_watcher.reloads,
+        "cache": result_cache.stats(),
+        "semantic_cache": state["semantic"].stats() if state["semantic"] is not None else None,
+        "tiers": dict(tier_counts),
+        # Snap and reject rates of LLM answers against the taxonomy
+        "labels": label_rates(label_counts),
+        "llm_client": default_limiter().stats(),
+        "classification_log": classification_log.stats() if classification_log is not None else None,
+    }
+
+# Prometheus text format; see metrics.py for what is recorded
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,453 @@
+"""
+Rate-limit-aware wrapper around the chat model.
+
+RateLimitedChatModel wraps any LangChain chat model (Gemini, or the fake from
+fake_llm.py) and is used in its place in the chains. Every call goes through
+the process-wide RateLimiter, which:
+
+  - waits for request and token budgets (token buckets for LLM_RPM and LLM_TPM;
+    0 disables a limit). Tokens are estimated up front and corrected from
+    usage_metadata afterwards.
+  - caps concurrent calls with an AIMD limit: +1 per window of successes, halved
+    on a 429 and cut by 10% when a call is slower than LLM_TARGET_LATENCY_SECONDS,
+    between LLM_MIN_CONCURRENCY and LLM_MAX_CONCURRENCY
+  - retries 429s and transient server errors up to LLM_MAX_RETRIES times with
+    full-jitter exponential backoff
+  - optionally hedges (async calls only): if a call has not answered after
+    LLM_HEDGE_AFTER_SECONDS (a number, or "auto" for the recent p95), a duplicate
+    is sent if the request budget allows, the first answer wins and the slower
+    call is cancelled
+
+Streaming calls (see streaming.py) go through the same budgets, concurrency
+limit and retries, except that a stream is not retried once it has produced
+output and is never hedged.
+
+The inner model should not retry on its own (ChatGoogleGenerativeAI max_retries=1),
+otherwise throttling never reaches the limiter.
+"""
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from metrics import registry
+from tokens import count_tokens
+
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_TARGET_LATENCY_SECONDS = float(os.getenv("LLM_TARGET_LATENCY_SECONDS", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+# Unset/"off" disables hedging; "auto" hedges after the recent p95 latency
+LLM_HEDGE_AFTER_SECONDS = os.getenv("LLM_HEDGE_AFTER_SECONDS", "off")
+# Minimum time between two decreases of the concurrency limit
+DECREASE_COOLDOWN_SECONDS = 1.0
+# Output tokens reserved per call before the real usage is known
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "50"))
+
+_RATE_LIMIT = re.compile(r"\b429\b|resource has been exhausted|resource_exhausted|rate limit|quota", re.IGNORECASE)
+_TRANSIENT = re.compile(r"\b(500|502|503|504)\b|unavailable|deadline exceeded|internal error", re.IGNORECASE)
+
+
+def _status(exc):
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return int(value)
+    return None
+
+
+def is_rate_limit(exc):
+    """True for provider throttling (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    return _status(exc) == 429 or type(exc).__name__ in ("ResourceExhausted", "RateLimitError") \
+        or bool(_RATE_LIMIT.search(str(exc)))
+
+
+def is_retryable(exc):
+    """True for throttling and transient server or connection errors."""
+    if is_rate_limit(exc) or isinstance(exc, ConnectionError):
+        return True
+    status = _status(exc)
+    return status in (500, 502, 503, 504) if status is not None else bool(_TRANSIENT.search(str(exc)))
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to `capacity` (one minute's worth by default).
+
+    reserve() takes units immediately, going into debt if needed, and returns how
+    long the caller must wait before using them; waits therefore queue up fairly.
+    A bucket with per_minute <= 0 never limits.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.per_second = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.per_second <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def reserve(self, amount):
+        if self.unlimited:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # A single call larger than the bucket must still be able to go through
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.per_second)
+
+    def try_take(self, amount):
+        """Takes units only if they are available right now."""
+        if self.unlimited:
+            return True
+        with self._lock:
+            self._refill()
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def consume(self, amount):
+        """Records units used beyond the reservation (may go into debt)."""
+        if self.unlimited or not amount:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit shared by threads (sync calls) and event loops (async calls)."""
+
+    def __init__(self, minimum=LLM_MIN_CONCURRENCY, maximum=LLM_MAX_CONCURRENCY,
+                 target_latency=LLM_TARGET_LATENCY_SECONDS):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.target_latency = target_latency
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._waiters = deque()
+
+    def _has_room(self):
+        return self.in_flight < int(self.limit)
+
+    def acquire_sync(self):
+        with self._condition:
+            while not self._has_room():
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._has_room():
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append(waiter)
+            await waiter
+
+    def release(self, latency=None, throttled=False):
+        """Frees a slot; latency is given for successful calls only."""
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            # Calls already in flight when the limit dropped must not cut it again
+            can_decrease = now - self._last_decrease > DECREASE_COOLDOWN_SECONDS
+            if throttled and can_decrease:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+            elif self.target_latency and latency is not None and latency > self.target_latency and can_decrease:
+                self.limit = max(self.minimum, self.limit * 0.9)
+                self._last_decrease = now
+            elif latency is not None and not throttled:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RateLimiter:
+    """Request/token budgets, adaptive concurrency, retries and hedging for LLM calls."""
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, concurrency=None, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE_SECONDS, backoff_max=LLM_BACKOFF_MAX_SECONDS,
+                 hedge_after=LLM_HEDGE_AFTER_SECONDS, expected_output_tokens=EXPECTED_OUTPUT_TOKENS):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = str(hedge_after).strip().lower()
+        self.expected_output_tokens = expected_output_tokens
+        self.latencies = deque(maxlen=200)
+        self.counts = Counter()
+        self._random = random.Random()
+
+    def stats(self):
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            **{key: self.counts[key] for key in ("calls", "throttled", "retries", "hedges", "hedge_wins")},
+        }
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+        return self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a duplicate call, or None to not hedge."""
+        if self.hedge_after in ("", "off", "0", "none"):
+            return None
+        if self.hedge_after == "auto":
+            if len(self.latencies) < 20:
+                return None
+            ordered = sorted(self.latencies)
+            return ordered[int(0.95 * (len(ordered) - 1))]
+        return float(self.hedge_after)
+
+    def _wait_time(self, estimate):
+        return max(self.requests.reserve(1), self.tokens.reserve(estimate))
+
+    def _finish(self, start, exc=None):
+        latency = time.monotonic() - start
+        throttled = exc is not None and is_rate_limit(exc)
+        if exc is None:
+            self.latencies.append(latency)
+        if throttled:
+            self.counts["throttled"] += 1
+            registry.inc("ticket_llm_throttled_total")
+        self.concurrency.release(latency if exc is None else None, throttled)
+
+    def _retry_or_raise(self, exc, attempt):
+        """Returns the backoff before the next attempt, or re-raises exc."""
+        if attempt >= self.max_retries or not is_retryable(exc):
+            raise exc
+        self.counts["retries"] += 1
+        registry.inc("ticket_llm_retries_total", reason="rate_limit" if is_rate_limit(exc) else "error")
+        return self.backoff(attempt)
+
+    def reconcile(self, message, estimate):
+        """Charges the token bucket for usage beyond the up-front estimate."""
+        usage = getattr(message, "usage_metadata", None) or {}
+        actual = usage.get("total_tokens") or 0
+        self.tokens.consume(actual - estimate if actual > estimate else 0)
+
+    def run(self, call, estimate):
+        """Runs call() under the limits, retrying transient failures (no hedging)."""
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._wait_time(estimate))
+            self.concurrency.acquire_sync()
+            self.counts["calls"] += 1
+            start = time.monotonic()
+            try:
+                result = call()
+            except Exception as exc:
+                self._finish(start, exc)
+                time.sleep(self._retry_or_raise(exc, attempt))
+                continue
+            self._finish(start)
+            self.reconcile(result, estimate)
+            return result
+
+    async def arun(self, make_call, estimate):
+        """Awaits make_call() under the limits, retrying transient failures and hedging slow calls."""
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._wait_time(estimate))
+            await self.concurrency.acquire()
+            self.counts["calls"] += 1
+            start = time.monotonic()
+            try:
+                result = await self._hedged(make_call, estimate)
+            except Exception as exc:
+                self._finish(start, exc)
+                await asyncio.sleep(self._retry_or_raise(exc, attempt))
+                continue
+            except BaseException:
+                # Cancelled (e.g. the request timed out): free the slot, adjust nothing
+                self.concurrency.release()
+                raise
+            self._finish(start)
+            self.reconcile(result, estimate)
+            return result
+
+    def stream(self, make_stream, estimate):
+        """Yields from make_stream() under the limits.
+
+        Only failures before the first chunk are retried; a stream closed early
+        by the caller counts as a success.
+        """
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._wait_time(estimate))
+            self.concurrency.acquire_sync()
+            self.counts["calls"] += 1
+            start, received, chunks = time.monotonic(), None, make_stream()
+            try:
+                for chunk in chunks:
+                    received = chunk if received is None else received + chunk
+                    yield chunk
+            except GeneratorExit:
+                self._finish(start)
+                raise
+            except Exception as exc:
+                self._finish(start, exc)
+                if received is not None:
+                    raise
+                time.sleep(self._retry_or_raise(exc, attempt))
+                continue
+            finally:
+                # Passes an early close on to the model's stream, which ends the provider call
+                chunks.close()
+            self._finish(start)
+            self.reconcile(received, estimate)
+            return
+
+    async def astream(self, make_stream, estimate):
+        """Async stream(); streams are never hedged."""
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._wait_time(estimate))
+            await self.concurrency.acquire()
+            self.counts["calls"] += 1
+            start, received, chunks = time.monotonic(), None, make_stream()
+            try:
+                async for chunk in chunks:
+                    received = chunk if received is None else received + chunk
+                    yield chunk
+            except GeneratorExit:
+                self._finish(start)
+                raise
+            except Exception as exc:
+                self._finish(start, exc)
+                if received is not None:
+                    raise
+                await asyncio.sleep(self._retry_or_raise(exc, attempt))
+                continue
+            except BaseException:
+                self.concurrency.release()
+                raise
+            finally:
+                await chunks.aclose()
+            self._finish(start)
+            self.reconcile(received, estimate)
+            return
+
+    async def _hedged(self, make_call, estimate):
+        primary, hedge = asyncio.ensure_future(make_call()), None
+        delay = self.hedge_delay()
+        if delay is None:
+            return await primary
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            # The duplicate must fit the budgets right now; hedging never queues
+            if done or not self.requests.try_take(1) or not self.tokens.try_take(estimate):
+                return await primary
+            self.counts["hedges"] += 1
+            hedge = asyncio.ensure_future(make_call())
+            pending, error = {primary, hedge}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is hedge
+                        self.counts["hedge_wins"] += won
+                        registry.inc("ticket_llm_hedges_total", outcome="hedge_won" if won else "primary_won")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+
+@lru_cache(maxsize=None)
+def default_limiter():
+    """Process-wide limiter, so every chain in the process shares one quota."""
+    return RateLimiter()
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """Chat model that sends every call through a RateLimiter."""
+
+    model: BaseChatModel
+    # None uses the process-wide default_limiter()
+    limiter: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate-limited-{self.model._llm_type}"
+
+    def _limiter(self):
+        return self.limiter or default_limiter()
+
+    def _estimate(self, messages):
+        return count_tokens("\n".join(str(m.content) for m in messages)) + self._limiter().expected_output_tokens
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._limiter().run(
+            lambda: self.model.invoke(messages, stop=stop, **kwargs), self._estimate(messages)
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = await self._limiter().arun(
+            lambda: self.model.ainvoke(messages, stop=stop, **kwargs), self._estimate(messages)
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = self._limiter().stream(
+            lambda: self.model.stream(messages, stop=stop, **kwargs), self._estimate(messages)
+        )
+        try:
+            for chunk in chunks:
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            chunks.close()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = self._limiter().astream(
+            lambda: self.model.astream(messages, stop=stop, **kwargs), self._estimate(messages)
+        )
+        try:
+            async for chunk in chunks:
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            await chunks.aclose()
+
+
+def rate_limited(model, limiter=None):
+    """Wraps a chat model in RateLimitedChatModel (no-op if it already is one)."""
+    if isinstance(model, RateLimitedChatModel):
+        return model
+    return RateLimitedChatModel(model=model, limiter=limiter)
@@ -0,0 +1,287 @@
+"""
+In-process metrics for the classifier entry points.
+
+Counters and latency histograms live in a process-wide registry (`registry`).
+lambdaapp.py records every classification into it and serves it at /metrics
+in the Prometheus text format; the Streamlit pages record into their own
+process and pages/Metrics.py charts either one.
+
+What is recorded:
+
+  ticket_stage_seconds{stage}                      preprocess, prompt build, LLM call and parse timings
+  ticket_request_seconds{path,status}              end-to-end HTTP request latency (FastAPI)
+  ticket_classifications_total{tier,taxonomy_version}  tickets answered per tier (cache/semantic/local/llm)
+  ticket_cache_lookups_total{result}               result cache hits and misses
+  ticket_semantic_lookups_total{result}            near-duplicate cache hits and misses (semantic_cache.py)
+  ticket_fallbacks_total{reason}                   tickets sent on to a slower path
+  ticket_llm_tokens_total{direction,taxonomy_version}  input/output tokens from usage_metadata
+  ticket_preprocess_tokens_total{result}           description tokens kept/removed by preprocess.py
+  ticket_label_validations_total{result}           LLM labels exact/normalized/subcategory/snapped/rejected (labels.py)
+  ticket_errors_total{kind}                        timeouts and failed LLM calls
+  ticket_llm_throttled_total                       429s from the provider (see llm_client.py)
+  ticket_llm_retries_total{reason}                 retried LLM calls
+  ticket_llm_hedges_total{outcome}                 hedged calls and which copy answered first
+  ticket_llm_streams_total{outcome}                streamed answers closed early or read to the end
+"""
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from cache hits to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "ticket_stage_seconds": "Time spent per classification stage",
+    "ticket_request_seconds": "End-to-end HTTP request latency",
+    "ticket_classifications_total": "Tickets classified, by answering tier",
+    "ticket_cache_lookups_total": "Result cache lookups",
+    "ticket_semantic_lookups_total": "Near-duplicate cache lookups",
+    "ticket_fallbacks_total": "Tickets passed on to a slower path",
+    "ticket_llm_tokens_total": "LLM tokens reported in usage_metadata",
+    "ticket_preprocess_tokens_total": "Ticket description tokens kept and removed by pre-processing",
+    "ticket_label_validations_total": "LLM answers checked against the taxonomy, by outcome",
+    "ticket_errors_total": "Classification errors",
+    "ticket_llm_throttled_total": "LLM calls rejected with 429",
+    "ticket_llm_retries_total": "LLM calls retried",
+    "ticket_llm_hedges_total": "Hedged LLM calls, by which copy answered first",
+    "ticket_llm_streams_total": "Streamed LLM answers, by whether the stream was closed early",
+}
+
+
+class MetricsRegistry:
+    """Thread-safe counters and fixed-bucket histograms keyed by name and labels."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            # Last slot is the +Inf bucket
+            slot = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            histogram["counts"][slot] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of the with-block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Returns {"counters": [...], "histograms": [...]} with labels as dicts.
+
+        Histogram buckets are cumulative (le, count) pairs, as in Prometheus.
+        """
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = []
+            for (name, labels), h in sorted(self._histograms.items()):
+                cumulative, buckets = 0, []
+                for bound, count in zip(self.buckets + (math.inf,), h["counts"]):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                histograms.append({"name": name, "labels": dict(labels), "buckets": buckets,
+                                   "sum": h["sum"], "count": h["count"]})
+        return {"counters": counters, "histograms": histograms}
+
+    def render(self):
+        """Renders the registry in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines, described = [], set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for c in snapshot["counters"]:
+            header(c["name"], "counter")
+            lines.append(f"{c['name']}{_format_labels(c['labels'])} {_format_value(c['value'])}")
+        for h in snapshot["histograms"]:
+            header(h["name"], "histogram")
+            for bound, count in h["buckets"]:
+                labels = {**h["labels"], "le": "+Inf" if bound == math.inf else _format_value(bound)}
+                lines.append(f"{h['name']}_bucket{_format_labels(labels)} {count}")
+            lines.append(f"{h['name']}_sum{_format_labels(h['labels'])} {_format_value(h['sum'])}")
+            lines.append(f"{h['name']}_count{_format_labels(h['labels'])} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_prometheus(text):
+    """Parses Prometheus text (as served by /metrics) into the snapshot() shape."""
+    types, counters, histograms = {}, [], {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(maxsplit=3)
+            types[name] = kind
+            continue
+        match = _SAMPLE.match(line)
+        if not match or line.startswith("#"):
+            continue
+        name, raw_labels, raw_value = match.groups()
+        labels = {k: v.replace('\\"', '"').replace("\\n", "\n").replace("\\\\", "\\")
+                  for k, v in _LABEL.findall(raw_labels or "")}
+        value = float(raw_value)
+
+        base = re.sub(r"_(bucket|sum|count)$", "", name)
+        if types.get(base) == "histogram" and base != name:
+            le = labels.pop("le", None)
+            h = histograms.setdefault((base, tuple(sorted(labels.items()))),
+                                      {"name": base, "labels": labels, "buckets": [], "sum": 0.0, "count": 0})
+            if name.endswith("_bucket"):
+                h["buckets"].append((math.inf if le == "+Inf" else float(le), int(value)))
+            elif name.endswith("_sum"):
+                h["sum"] = value
+            else:
+                h["count"] = int(value)
+        else:
+            counters.append({"name": name, "labels": labels, "value": value})
+    return {"counters": counters, "histograms": list(histograms.values())}
+
+
+def histogram_quantile(buckets, q):
+    """Estimates a quantile from cumulative (le, count) buckets by linear interpolation."""
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    rank, lower, below = q * total, 0.0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == math.inf:
+                return lower
+            in_bucket = cumulative - below
+            return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 1)
+        lower, below = bound, cumulative
+    return lower
+
+
+# ---------- Process-wide registry and recording helpers ----------
+registry = MetricsRegistry()
+
+
+class RequestLatencyMiddleware:
+    """ASGI middleware recording ticket_request_seconds per route and status.
+
+    Plain ASGI rather than @app.middleware("http"), which roughly doubled the
+    cost of a cache-hit request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start, status = time.perf_counter(), 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in scope; its template (e.g.
+            # /jobs/{job_id}) keeps the label set small
+            route = scope.get("route")
+            registry.observe("ticket_request_seconds", time.perf_counter() - start,
+                             path=getattr(route, "path", scope["path"]), status=status)
+
+
+def stage(name):
+    """Times one classification stage: 'preprocess', 'prompt', 'llm' or 'parse'."""
+    return registry.timer("ticket_stage_seconds", stage=name)
+
+
+def record_tier(tier, taxonomy_version):
+    registry.inc("ticket_classifications_total", tier=tier, taxonomy_version=taxonomy_version)
+
+
+def record_cache_lookup(hit):
+    registry.inc("ticket_cache_lookups_total", result="hit" if hit else "miss")
+
+
+def record_semantic_lookup(hit):
+    registry.inc("ticket_semantic_lookups_total", result="hit" if hit else "miss")
+
+
+def record_fallback(reason):
+    registry.inc("ticket_fallbacks_total", reason=reason)
+
+
+def record_stream(early_exit):
+    registry.inc("ticket_llm_streams_total", outcome="early_exit" if early_exit else "complete")
+
+
+def record_label(match):
+    registry.inc("ticket_label_validations_total", result=match)
+
+
+def record_error(kind):
+    registry.inc("ticket_errors_total", kind=kind)
+
+
+def record_tokens(response, taxonomy_version):
+    """Adds the input/output tokens from a LangChain response's usage_metadata."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    for direction in ("input", "output"):
+        tokens = usage.get(f"{direction}_tokens")
+        if tokens:
+            registry.inc("ticket_llm_tokens_total", tokens, direction=direction, taxonomy_version=taxonomy_version)
+
+
+def record_preprocess(report):
+    """Adds the token counts of one preprocess_ticket() report."""
+    registry.inc("ticket_preprocess_tokens_total", report["tokens_after"], result="kept")
+    if report["tokens_removed"]:
+        registry.inc("ticket_preprocess_tokens_total", report["tokens_removed"], result="removed")
@@ -0,0 +1,104 @@
+"""
+Multi-ticket prompt packing.
+
+Sending one short ticket per call means re-paying for the large system prompt
+(taxonomy plus instructions) every time. In packing mode several tickets share
+one LLM request: each ticket is sent with an id and the model answers with a
+JSON array holding one {"id", "category", "subcategory"} object per ticket.
+
+How many tickets go into one request is decided by a token budget measured
+with the tiktoken encoder (see tokens.py). Tickets the model skipped or
+answered malformed are returned as missing so the caller can retry them one
+at a time.
+"""
+import json
+import os
+import re
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from tokens import count_tokens
+
+# Ticket tokens allowed in one packed request (the shared system prompt is not counted)
+PACK_TOKEN_BUDGET = int(os.getenv("PACK_TOKEN_BUDGET", "3000"))
+# Hard cap on tickets per request, which also bounds the size of the JSON answer
+PACK_MAX_TICKETS = int(os.getenv("PACK_MAX_TICKETS", "25"))
+# Tokens taken by the JSON wrapping of each ticket ({"id": ..., "text": ...})
+PER_TICKET_OVERHEAD = 12
+
+packed_prompt = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert IT ticket classifier.
+
+Classify every ticket you are given using only these categories:
+{category_map}
+
+The tickets arrive as a JSON array of objects with "id" and "text".
+Respond with only a JSON array containing exactly one object per ticket, in any order:
+[{{"id": "<ticket id>", "category": "<category>", "subcategory": "<subcategory>"}}]
+"""),
+    ("human", "{tickets}"),
+])
+
+
+def pack_tickets(tickets, budget=PACK_TOKEN_BUDGET, max_tickets=PACK_MAX_TICKETS):
+    """Greedily groups (id, text) pairs into packs that fit the token budget.
+
+    A ticket that is larger than the budget on its own gets a pack to itself.
+    """
+    packs, current, used = [], [], 0
+    for ticket_id, text in tickets:
+        cost = count_tokens(text) + PER_TICKET_OVERHEAD
+        if current and (used + cost > budget or len(current) >= max_tickets):
+            packs.append(current)
+            current, used = [], 0
+        current.append((ticket_id, text))
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def format_tickets(pack):
+    """Renders a pack as the JSON array sent in the human message."""
+    return json.dumps([{"id": str(ticket_id), "text": text} for ticket_id, text in pack], ensure_ascii=False)
+
+
+_JSON_ARRAY = re.compile(r"\[.*\]", re.DOTALL)
+
+
+def parse_packed_response(content, ids):
+    """Returns {id: {"category", "subcategory"}} for the well-formed answers in content.
+
+    Answers with unknown ids, duplicate ids or missing fields are dropped, so the
+    caller can treat every id absent from the result as needing a retry.
+    """
+    match = _JSON_ARRAY.search(content if isinstance(content, str) else str(content))
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    expected = {str(i) for i in ids}
+    answers, seen = {}, set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        ticket_id = str(item.get("id", ""))
+        category = item.get("category")
+        subcategory = item.get("subcategory")
+        if ticket_id not in expected or not isinstance(category, str) or not category.strip():
+            continue
+        if ticket_id in seen:
+            # Conflicting answers for the same ticket: trust neither
+            answers.pop(ticket_id, None)
+            continue
+        seen.add(ticket_id)
+        answers[ticket_id] = {
+            "category": category.strip(),
+            "subcategory": subcategory.strip() if isinstance(subcategory, str) else "",
+        }
+    return answers
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import time
+from itertools import islice
+
+import pandas as pd
+import streamlit as st
+from dotenv import load_dotenv
+
+from metrics import record_error, record_tier, record_tokens, stage
+from preprocess import clean_ticket
+from ticket_classifier import (
+    classify_without_llm, get_chain, get_classification_log, get_taxonomy_watcher, parse_classification, store_result,
+)
+
+load_dotenv()
+
+# --- Constants ---
+JOBS_DIR = "bulk_jobs"
+JOB_FILE = "job.json"
+PROGRESS_FILE = "progress.json"
+RESULTS_FILE = "results.csv"
+RESULT_COLUMNS = ["category", "subcategory", "tier", "tokens_removed", "error"]
+DEFAULT_CHUNK_SIZE = 200
+
+os.makedirs(JOBS_DIR, exist_ok=True)
+
+
+# --- Job files ---
+def write_json(path, data):
+    """Writes JSON through a temp file so a crash never leaves a half-written file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_csv(name):
+    return name.lower().endswith(".csv")
+
+
+def read_header(source, csv):
+    """Returns the column names of a CSV/XLSX file (path or file object) without loading its rows."""
+    if csv:
+        return list(pd.read_csv(source, nrows=0).columns)
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True)
+    try:
+        header = next(workbook.active.iter_rows(values_only=True), ())
+        return [str(c) for c in header]
+    finally:
+        workbook.close()
+
+
+def iter_chunks(path, chunk_size):
+    """Streams a CSV/XLSX file as DataFrames of at most chunk_size rows."""
+    if is_csv(path):
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+        return
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(c) for c in next(rows, ())]
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=header).fillna("").astype(str)
+    finally:
+        workbook.close()
+
+
+def count_rows(path):
+    """Counts data rows by streaming the file once."""
+    return sum(len(chunk) for chunk in iter_chunks(path, 5000))
+
+
+def create_job(uploaded_file, column):
+    """Stores the upload under bulk_jobs/<hash>/; re-uploading the same file resumes that job."""
+    data = uploaded_file.getvalue()
+    job_id = hashlib.sha256(data + column.encode("utf-8")).hexdigest()[:16]
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    if not os.path.exists(os.path.join(job_dir, JOB_FILE)):
+        os.makedirs(job_dir, exist_ok=True)
+        extension = ".csv" if is_csv(uploaded_file.name) else ".xlsx"
+        input_path = os.path.join(job_dir, f"input{extension}")
+        with open(input_path, "wb") as f:
+            f.write(data)
+        write_json(os.path.join(job_dir, JOB_FILE), {
+            "name": uploaded_file.name,
+            "input": input_path,
+            "column": column,
+            "total": count_rows(input_path),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    return job_id
+
+
+# --- Classification ---
+def classify_chunk(descriptions, taxonomy, index, concurrency):
+    """Classifies one chunk: cache/near-duplicate/local tiers first, the rest concurrently through the LLM."""
+    started = time.perf_counter()
+    classification_log = get_classification_log()
+    descriptions = list(descriptions)
+    results = [None] * len(descriptions)
+    pending = []
+    removed = [0] * len(descriptions)
+    for i, description in enumerate(descriptions):
+        if not description.strip():
+            results[i] = {"category": "", "subcategory": "", "tier": "", "tokens_removed": 0,
+                          "error": "empty description"}
+            continue
+        # Quoted replies, signatures and pasted logs are stripped first (see preprocess.py)
+        ticket = clean_ticket(description)
+        descriptions[i], removed[i] = ticket["text"], ticket["tokens_removed"]
+        result, tier, _ = classify_without_llm(descriptions[i], taxonomy, index)
+        if result is not None:
+            results[i] = {**result, "tier": tier, "tokens_removed": removed[i], "error": ""}
+            if classification_log is not None:
+                classification_log.record(descriptions[i], result, tier, taxonomy["version"], "bulk",
+                                          time.perf_counter() - started)
+        else:
+            pending.append(i)
+
+    # The pooled chain for this taxonomy version, shared with the other pages; no chat history in bulk
+    responses = get_chain(taxonomy, history=False).batch(
+        [{"ticket_description": descriptions[i]} for i in pending],
+        config={"max_concurrency": concurrency},
+        return_exceptions=True,
+    )
+    for i, response in zip(pending, responses):
+        if isinstance(response, Exception):
+            record_error("llm")
+            results[i] = {"category": "", "subcategory": "", "tier": "llm", "tokens_removed": removed[i],
+                          "error": str(response)}
+            continue
+        record_tokens(response, taxonomy["version"])
+        record_tier("llm", taxonomy["version"])
+        with stage("parse"):
+            label = parse_classification(getattr(response, "content", str(response)), taxonomy)
+        if label.match == "rejected":
+            # Not cached, so a later run asks again
+            results[i] = {"category": "", "subcategory": "", "tier": "llm", "tokens_removed": removed[i],
+                          "error": f"label not in taxonomy: {label.raw}"}
+            continue
+        store_result(descriptions[i], taxonomy, label.as_dict())
+        results[i] = {"category": label.category, "subcategory": label.subcategory, "tier": "llm",
+                      "tokens_removed": removed[i], "error": ""}
+        if classification_log is not None:
+            # Latency of an LLM row is the time until its concurrent batch finished
+            classification_log.record(descriptions[i], label.as_dict(), "llm", taxonomy["version"], "bulk",
+                                      time.perf_counter() - started, getattr(response, "usage_metadata", None))
+    return results
+
+
+def run_job(job_dir, chunk_size, concurrency):
+    """Processes a job from its last checkpoint, appending each finished chunk to results.csv."""
+    job = read_json(os.path.join(job_dir, JOB_FILE))
+    progress_path = os.path.join(job_dir, PROGRESS_FILE)
+    results_path = os.path.join(job_dir, RESULTS_FILE)
+    progress = read_json(progress_path, {"rows_done": 0, "results_bytes": 0})
+
+    # Drop anything written after the last checkpoint (e.g. a crash mid-append)
+    if os.path.exists(results_path):
+        with open(results_path, "r+b") as f:
+            f.truncate(progress["results_bytes"])
+
+    total = max(job["total"], 1)
+    progress_bar = st.progress(min(progress["rows_done"] / total, 1.0))
+    status = st.empty()
+    started, processed = time.perf_counter(), 0
+
+    rows_seen = 0
+    for chunk in iter_chunks(job["input"], chunk_size):
+        # Skip rows already classified by an earlier run
+        chunk_start, rows_seen = rows_seen, rows_seen + len(chunk)
+        if rows_seen <= progress["rows_done"]:
+            continue
+        chunk = chunk.iloc[max(0, progress["rows_done"] - chunk_start):]
+
+        # Re-read every chunk so a newly published taxonomy is picked up mid-job
+        taxonomy, index = get_taxonomy_watcher().current()
+        results = classify_chunk(chunk[job["column"]].astype(str).tolist(), taxonomy, index, concurrency)
+        output = chunk.assign(**{col: [r[col] for r in results] for col in RESULT_COLUMNS})
+        output.to_csv(results_path, mode="a", index=False, header=progress["results_bytes"] == 0)
+
+        progress = {"rows_done": progress["rows_done"] + len(chunk), "results_bytes": os.path.getsize(results_path)}
+        write_json(progress_path, progress)
+
+        processed += len(chunk)
+        elapsed = time.perf_counter() - started
+        progress_bar.progress(min(progress["rows_done"] / total, 1.0))
+        status.markdown(
+            f"**{progress['rows_done']:,} / {job['total']:,}** rows · "
+            f"{processed / elapsed:.1f} rows/s · elapsed {elapsed:.0f}s"
+        )
+    return progress
+
+
+# --- Streamlit App ---
+st.title("📦 Bulk Ticket Classification")
+st.caption("Classify CSV/XLSX ticket exports in chunks. Progress is checkpointed to disk, "
+           "so a refresh or crash resumes where it stopped.")
+
+uploaded_file = st.file_uploader("Upload ticket file", type=["csv", "xlsx"])
+job_id = None
+
+if uploaded_file:
+    columns = read_header(uploaded_file, is_csv(uploaded_file.name))
+    uploaded_file.seek(0)
+    default = next((i for i, c in enumerate(columns) if "desc" in c.lower()), 0)
+    column = st.selectbox("Ticket description column", columns, index=default)
+    if st.button("📥 Create / resume job"):
+        st.session_state["bulk_job_id"] = create_job(uploaded_file, column)
+
+# Existing jobs on disk (most recent first), so work can resume after a refresh
+jobs = sorted(
+    (d for d in os.listdir(JOBS_DIR) if os.path.exists(os.path.join(JOBS_DIR, d, JOB_FILE))),
+    key=lambda d: os.path.getmtime(os.path.join(JOBS_DIR, d, JOB_FILE)),
+    reverse=True,
+)
+if jobs:
+    current = st.session_state.get("bulk_job_id")
+    job_id = st.selectbox(
+        "Job", jobs,
+        index=jobs.index(current) if current in jobs else 0,
+        format_func=lambda d: f"{read_json(os.path.join(JOBS_DIR, d, JOB_FILE))['name']} ({d})",
+    )
+
+if job_id:
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    job = read_json(os.path.join(job_dir, JOB_FILE))
+    progress = read_json(os.path.join(job_dir, PROGRESS_FILE), {"rows_done": 0, "results_bytes": 0})
+    st.metric("Rows classified", f"{progress['rows_done']:,} / {job['total']:,}")
+
+    col1, col2 = st.columns(2)
+    chunk_size = col1.number_input("Chunk size", min_value=10, max_value=5000, value=DEFAULT_CHUNK_SIZE, step=10)
+    concurrency = col2.slider("Concurrent LLM calls", min_value=1, max_value=32, value=8)
+
+    if progress["rows_done"] < job["total"]:
+        if st.button("▶️ Start / resume classification"):
+            progress = run_job(job_dir, int(chunk_size), concurrency)
+            st.success("✅ Job complete")
+
+    results_path = os.path.join(job_dir, RESULTS_FILE)
+    if os.path.exists(results_path) and progress["rows_done"]:
+        # Served straight from disk; the result set never goes into session state
+        with open(results_path, "rb") as f:
+            st.download_button(
+                "⬇️ Download results (CSV)", f,
+                file_name=f"{os.path.splitext(job['name'])[0]}_classified.csv",
+                mime="text/csv",
+            )
@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import streamlit as st
+
+from classification_log import CLASSIFICATION_LOG_DIR, PARTITION, open_dataset, partitions
+from metrics import LATENCY_BUCKETS, histogram_quantile
+from ticket_classifier import get_classification_log
+
+# --- Constants ---
+# USD per million tokens; the defaults are Gemini 1.5 Flash list prices for prompts up to 128k tokens
+INPUT_PRICE_PER_MTOK = float(os.getenv("LLM_INPUT_PRICE_PER_MTOK", "0.075"))
+OUTPUT_PRICE_PER_MTOK = float(os.getenv("LLM_OUTPUT_PRICE_PER_MTOK", "0.30"))
+# Only these columns are read; the others are never paged in
+QUERY_COLUMNS = ["date", "category", "subcategory", "tier", "input_tokens", "output_tokens", "latency_ms",
+                 "taxonomy_version"]
+LATENCY_BOUNDS = list(LATENCY_BUCKETS) + [float("inf")]
+TOP_CATEGORIES = 20
+
+
+# --- Queries ---
+def log_signature(directory, days):
+    """Files per day in the range; the log is append-only, so this changes whenever new rows land."""
+    signature = []
+    for day in days:
+        names = os.listdir(os.path.join(directory, f"{PARTITION}={day}"))
+        signature.append((day, sum(not name.startswith(".") for name in names)))
+    return tuple(signature)
+
+
+@st.cache_data(show_spinner="Querying classification log...")
+def query_log(directory, start, end, signature):
+    """Category counts, per-day tier counts and tokens, and latency histograms for [start, end].
+
+    Scans the memory-mapped files one record batch at a time and merges partial
+    aggregates, so memory stays flat however large the log grows; days outside
+    the range are skipped without opening their files.
+    """
+    dataset = open_dataset(directory)
+    in_range = (ds.field(PARTITION) >= start) & (ds.field(PARTITION) <= end)
+    categories, daily, latency = [], [], {}
+    for batch in dataset.to_batches(columns=QUERY_COLUMNS, filter=in_range):
+        if not batch.num_rows:
+            continue
+        table = pa.Table.from_batches([batch])
+        categories.append(
+            table.group_by(["category", "subcategory"], use_threads=False)
+            .aggregate([("latency_ms", "count")]).to_pandas()
+        )
+        daily.append(
+            table.group_by([PARTITION, "tier", "taxonomy_version"], use_threads=False)
+            .aggregate([("latency_ms", "count"), ("input_tokens", "sum"), ("output_tokens", "sum")]).to_pandas()
+        )
+        tiers = table.column("tier").to_numpy()
+        seconds = table.column("latency_ms").to_numpy() / 1000
+        for tier in np.unique(tiers):
+            counts = np.bincount(np.searchsorted(LATENCY_BOUNDS, seconds[tiers == tier]), minlength=len(LATENCY_BOUNDS))
+            latency[tier] = latency.get(tier, 0) + counts
+    if not daily:
+        return None
+
+    categories = (pd.concat(categories).rename(columns={"latency_ms_count": "tickets"})
+                  .groupby(["category", "subcategory"], dropna=False, as_index=False).sum())
+    daily = (pd.concat(daily)
+             .rename(columns={"latency_ms_count": "tickets", "input_tokens_sum": "input_tokens",
+                              "output_tokens_sum": "output_tokens"})
+             .groupby([PARTITION, "tier", "taxonomy_version"], as_index=False).sum())
+    latency = pd.DataFrame([{
+        "tier": tier,
+        "tickets": int(counts.sum()),
+        # Estimated from the metrics.py bucket bounds, so only as precise as the buckets
+        **{f"p{q} ms": 1000 * (histogram_quantile(list(zip(LATENCY_BOUNDS, np.cumsum(counts))), q / 100) or 0)
+           for q in (50, 95, 99)},
+    } for tier, counts in sorted(latency.items())]).round(1)
+    return {"categories": categories, "daily": daily, "latency": latency}
+
+
+def cost(frame, input_price, output_price):
+    return (frame["input_tokens"] * input_price + frame["output_tokens"] * output_price) / 1_000_000
+
+
+# --- Streamlit App ---
+st.title("🗂️ Classification Log")
+st.caption("Every classified ticket, from this app and the API, read from the append-only Parquet log "
+           f"in '{CLASSIFICATION_LOG_DIR}' without calling the LLM again.")
+
+classification_log = get_classification_log()
+if classification_log is None:
+    st.info("Logging is disabled in this process (CLASSIFICATION_LOG=off); showing what is already on disk.")
+else:
+    # Results of this process still in the write buffer
+    classification_log.flush()
+
+days = partitions()
+if not days:
+    st.info("No classifications logged yet.")
+    st.stop()
+
+start, end = st.select_slider("Days", options=days, value=(days[0], days[-1])) if len(days) > 1 else (days[0],) * 2
+input_price = st.sidebar.number_input("Input price (USD / 1M tokens)", min_value=0.0, value=INPUT_PRICE_PER_MTOK,
+                                      format="%.4f")
+output_price = st.sidebar.number_input("Output price (USD / 1M tokens)", min_value=0.0, value=OUTPUT_PRICE_PER_MTOK,
+                                       format="%.4f")
+
+selected = [day for day in days if start <= day <= end]
+summary = query_log(CLASSIFICATION_LOG_DIR, start, end, log_signature(CLASSIFICATION_LOG_DIR, selected))
+if summary is None:
+    st.info("No classifications logged in this range.")
+    st.stop()
+
+daily = summary["daily"].assign(cost=lambda frame: cost(frame, input_price, output_price))
+tickets = daily["tickets"].sum()
+llm_tickets = daily.loc[daily["tier"] == "llm", "tickets"].sum()
+
+# --- Totals ---
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Tickets", f"{tickets:,}")
+col2.metric("Sent to LLM", f"{llm_tickets / tickets:.0%}")
+col3.metric("LLM tokens", f"{daily['input_tokens'].sum() + daily['output_tokens'].sum():,}")
+col4.metric("Estimated cost", f"${daily['cost'].sum():,.4f}")
+
+# --- Category distribution ---
+st.subheader("Category distribution")
+categories = summary["categories"]
+by_category = categories.groupby("category", dropna=False)["tickets"].sum().sort_values(ascending=False)
+st.bar_chart(by_category.head(TOP_CATEGORIES))
+with st.expander("All category / subcategory pairs"):
+    st.dataframe(categories.sort_values("tickets", ascending=False), hide_index=True)
+
+# --- Over time ---
+st.subheader("Tickets per day by tier")
+st.bar_chart(daily.pivot_table(index=PARTITION, columns="tier", values="tickets", aggfunc="sum").fillna(0))
+
+st.subheader("Estimated LLM cost per day (USD)")
+st.bar_chart(daily.pivot_table(index=PARTITION, columns="taxonomy_version", values="cost", aggfunc="sum").fillna(0))
+
+versions = daily.groupby("taxonomy_version").agg(
+    tickets=("tickets", "sum"), input_tokens=("input_tokens", "sum"), output_tokens=("output_tokens", "sum"),
+    cost=("cost", "sum"),
+)
+versions["cost per 1k tickets"] = 1000 * versions["cost"] / versions["tickets"]
+st.caption("Per taxonomy version: a larger taxonomy makes every LLM call more expensive.")
+st.dataframe(versions.round(4))
+
+# --- Latency ---
+st.subheader("Latency by tier")
+st.dataframe(summary["latency"], hide_index=True)
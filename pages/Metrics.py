@@ -0,0 +1,151 @@
+import math
+import os
+import urllib.request
+
+import pandas as pd
+import streamlit as st
+
+from metrics import histogram_quantile, parse_prometheus, registry
+
+# --- Constants ---
+# /metrics endpoint of a running lambdaapp.py
+METRICS_URL = os.getenv("METRICS_URL", "http://localhost:8000/metrics")
+HISTOGRAM_TITLES = {
+    "ticket_stage_seconds": "Stage latency",
+    "ticket_request_seconds": "Request latency (FastAPI)",
+}
+
+
+# --- Helpers ---
+def fetch_snapshot(url):
+    """Reads a Prometheus /metrics endpoint into the registry snapshot shape."""
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return parse_prometheus(response.read().decode("utf-8"))
+
+
+def counter_frame(snapshot, name):
+    """One row per labelled series of a counter, with a 'value' column."""
+    rows = [{**c["labels"], "value": c["value"]} for c in snapshot["counters"] if c["name"] == name]
+    return pd.DataFrame(rows)
+
+
+def total(frame, **labels):
+    if frame.empty:
+        return 0
+    for key, value in labels.items():
+        if key not in frame:
+            return 0
+        frame = frame[frame[key] == value]
+    return frame["value"].sum()
+
+
+def bucket_label(bound):
+    return "> last" if bound == math.inf else f"≤ {bound:g}s"
+
+
+# --- Streamlit App ---
+st.title("📈 Classification Metrics")
+
+source = st.radio("Source", ["This Streamlit app", "FastAPI /metrics"], horizontal=True)
+if source == "This Streamlit app":
+    snapshot = registry.snapshot()
+else:
+    url = st.text_input("Metrics URL", METRICS_URL)
+    try:
+        snapshot = fetch_snapshot(url)
+    except Exception as e:
+        st.error(f"❌ Could not read {url}: {e}")
+        st.stop()
+
+if st.button("🔄 Refresh"):
+    st.rerun()
+
+if not snapshot["counters"] and not snapshot["histograms"]:
+    st.info("No classifications recorded yet.")
+    st.stop()
+
+# --- Outcomes ---
+tiers = counter_frame(snapshot, "ticket_classifications_total")
+lookups = counter_frame(snapshot, "ticket_cache_lookups_total")
+errors = counter_frame(snapshot, "ticket_errors_total")
+fallbacks = counter_frame(snapshot, "ticket_fallbacks_total")
+
+tickets = total(tiers)
+cache_lookups = total(lookups)
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Tickets", f"{tickets:,.0f}")
+col2.metric("Cache hit rate", f"{total(lookups, result='hit') / cache_lookups:.0%}" if cache_lookups else "–")
+col3.metric("Sent to LLM", f"{total(tiers, tier='llm') / tickets:.0%}" if tickets else "–")
+col4.metric("Errors", f"{total(errors):,.0f}")
+
+if not tiers.empty:
+    st.subheader("Answered by tier")
+    st.bar_chart(tiers.pivot_table(index="taxonomy_version", columns="tier", values="value", aggfunc="sum"))
+
+if not fallbacks.empty or not errors.empty:
+    col1, col2 = st.columns(2)
+    if not fallbacks.empty:
+        col1.caption("Fallbacks")
+        col1.dataframe(fallbacks, hide_index=True)
+    if not errors.empty:
+        col2.caption("Errors")
+        col2.dataframe(errors, hide_index=True)
+
+# --- Label validation ---
+validations = counter_frame(snapshot, "ticket_label_validations_total")
+validated = total(validations)
+if validated:
+    st.subheader("LLM answers vs taxonomy")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Validated answers", f"{validated:,.0f}")
+    snapped = total(validations, result="snapped") + total(validations, result="subcategory")
+    col2.metric("Snap rate", f"{snapped / validated:.1%}")
+    col3.metric("Reject rate", f"{total(validations, result='rejected') / validated:.1%}")
+    st.dataframe(validations, hide_index=True)
+
+# --- Near-duplicate cache ---
+semantic = counter_frame(snapshot, "ticket_semantic_lookups_total")
+semantic_lookups = total(semantic)
+if semantic_lookups:
+    st.subheader("Near-duplicate cache")
+    col1, col2 = st.columns(2)
+    col1.metric("Lookups (exact-cache misses)", f"{semantic_lookups:,.0f}")
+    col2.metric("Reused a similar ticket's label", f"{total(semantic, result='hit') / semantic_lookups:.0%}")
+
+# --- Token spend ---
+tokens = counter_frame(snapshot, "ticket_llm_tokens_total")
+if not tokens.empty:
+    st.subheader("Token spend per taxonomy version")
+    spend = tokens.pivot_table(index="taxonomy_version", columns="direction", values="value", aggfunc="sum").fillna(0)
+    st.bar_chart(spend)
+    llm_tickets = (
+        tiers[tiers["tier"] == "llm"].groupby("taxonomy_version")["value"].sum()
+        if not tiers.empty else pd.Series(dtype=float)
+    )
+    spend["total"] = spend.sum(axis=1)
+    spend["LLM tickets"] = llm_tickets.reindex(spend.index).fillna(0)
+    spend["tokens / LLM ticket"] = (spend["total"] / spend["LLM tickets"].where(spend["LLM tickets"] > 0)).round(1)
+    st.dataframe(spend)
+
+# --- Latency histograms ---
+for name, title in HISTOGRAM_TITLES.items():
+    series = [h for h in snapshot["histograms"] if h["name"] == name and h["count"]]
+    if not series:
+        continue
+    st.subheader(title)
+    summary = pd.DataFrame([{
+        **h["labels"],
+        "count": h["count"],
+        "mean ms": 1000 * h["sum"] / h["count"],
+        # Estimated from the bucket bounds, so only as precise as the buckets
+        **{f"p{q} ms": 1000 * (histogram_quantile(h["buckets"], q / 100) or 0) for q in (50, 95, 99)},
+    } for h in series]).round(1)
+    st.dataframe(summary, hide_index=True)
+
+    labels = [", ".join(f"{k}={v}" for k, v in sorted(h["labels"].items())) or name for h in series]
+    chosen = series[labels.index(st.selectbox("Series", labels, key=name))]
+    counts, below = [], 0
+    for bound, cumulative in chosen["buckets"]:
+        counts.append({"bucket": bucket_label(bound), "requests": cumulative - below})
+        below = cumulative
+    st.bar_chart(pd.DataFrame(counts).set_index("bucket"), sort=False)
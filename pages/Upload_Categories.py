@@ -1,7 +1,12 @@
 import streamlit as st
 import os
 import pandas as pd
-import tiktoken # Import tiktoken
+
+import tokens
+from taxonomy import (
+    compile_rows, list_versions, load_taxonomy, publish_taxonomy, rollback_taxonomy, rows_from_dataframe, write_workbook,
+)
+from ticket_classifier import SYSTEM_MESSAGE
 
 # --- Constants ---
 UPLOAD_DIR = "categories"
@@ -13,30 +18,58 @@ COLUMNS_TO_COUNT_TOKENS = ["category", "subcategory", "examples"] # Added 'examp
 # Ensure upload folder exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# --- Token Counting Function ---
-@st.cache_data # Cache the tokenizer for performance
-def get_encoder(encoding_name="cl100k_base"):
-    """Returns the tiktoken encoder for a given encoding name."""
-    try:
-        return tiktoken.get_encoding(encoding_name)
-    except Exception as e:
-        st.error(f"Error loading tiktoken encoder '{encoding_name}': {e}. Please ensure tiktoken is installed and the encoding name is correct.")
-        return None # Return None if encoder can't be loaded
-
-def count_tokens(text, encoder):
-    """Counts tokens using a tiktoken encoder."""
-    if encoder is None: # If encoder failed to load, return 0
-        return 0
-    if pd.isna(text): # Handle NaN or None values gracefully
-        return 0
-    return len(encoder.encode(str(text))) # Ensure text is string for encoding
+# --- Token Counting ---
+@st.cache_resource # A resource, not data: the encoder is loaded once per process and never serialized
+def get_encoder(encoding_name=tokens.ENCODING_NAME):
+    """Returns the tiktoken encoder, or None if it cannot be loaded."""
+    return tokens.get_encoder(encoding_name)
+
+@st.cache_resource
+def get_token_count_cache():
+    """Per-cell token counts keyed by content hash, shared by every session,
+    so a re-upload only encodes the rows that changed."""
+    return tokens.TokenCountCache(encoder=get_encoder())
+
+def count_column(values):
+    """Token counts for a column, encoded in multi-threaded batches; returns (counts, texts encoded)."""
+    return get_token_count_cache().count("" if pd.isna(value) else str(value) for value in values)
+
+# --- Saved Taxonomy ---
+# Keyed on the file's mtime so reruns (every widget click) neither re-read nor re-compile the workbook
+@st.cache_data(show_spinner="Reading categories file...")
+def read_saved(path, mtime):
+    df = pd.read_excel(path)
+    df.columns = df.columns.str.lower().str.strip() # Normalize columns for the saved file as well
+    return df
+
+@st.cache_data(show_spinner="Counting tokens...")
+def column_token_counts(path, mtime):
+    """{column: (counts, texts encoded)} for the saved file; reruns reuse it, a re-upload
+    only encodes cells whose content is not in the count cache yet."""
+    df = read_saved(path, mtime)
+    return {col_name: count_column(df[col_name]) for col_name in COLUMNS_TO_COUNT_TOKENS if col_name in df.columns}
+
+@st.cache_data(show_spinner="Projecting prompt size...")
+def projected_prompt_tokens(path, mtime):
+    """Tokens of the taxonomy part of each classification prompt for the saved file."""
+    artifact = compile_rows(rows_from_dataframe(read_saved(path, mtime)))
+    system_prompt = SYSTEM_MESSAGE.format(categories=artifact["category_str"],
+                                          subcategories=artifact["subcategory_str"])
+    return {
+        "version": artifact["version"],
+        # Home.py / app2.py / Bulk Classify: category and subcategory lists in the system prompt
+        "system_prompt": tokens.count_tokens(system_prompt, get_encoder()),
+        # lambdaapp.py: the category map with examples
+        "category_map": tokens.count_tokens(artifact["category_map"], get_encoder()),
+    }
 
 # --- Streamlit App ---
 st.title("📤 Upload Categories File")
 
 uploaded_file = st.file_uploader("Upload Excel File", type=["xlsx"])
 
-if uploaded_file:
+# The uploader keeps its file across reruns; publish each upload only once
+if uploaded_file and st.session_state.get("published_upload") != uploaded_file.file_id:
     try:
         # Read file
         df = pd.read_excel(uploaded_file)
@@ -47,19 +80,37 @@ if uploaded_file:
         if REQUIRED_COLUMNS.issubset(df.columns):
             save_path = os.path.join(UPLOAD_DIR, SAVE_AS)
             df.to_excel(save_path, index=False)
+            # Compile once here so the classifier apps never re-parse the workbook;
+            # running apps pick up the newly published version on their next request
+            artifact = compile_rows(rows_from_dataframe(df))
+            publish_taxonomy(artifact)
+            st.session_state["published_upload"] = uploaded_file.file_id
             st.success("✅ File uploaded successfully and saved as 'categories_fixed.xlsx'")
+            st.caption(f"Compiled taxonomy version {artifact['version']} ({len(artifact['rows'])} rows)")
         else:
             missing_cols = REQUIRED_COLUMNS - set(df.columns)
             st.error(f"❌ File must contain 'category' and 'subcategory' columns. Missing: {', '.join(missing_cols)}")
     except Exception as e:
         st.error(f"❌ Error reading Excel file: {e}")
 
+# Published taxonomy versions (newest first), with rollback
+versions = list_versions()
+if len(versions) > 1:
+    with st.expander("🕘 Taxonomy versions"):
+        labels = {f"{v} · {compiled_at} · {rows} rows": v for v, compiled_at, rows in versions}
+        choice = st.selectbox("Published versions", list(labels))
+        if st.button("↩️ Make this version current"):
+            version = rollback_taxonomy(labels[choice])
+            # The page below is built from the workbook, so it is rewritten to the rolled-back rows
+            write_workbook(load_taxonomy(), os.path.join(UPLOAD_DIR, SAVE_AS))
+            st.success(f"✅ Taxonomy version {version} is now current; '{SAVE_AS}' was rewritten to match")
+
 # Show saved file (if it exists and is valid)
 saved_path = os.path.join(UPLOAD_DIR, SAVE_AS)
 if os.path.exists(saved_path):
     try:
-        df = pd.read_excel(saved_path)
-        df.columns = df.columns.str.lower().str.strip() # Normalize columns for the saved file as well
+        saved_mtime = os.path.getmtime(saved_path)
+        df = read_saved(saved_path, saved_mtime)
 
         if REQUIRED_COLUMNS.issubset(df.columns):
             st.subheader(f"📂 Showing: {SAVE_AS}")
@@ -83,34 +134,44 @@ if os.path.exists(saved_path):
                 col1.metric("Total Unique Categories", total_categories)
                 col2.metric("Total Unique Subcategories", total_subcategories)
 
+            # --- Projected prompt size per classification call ---
+            st.subheader("🧮 Projected Prompt Tokens per Classification")
+            projection = projected_prompt_tokens(saved_path, saved_mtime)
+            col1, col2 = st.columns(2)
+            col1.metric("System prompt (Streamlit apps)", f"{projection['system_prompt']:,}")
+            col2.metric("Category map (API /classify)", f"{projection['category_map']:,}")
+            st.caption(f"Taxonomy version {projection['version']}. Sent with every ticket that reaches the LLM, "
+                       f"before the ticket text; shortlist mode and packed batches send less.")
 
             st.subheader("📊 Token Counts for Specified Columns")
-
-            # Initialize encoder once
-            encoder = get_encoder()
-
-            if encoder: # Only proceed if encoder was loaded successfully
-                # Create a list to hold columns to display in the token count dataframe
-                columns_to_display = []
-                # Flag to check if any relevant column was found
-                relevant_column_found = False
-
-                for col_name in COLUMNS_TO_COUNT_TOKENS:
-                    if col_name in df.columns:
-                        relevant_column_found = True
-                        # Apply token counting to the current column
-                        df[f'{col_name}_tokens'] = df[col_name].apply(lambda x: count_tokens(x, encoder))
-                        columns_to_display.extend([col_name, f'{col_name}_tokens'])
-                    else:
-                        st.info(f"Column '{col_name}' not found in the uploaded file. Skipping token count for it.")
-
-                if relevant_column_found:
-                    if st.button("Display All Calculated Token Counts"):
-                        st.dataframe(df[columns_to_display])
+            if get_encoder() is None:
+                st.caption("tiktoken encoding unavailable; counts are estimated at ~4 characters per token.")
+
+            # Create a list to hold columns to display in the token count dataframe
+            columns_to_display = []
+            totals = {}
+            encoded = 0
+            column_counts = column_token_counts(saved_path, saved_mtime)
+            for col_name in COLUMNS_TO_COUNT_TOKENS:
+                if col_name in df.columns:
+                    counts, new_texts = column_counts[col_name]
+                    df[f'{col_name}_tokens'] = counts
+                    totals[col_name] = sum(counts)
+                    encoded += new_texts
+                    columns_to_display.extend([col_name, f'{col_name}_tokens'])
                 else:
-                    st.info("No specified columns (category, subcategory, examples) were found in the file to count tokens for.")
+                    st.info(f"Column '{col_name}' not found in the uploaded file. Skipping token count for it.")
+
+            if columns_to_display:
+                cols = st.columns(len(totals))
+                for col, (col_name, total) in zip(cols, totals.items()):
+                    col.metric(f"{col_name} tokens", f"{total:,}")
+                st.caption(f"{len(df):,} rows · {encoded:,} new or changed values encoded for this file, "
+                           f"the rest reused from the count cache.")
+                if st.button("Display All Calculated Token Counts"):
+                    st.dataframe(df[columns_to_display])
             else:
-                st.warning("Token counting functionality is disabled due to an encoder loading error.")
+                st.info("No specified columns (category, subcategory, examples) were found in the file to count tokens for.")
 
     except Exception as e:
         st.error(f"❌ Error loading saved file: {e}")
@@ -0,0 +1,179 @@
+"""
+Ticket text clean-up before classification.
+
+Tickets often arrive as email threads: the actual problem is a few lines at
+the top, followed by quoted replies, signatures, legal disclaimers and pasted
+logs that cost thousands of input tokens and add nothing to the category.
+preprocess_ticket() runs one pass over the lines and
+
+  - stops at the first quoted reply ("On ... wrote:", "-----Original Message-----",
+    "From:" headers, Outlook separators), signature ("-- ", "Thanks,", "Sent from my ...")
+    or disclaimer, and drops ">"-quoted lines
+  - collapses runs of stack-trace / log lines to their first and last lines
+  - drops repeated lines (log lines are compared with digits normalised, so
+    lines that differ only by timestamp or id count as repeats)
+  - truncates to TICKET_MAX_TOKENS, keeping the opening lines and the lines
+    that mention errors before anything else
+
+and reports the tokens removed. Every entry point classifies the cleaned text,
+so the cache and local index also see the same text the LLM would.
+TICKET_PREPROCESS=off sends descriptions unchanged (truncation included).
+"""
+import os
+import re
+
+from metrics import record_preprocess, stage
+from tokens import count_tokens
+
+TICKET_PREPROCESS = os.getenv("TICKET_PREPROCESS", "on").lower() not in ("0", "off", "false", "no")
+# Budget for the cleaned description, in tiktoken tokens
+TICKET_MAX_TOKENS = int(os.getenv("TICKET_MAX_TOKENS", "512"))
+# Lines kept at each end of a collapsed log / stack trace run
+LOG_KEEP_HEAD = 2
+LOG_KEEP_TAIL = 1
+# Opening lines are usually the subject and the problem statement
+HEAD_LINES = 3
+
+# Everything from one of these lines on is quoted history, a signature or a disclaimer
+_CUT = re.compile(
+    r"^(?:"
+    r"on .{1,200}\bwrote:$"
+    r"|-{2,}\s*(?:original|forwarded) message\s*-{2,}"
+    r"|_{10,}"
+    r"|from:\s.+"
+    r"|--\s?"
+    r"|(?:many |kind |best |warm )?(?:thanks|thank you|regards|cheers|sincerely)[,.!]?(?: \w+)?[,.!]?"
+    r"|sent from my .+"
+    r"|(?:confidentiality notice|disclaimer)\b.*"
+    r"|this (?:e-?mail|message)(?: and any attachments?)? (?:is|are|may be) (?:confidential|intended)\b.*"
+    r")$",
+    re.IGNORECASE,
+)
+_QUOTED = re.compile(r"^\s*>")
+_LOG_LINE = re.compile(
+    r"^\s*(?:"
+    r"at [\w$.<>]+\(.*\)"                                  # Java / .NET frames
+    r"|File \".+\", line \d+"                              # Python frames
+    r"|\.\.\. \d+ more"
+    r"|\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}"             # ISO timestamps
+    r"|\[?\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\]?\s"
+    r"|\[?(?:TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL)\]?[\s:]"
+    r"|0x[0-9a-fA-F]{6,}"
+    r")"
+)
+_ERROR_WORDS = re.compile(
+    r"\b(?:error|fail\w*|exception|cannot|can't|unable|not working|denied|timeout|timed out|crash\w*|broken|down)\b",
+    re.IGNORECASE,
+)
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+
+
+def _clean_lines(lines):
+    """Yields the lines that carry the ticket, with quotes, signatures, logs and repeats removed."""
+    seen = set()
+    log_run = []
+    has_content = False
+
+    def flush_logs():
+        if len(log_run) > LOG_KEEP_HEAD + LOG_KEEP_TAIL + 1:
+            omitted = len(log_run) - LOG_KEEP_HEAD - LOG_KEEP_TAIL
+            yield from log_run[:LOG_KEEP_HEAD]
+            yield f"[... {omitted} log lines omitted ...]"
+            yield from log_run[-LOG_KEEP_TAIL:]
+        else:
+            yield from log_run
+        log_run.clear()
+
+    for line in lines:
+        stripped = line.strip()
+        # Only after some content, so a forwarded ticket that opens with "From:" survives
+        if has_content and _CUT.match(stripped):
+            break
+        if _QUOTED.match(line):
+            continue
+        if not stripped:
+            yield from flush_logs()
+            continue
+        # Indented lines under a frame (the source line of a Python traceback) stay in the run
+        is_log = bool(_LOG_LINE.match(line)) or bool(log_run and line[:1].isspace())
+        # Digits only count for prose, so log lines differing by timestamp or id are repeats
+        key = _SPACES.sub(" ", _DIGITS.sub("0", stripped.lower()) if is_log else stripped.lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        if is_log:
+            log_run.append(stripped)
+            continue
+        yield from flush_logs()
+        has_content = True
+        yield stripped
+    yield from flush_logs()
+
+
+def truncate_to_budget(lines, max_tokens=TICKET_MAX_TOKENS):
+    """Keeps the most informative lines within max_tokens, in their original order.
+
+    Opening lines come first, then lines mentioning errors, then the rest top
+    down; a line that does not fit is cut at a word boundary.
+    """
+    costs = [count_tokens(line) + 1 for line in lines]
+    order = sorted(
+        range(len(lines)),
+        key=lambda i: (0 if i < HEAD_LINES else 1 if _ERROR_WORDS.search(lines[i]) else 2, i),
+    )
+    kept, budget = {}, max_tokens
+    for i in order:
+        if costs[i] <= budget:
+            kept[i] = lines[i]
+            budget -= costs[i]
+        elif budget > 8 and i < HEAD_LINES:
+            # A long opening line is still worth a prefix, but leaves room for the error lines
+            share = min(budget, max(8, max_tokens // 2))
+            # Roughly 4 characters per token
+            kept[i] = lines[i][: share * 4].rsplit(" ", 1)[0] + " ..."
+            budget -= share
+        if budget <= 0:
+            break
+
+    output, previous = [], -1
+    for i in sorted(kept):
+        if i != previous + 1:
+            output.append("[...]")
+        output.append(kept[i])
+        previous = i
+    return output
+
+
+def preprocess_ticket(text, max_tokens=TICKET_MAX_TOKENS, enabled=TICKET_PREPROCESS):
+    """Cleans and truncates a ticket description.
+
+    Returns {"text", "tokens_before", "tokens_after", "tokens_removed"}.
+    """
+    text = text or ""
+    tokens_before = count_tokens(text)
+    if enabled and "\n" in text:
+        lines = list(_clean_lines(text.splitlines()))
+        # A ticket that is nothing but quoted history keeps its text rather than becoming empty
+        cleaned = "\n".join(lines) if lines else text.strip()
+    else:
+        lines, cleaned = None, text.strip()
+
+    tokens_after = count_tokens(cleaned) if cleaned != text else tokens_before
+    if tokens_after > max_tokens:
+        cleaned = "\n".join(truncate_to_budget(lines or cleaned.splitlines(), max_tokens))
+        tokens_after = count_tokens(cleaned)
+    return {
+        "text": cleaned,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_removed": max(0, tokens_before - tokens_after),
+    }
+
+
+def clean_ticket(text):
+    """preprocess_ticket() for the entry points: timed and recorded in metrics.py."""
+    with stage("preprocess"):
+        report = preprocess_ticket(text)
+    record_preprocess(report)
+    return report
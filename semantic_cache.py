@@ -0,0 +1,282 @@
+"""
+Near-duplicate cache: reuses the label of a recently classified ticket that
+says the same thing in other words.
+
+The exact-match cache (classification_cache.py) only catches tickets that are
+identical after case and whitespace normalization, so "Hi team, Outlook
+crashes on attachments" and "Outlook crashes on attachments. Thanks" both
+cost an LLM call. Here every ticket the LLM labeled is kept as a hashed term
+vector in a NumPy matrix; a new ticket whose cosine similarity to a stored
+one reaches SEMANTIC_CACHE_THRESHOLD reuses its label, for the price of one
+matrix-vector product.
+
+The features (features()) are stemmed words plus word bigrams at half weight:
+the bigrams separate tickets that share most words ("Wifi not working on
+laptop" / "Laptop not working" scores 0.80 rather than 0.87), while a change of
+word order ("can't connect to VPN" / "VPN won't connect") still scores 0.93.
+Unlike the taxonomy index, negations are kept ("cannot", "won't" and
+"unable" all become "not"), since "I need access to the shared drive" and
+"I cannot access the shared drive" belong in different categories; greetings
+and courtesy words are dropped, since they say nothing about the category.
+
+  - bounded: at most SEMANTIC_CACHE_SIZE tickets; when full, the least
+    recently used one is replaced
+  - per taxonomy version: each version gets its own cache (semantic_cache_for),
+    so a label from an older taxonomy is never reused
+  - persistable: with SEMANTIC_CACHE_DIR set, the cache is written there every
+    SEMANTIC_CACHE_SAVE_EVERY new tickets and by save_all() at shutdown, and
+    loaded again on start; save_all() also removes the files of versions
+    this process dropped from memory
+
+SEMANTIC_CACHE=off disables it.
+"""
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from metrics import record_semantic_lookup
+from taxonomy_index import _STOPWORDS, _TOKEN, _bucket, _stem
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "on").lower() not in ("0", "off", "false", "no")
+# Cosine similarity at which a stored ticket's label is reused. The same ticket
+# with a greeting or sign-off scores 1.0, rewording or reordering 0.93-0.97;
+# tickets that differ in a negation or a product score about 0.65-0.8
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "5000"))
+# 4 KB per stored ticket at the default
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "1024"))
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR")
+SEMANTIC_CACHE_SAVE_EVERY = int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", "100"))
+# Characters of the matched ticket reported with a hit
+TICKET_PREVIEW = 200
+# Stored tickets at least this similar are the same ticket: refreshed, not added again
+_SAME_TICKET = 0.999
+# Bumped when features() changes, so vectors saved by an older version are not loaded
+FEATURE_FORMAT = 3
+# Weight of a word bigram relative to a single word
+_BIGRAM_WEIGHT = 0.5
+
+_NEGATIONS = {"not", "no", "never", "cannot", "unable", "without", "nor", "none", "nothing"}
+# "can't" -> "ca not", "doesn't" -> "does not"
+_CONTRACTION = re.compile(r"n['’]t\b")
+_AUXILIARIES = {"ca", "wo", "sha", "do", "does", "did", "was", "were", "will", "would", "could", "should"}
+_FILLER = {"hi", "hello", "hey", "dear", "team", "thanks", "thank", "advance", "regards", "kindly", "appreciated",
+           "urgent", "asap", "someone", "anyone", "help"}
+_SEMANTIC_STOPWORDS = (_STOPWORDS - _NEGATIONS) | _AUXILIARIES | _FILLER
+
+
+def features(text):
+    """Stemmed words, with every negation as "not", plus word bigrams, as (feature, weight) pairs."""
+    words = []
+    for word in _TOKEN.findall(_CONTRACTION.sub(" not", str(text).lower())):
+        if word in _NEGATIONS:
+            words.append("not")
+        elif word not in _SEMANTIC_STOPWORDS:
+            words.append(_stem(word))
+    return [(word, 1.0) for word in words] + [(f"{a} {b}", _BIGRAM_WEIGHT) for a, b in zip(words, words[1:])]
+
+
+def vectorize(text, dim=SEMANTIC_CACHE_DIM):
+    """L2-normalized weighted term-frequency vector, or None for text without content words."""
+    counts = {}
+    for feature, weight in features(text):
+        bucket = _bucket(feature, dim)
+        counts[bucket] = counts.get(bucket, 0) + weight
+    if not counts:
+        return None
+    vector = np.zeros(dim, dtype=np.float32)
+    for bucket, count in counts.items():
+        vector[bucket] = count
+    return vector / np.linalg.norm(vector)
+
+
+def cache_path(version, directory=SEMANTIC_CACHE_DIR):
+    return os.path.join(directory, f"semantic_{version}.npz") if directory else None
+
+
+class SemanticCache:
+    """Labels of recently classified tickets of one taxonomy version, searchable by similarity."""
+
+    def __init__(self, version, max_size=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 dim=SEMANTIC_CACHE_DIM, path=None, save_every=SEMANTIC_CACHE_SAVE_EVERY):
+        self.version = version
+        self.max_size = max_size
+        self.threshold = threshold
+        self.dim = dim
+        self.path = path
+        self.save_every = save_every
+        # Rows [0, size) are filled; last_used orders them for eviction
+        self.matrix = np.zeros((max_size, dim), dtype=np.float32)
+        self.last_used = np.zeros(max_size, dtype=np.int64)
+        self.results = [None] * max_size
+        self.tickets = [None] * max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clock = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, description):
+        """Returns (result, similarity, matched ticket) for the closest stored ticket
+        at or above the threshold, or None."""
+        vector = vectorize(description, self.dim)
+        match = None
+        with self._lock:
+            if vector is not None and self.size:
+                scores = self.matrix[:self.size] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._clock += 1
+                    self.last_used[best] = self._clock
+                    match = self.results[best], round(float(scores[best]), 4), self.tickets[best]
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_semantic_lookup(match is not None)
+        return match
+
+    def add(self, description, result):
+        """Stores the result of a classified ticket."""
+        vector = vectorize(description, self.dim)
+        if vector is None:
+            return
+        with self._lock:
+            slot = None
+            if self.size:
+                scores = self.matrix[:self.size] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= _SAME_TICKET:
+                    slot = best
+            if slot is None and self.size < self.max_size:
+                slot = self.size
+                self.size += 1
+            elif slot is None:
+                slot = int(np.argmin(self.last_used[:self.size]))
+                self.evictions += 1
+            self._clock += 1
+            self.matrix[slot] = vector
+            self.last_used[slot] = self._clock
+            self.results[slot] = result
+            self.tickets[slot] = description[:TICKET_PREVIEW]
+            self._unsaved += 1
+            save = self.path is not None and self._unsaved >= self.save_every
+        if save:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self.size = 0
+            self.last_used[:] = 0
+            self.results = [None] * self.max_size
+            self.tickets = [None] * self.max_size
+
+    def save(self):
+        """Writes the cache to its path, if it has one."""
+        if self.path is None:
+            return
+        with self._lock:
+            size = self.size
+            arrays = {
+                "version": self.version,
+                "format": FEATURE_FORMAT,
+                "matrix": self.matrix[:size].copy(),
+                "last_used": self.last_used[:size].copy(),
+                "results": json.dumps(self.results[:size]),
+                "tickets": json.dumps(self.tickets[:size]),
+            }
+            self._unsaved = 0
+        directory = os.path.dirname(self.path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # read-only filesystem: the cache simply starts empty next time
+
+    def load(self):
+        """Restores a saved cache for this version; keeps the most recently used rows if it was larger."""
+        if self.path is None or not os.path.exists(self.path):
+            return self
+        with np.load(self.path) as data:
+            if (str(data["version"]) != self.version or "format" not in data
+                    or int(data["format"]) != FEATURE_FORMAT or data["matrix"].shape[1] != self.dim):
+                return self
+            matrix, last_used = data["matrix"], data["last_used"]
+            results, tickets = json.loads(str(data["results"])), json.loads(str(data["tickets"]))
+        keep = np.argsort(-last_used)[:self.max_size]
+        with self._lock:
+            self.size = len(keep)
+            self.matrix[:self.size] = matrix[keep]
+            # Recency order is kept; the clock restarts above it
+            self.last_used[:self.size] = last_used[keep] - last_used.min() + 1 if len(keep) else 0
+            self._clock = int(self.last_used[:self.size].max()) if self.size else 0
+            for slot, row in enumerate(keep):
+                self.results[slot], self.tickets[slot] = results[row], tickets[row]
+        return self
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self.size,
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+# Saved files of versions this process dropped from memory, removed by save_all()
+_evicted_paths = set()
+
+
+def semantic_cache_for(version):
+    """Returns the process-wide cache of a taxonomy version (loaded from disk when saved), or None when disabled."""
+    if not SEMANTIC_CACHE:
+        return None
+    with _caches_lock:
+        cache = _caches.get(version)
+        if cache is None:
+            # Only the current and previous versions are kept in memory
+            while len(_caches) >= 2:
+                evicted = _caches.pop(next(iter(_caches)))
+                if evicted.path is not None:
+                    _evicted_paths.add(evicted.path)
+            cache = _caches[version] = SemanticCache(version, path=cache_path(version)).load()
+            _evicted_paths.discard(cache.path)
+        return cache
+
+
+def save_all():
+    """Saves every cache in this process, then removes the files of versions it dropped
+    from memory; for shutdown hooks.
+
+    Only files of versions this process evicted itself are removed, never another
+    worker's: workers sharing SEMANTIC_CACHE_DIR each keep their live versions' files.
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+        evicted = _evicted_paths - {cache.path for cache in caches}
+        _evicted_paths.clear()
+    for cache in caches:
+        cache.save()
+    if not caches:
+        return
+    for path in evicted:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,220 @@
+"""
+Early-exit streaming for single-ticket classification calls.
+
+The prompts ask for a JSON object, {"category": ..., "subcategory": ...}, and
+the Gemini clients are put in JSON mode, but models often keep going with an
+explanation after it, and a plain invoke waits for all of it. Here the reply
+is streamed and parsed as it arrives; as soon as both fields are known (or the
+object is closed) the stream is closed, which cancels the generation.
+LLM_MAX_OUTPUT_TOKENS additionally caps the completion, so a model that never
+gets to the point still stops early: lambdaapp.py passes it with each
+single-ticket call, and the Streamlit apps' client is built with it
+(ticket_classifier.get_llm).
+
+Models that ignore the format and answer in lines, "Category: ..." and
+"Subcategory: ..." (or "Category: <category> -> <subcategory>"), are parsed
+the same way.
+
+LLM_STREAMING=off falls back to waiting for the full reply.
+"""
+import json
+import os
+import re
+
+from tokens import count_tokens
+
+LLM_STREAMING = os.getenv("LLM_STREAMING", "on").lower() not in ("0", "off", "false", "no")
+# Cap on output tokens for single-ticket calls; the JSON answer needs ~20
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "64"))
+
+# A complete "key": "value" member of the JSON answer; a value still streaming has no closing quote yet
+_JSON_FIELD = re.compile(r'"(category|subcategory)"\s*:\s*"((?:[^"\\]|\\.)*)"', re.IGNORECASE)
+_JSON_END = re.compile(r"\s*\}")
+_FIELD = re.compile(r"^(category|subcategory)\s*:\s*(.*)$", re.IGNORECASE)
+# Markdown the model sometimes wraps the answer in ("**Category:** X", "- Category: X")
+_DECORATION = re.compile(r"[*_`#]+|^\s*[-•]\s*")
+
+
+class ClassificationParser:
+    """Incremental parser for {"category", "subcategory"} JSON replies, and for
+    'Category: ...' / 'Subcategory: ...' lines from models that ignore the format.
+
+    feed() takes streamed text and returns the fields recognised so far as
+    (name, value) pairs; `done` turns True once nothing more is needed.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.category = None
+        self.subcategory = None
+        self.done = False
+        # Span of the answer in buffer; anything around it is commentary
+        self.answer_start = None
+        self.answer_end = 0
+        self._position = 0
+        self._json = False
+
+    @property
+    def answer(self):
+        """The answer of the reply, without any preamble or trailing explanation."""
+        return self.buffer[self.answer_start or 0:self.answer_end].strip()
+
+    def feed(self, text):
+        self.buffer += text
+        fields = []
+        while not self.done:
+            if self._json:
+                fields += self._parse_json(final=False)
+                break
+            newline = self.buffer.find("\n", self._position)
+            line_end = newline if newline >= 0 else len(self.buffer)
+            # An object opened before any answer line: the reply is JSON
+            brace = self.buffer.find("{", self._position, line_end)
+            if brace >= 0 and self.answer_start is None:
+                self._json, self.answer_start, self._position = True, brace, brace
+                continue
+            # Only complete lines are parsed, a partial "Category: Net" must not count
+            if newline < 0:
+                break
+            fields += self._parse_line(self._position, newline)
+            self._position = newline + 1
+        return fields
+
+    def finish(self):
+        """Parses what is left once the stream has ended."""
+        fields = []
+        if self._json:
+            fields = self._parse_json(final=True)
+        elif not self.done and self._position < len(self.buffer):
+            fields = self._parse_line(self._position, len(self.buffer))
+            self._position = len(self.buffer)
+        self.done = True
+        return fields
+
+    def _parse_json(self, final):
+        fields = []
+        while not self.done:
+            match = _JSON_FIELD.search(self.buffer, self._position)
+            end = _JSON_END.search(self.buffer, self._position)
+            if end is not None and (match is None or end.start() < match.start()):
+                # The object is closed; a field left out is not coming
+                self.answer_end, self._position, self.done = end.end(), end.end(), True
+                break
+            if match is None:
+                break
+            try:
+                value = json.loads(f'"{match.group(2)}"').strip()
+            except ValueError:
+                value = match.group(2).strip()
+            self.answer_end = self._position = match.end()
+            fields += self._set(match.group(1).lower(), value)
+        if self.done:
+            # Both fields in: the closing brace belongs to the answer if it has arrived
+            end = _JSON_END.match(self.buffer, self._position)
+            if end is not None:
+                self.answer_end = self._position = end.end()
+        elif final and self.answer_end == 0:
+            self.answer_end = len(self.buffer)
+        return fields
+
+    def _parse_line(self, start, end):
+        line = _DECORATION.sub("", self.buffer[start:end]).strip()
+        if not line:
+            return []
+        match = _FIELD.match(line)
+        if match is None:
+            # Preamble before the answer is skipped; text after it is an explanation
+            if self.category is not None:
+                self.done = True
+            return []
+
+        if self.answer_start is None:
+            self.answer_start = start
+        self.answer_end = end
+        return self._set(match.group(1).lower(), match.group(2).strip())
+
+    def _set(self, key, value):
+        if key == "subcategory":
+            self.subcategory = value
+            self.done = self.category is not None
+            return [("subcategory", value)]
+        if "->" in value:
+            category, _, subcategory = (part.strip() for part in value.partition("->"))
+            self.category, self.subcategory, self.done = category, subcategory, True
+            return [("category", category), ("subcategory", subcategory)]
+        self.category = value
+        self.done = self.subcategory is not None
+        return [("category", value)]
+
+
+def _answer(parser, message, prompt_text, early_exit):
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        # Gemini reports usage on every chunk; estimate for models that only send it at the end
+        usage = {"input_tokens": count_tokens(prompt_text), "output_tokens": count_tokens(parser.buffer)}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+    if message is not None:
+        message.usage_metadata = usage
+    return {
+        "text": parser.answer or parser.buffer.strip(),
+        "category": parser.category,
+        "subcategory": parser.subcategory,
+        "early_exit": early_exit,
+        "message": message,
+    }
+
+
+def _prompt_text(prompt_value):
+    messages = prompt_value.to_messages() if hasattr(prompt_value, "to_messages") else prompt_value
+    if isinstance(messages, str):
+        return messages
+    if isinstance(messages, dict):
+        return "\n".join(str(v) for v in messages.values())
+    return "\n".join(str(getattr(m, "content", m)) for m in messages)
+
+
+async def astream_answer(runnable, inputs, config=None, **kwargs):
+    """Streams a classification reply, stopping once the answer is complete.
+
+    Yields ("category" | "subcategory", value) as each field is recognised and
+    finally ("done", answer) with answer = {"text", "category", "subcategory",
+    "early_exit", "message"}. The message is the chunks received so far, with
+    their usage_metadata (estimated when the model reported none).
+
+    Pass the cap for a chat model as max_output_tokens here rather than binding
+    it with llm.bind(): LangChain does not close the stream behind a binding, so
+    the model's rate-limiter slot would only be freed by garbage collection.
+    """
+    parser, message = ClassificationParser(), None
+    stream = runnable.astream(inputs, config, **kwargs)
+    try:
+        async for chunk in stream:
+            message = chunk if message is None else message + chunk
+            for field in parser.feed(str(chunk.content)):
+                yield field
+            if parser.done:
+                break
+    finally:
+        # Closing the stream cancels the rest of the generation
+        await stream.aclose()
+    early_exit = parser.done
+    for field in parser.finish():
+        yield field
+    yield "done", _answer(parser, message, _prompt_text(inputs), early_exit)
+
+
+def stream_answer(runnable, inputs, config=None):
+    """Blocking astream_answer() for the Streamlit apps; returns only the final answer."""
+    parser, message = ClassificationParser(), None
+    stream = runnable.stream(inputs, config)
+    try:
+        for chunk in stream:
+            message = chunk if message is None else message + chunk
+            parser.feed(str(chunk.content))
+            if parser.done:
+                break
+    finally:
+        stream.close()
+    early_exit = parser.done
+    parser.finish()
+    return _answer(parser, message, _prompt_text(inputs), early_exit)
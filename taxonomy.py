@@ -0,0 +1,255 @@
+"""
+Compiled taxonomy artifact shared by every entry point.
+
+The category workbook is compiled once, when it is uploaded, into a small JSON
+artifact holding the taxonomy rows, the pre-rendered prompt strings, lookup
+tables and a content hash. Home.py, app2.py and lambdaapp.py load the artifact
+instead of re-reading the workbook with pandas, so they all see the same
+taxonomy and the content hash doubles as the taxonomy version.
+
+Every published version is kept under categories/versions/ and the current
+one is swapped into categories/taxonomy.json with an atomic rename, so a
+rollback is just re-publishing an older version. Running processes use a
+TaxonomyWatcher, which notices a new version with a single os.stat and
+swaps in objects prebuilt for it.
+
+Compile and publish a workbook, or roll back, from the command line with:
+    python taxonomy.py [path/to/categories_fixed.xlsx]
+    python taxonomy.py rollback <version>
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Bump when the artifact layout changes so stale artifacts are recompiled
+ARTIFACT_FORMAT = 1
+
+TAXONOMY_DIR = "categories"
+WORKBOOK_PATH = os.path.join(TAXONOMY_DIR, "categories_fixed.xlsx")
+ARTIFACT_PATH = os.path.join(TAXONOMY_DIR, "taxonomy.json")
+VERSIONS_DIR = os.path.join(TAXONOMY_DIR, "versions")
+# Older deployments kept the workbook in the repository root
+LEGACY_WORKBOOK_PATH = "categories_fixed.xlsx"
+
+REQUIRED_COLUMNS = {"category", "subcategory"}
+
+
+def rows_from_dataframe(df):
+    """Extracts (category, subcategory, examples) rows from a taxonomy DataFrame."""
+    columns = {str(c).lower().strip(): c for c in df.columns}
+    missing = REQUIRED_COLUMNS - set(columns)
+    if missing:
+        raise ValueError(f"Taxonomy must have 'category' and 'subcategory' columns. Missing: {', '.join(sorted(missing))}")
+    examples_col = columns.get("examples")
+    rows = []
+    for category, subcategory, examples in zip(
+        df[columns["category"]],
+        df[columns["subcategory"]],
+        df[examples_col] if examples_col is not None else [""] * len(df),
+    ):
+        if category != category or subcategory != subcategory:  # skip rows with NaN labels
+            continue
+        rows.append({
+            "category": str(category).strip(),
+            "subcategory": str(subcategory).strip(),
+            "examples": "" if examples is None or examples != examples else str(examples).strip(),
+        })
+    return rows
+
+
+def compile_rows(rows):
+    """Builds the artifact dict (prompt strings, lookups, content hash) from taxonomy rows."""
+    canonical = json.dumps(rows, sort_keys=True, ensure_ascii=False)
+    content_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+    subcategories_by_category = {}
+    for row in rows:
+        subcategories = subcategories_by_category.setdefault(row["category"], [])
+        if row["subcategory"] not in subcategories:
+            subcategories.append(row["subcategory"])
+
+    return {
+        "format": ARTIFACT_FORMAT,
+        "version": content_hash,
+        "compiled_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "rows": rows,
+        "subcategories_by_category": subcategories_by_category,
+        # Pre-rendered prompt fragments
+        "category_str": "\n".join(sorted(subcategories_by_category)),
+        "subcategory_str": "\n".join(f"{row['category']} - {row['subcategory']}" for row in rows),
+        "category_map": "\n".join(
+            f"{row['category']} -> {row['subcategory']}" + (f": {row['examples']}" if row["examples"] else "")
+            for row in rows
+        ),
+    }
+
+
+def compile_workbook(source):
+    """Compiles an Excel workbook (path or file-like object) into an artifact dict."""
+    import pandas as pd  # only needed at compile time
+    return compile_rows(rows_from_dataframe(pd.read_excel(source)))
+
+
+def write_workbook(artifact, path=WORKBOOK_PATH):
+    """Writes an artifact's rows back to the workbook, e.g. after a rollback, so the
+    workbook and the current taxonomy agree again; recompiling it gives the same version."""
+    import pandas as pd
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    columns = ["category", "subcategory", "examples"]
+    pd.DataFrame(artifact["rows"], columns=columns).to_excel(path, index=False)
+    return path
+
+
+def save_artifact(artifact, path=ARTIFACT_PATH):
+    """Writes the artifact to disk, replacing any previous one in a single rename."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Unique temp name so concurrent publishers never write to the same file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_artifact(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _archive(artifact, versions_dir):
+    version_path = os.path.join(versions_dir, f"{artifact['version']}.json")
+    if not os.path.exists(version_path):
+        save_artifact(artifact, version_path)
+
+
+def publish_taxonomy(artifact, path=ARTIFACT_PATH, versions_dir=VERSIONS_DIR):
+    """Keeps a copy of the artifact under versions/ and atomically makes it current."""
+    if os.path.exists(path):
+        # Make sure the version being replaced can be rolled back to
+        _archive(_read_artifact(path), versions_dir)
+    _archive(artifact, versions_dir)
+    save_artifact(artifact, path)
+    return artifact["version"]
+
+
+def list_versions(versions_dir=VERSIONS_DIR):
+    """Returns [(version, compiled_at, row_count)] for every published version, newest first."""
+    if not os.path.isdir(versions_dir):
+        return []
+    versions = []
+    for name in os.listdir(versions_dir):
+        if name.endswith(".json"):
+            artifact = _read_artifact(os.path.join(versions_dir, name))
+            versions.append((artifact["version"], artifact.get("compiled_at", ""), len(artifact["rows"])))
+    return sorted(versions, key=lambda v: v[1], reverse=True)
+
+
+def rollback_taxonomy(version, path=ARTIFACT_PATH, versions_dir=VERSIONS_DIR):
+    """Makes a previously published version current again.
+
+    The workbook is left alone; callers that show or recompile it follow up with write_workbook().
+    """
+    version_path = os.path.join(versions_dir, f"{version}.json")
+    if not os.path.exists(version_path):
+        raise ValueError(f"Unknown taxonomy version '{version}'")
+    return publish_taxonomy(_read_artifact(version_path), path, versions_dir)
+
+
+def load_taxonomy(path=ARTIFACT_PATH):
+    """Loads the compiled taxonomy, compiling it from the workbook on first use."""
+    if os.path.exists(path):
+        artifact = _read_artifact(path)
+        if artifact.get("format") == ARTIFACT_FORMAT:
+            return artifact
+
+    for workbook in (WORKBOOK_PATH, LEGACY_WORKBOOK_PATH):
+        if os.path.exists(workbook):
+            artifact = compile_workbook(workbook)
+            publish_taxonomy(artifact, path)
+            return artifact
+
+    raise FileNotFoundError(
+        f"No compiled taxonomy at '{path}' and no workbook at '{WORKBOOK_PATH}'. "
+        "Upload one on the Upload Categories page."
+    )
+
+
+def _file_signature(path):
+    """Cheap change detector: a new publish replaces the file, changing its inode and mtime."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class TaxonomyWatcher:
+    """Serves the current taxonomy plus objects prebuilt from it, reloading on change.
+
+    `build(taxonomy)` is called once per new version to prepare whatever the
+    caller needs (prompt, chain, index). The result is swapped in with a single
+    assignment, so requests already holding the previous state finish on it.
+    """
+
+    def __init__(self, build=None, path=ARTIFACT_PATH, check_interval=None):
+        self.path = path
+        self.build = build or (lambda taxonomy: None)
+        if check_interval is None:
+            check_interval = float(os.getenv("TAXONOMY_CHECK_INTERVAL_SECONDS", "1"))
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state = None  # (signature, taxonomy, built)
+        self._next_check = 0.0
+        self.reloads = 0
+
+    def current(self):
+        """Returns (taxonomy, built) for the newest published version."""
+        state = self._state
+        now = time.monotonic()
+        if state is None or now >= self._next_check:
+            self._next_check = now + self.check_interval
+            if state is None or _file_signature(self.path) != state[0]:
+                state = self._reload(state)
+        return state[1], state[2]
+
+    def _reload(self, seen):
+        with self._lock:
+            # Another thread may have finished the reload while we waited
+            if self._state is not seen:
+                return self._state
+            # Stat before reading: if a publish lands in between, the next check reloads again
+            signature = _file_signature(self.path)
+            taxonomy = load_taxonomy(self.path)
+            if signature is None:  # load_taxonomy just compiled and published it
+                signature = _file_signature(self.path)
+            if seen is not None and taxonomy["version"] == seen[1]["version"]:
+                # Same content re-published (e.g. a re-upload): keep the prebuilt objects
+                self._state = (signature, seen[1], seen[2])
+            else:
+                self._state = (signature, taxonomy, self.build(taxonomy))
+                self.reloads += 1
+            return self._state
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "rollback":
+        current = rollback_taxonomy(sys.argv[2])
+        write_workbook(load_taxonomy())
+        print(f"Current taxonomy version is now {current}; {WORKBOOK_PATH} rewritten to match")
+    else:
+        workbook = sys.argv[1] if len(sys.argv) > 1 else WORKBOOK_PATH
+        compiled = compile_workbook(workbook)
+        publish_taxonomy(compiled)
+        # Precompute the local index too, so cold starts only have to load it
+        from taxonomy_index import load_or_build_index
+        load_or_build_index(compiled)
+        print(f"Compiled {len(compiled['rows'])} rows from {workbook} (version {compiled['version']})")
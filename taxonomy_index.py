@@ -0,0 +1,165 @@
+"""
+Local vector index over the category taxonomy.
+
+Each taxonomy row (category, subcategory and its examples) is turned into a
+hashed TF-IDF vector held in a NumPy matrix, so scoring a ticket against the
+whole taxonomy is one matrix-vector product. The index backs the local
+fast-path classifier: tickets whose best match is both strong enough and
+clearly ahead of the runner-up are answered without calling the LLM. It also produces the top-k candidate
+shortlist used instead of the full taxonomy in shortlist prompt mode.
+"""
+import math
+import os
+import re
+import zlib
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "cannot", "for",
+    "from", "has", "have", "i", "in", "is", "it", "its", "me", "my", "of", "on",
+    "or", "our", "please", "the", "this", "to", "we", "with", "you", "etc",
+}
+
+DEFAULT_DIM = 2 ** 12
+# Precomputed index for the current taxonomy, written next to categories/taxonomy.json
+INDEX_PATH = os.path.join("categories", "taxonomy_index.npz")
+# Minimum margin between the best and second-best match for a local answer;
+# raise it to send more tickets to the LLM, set it above 1 to disable the fast path
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.25"))
+# Minimum similarity of the best match itself, so a vague ticket with one weak
+# match (0.26 against nothing) still goes to the LLM
+FAST_PATH_MIN_SCORE = float(os.getenv("FAST_PATH_MIN_SCORE", "0.3"))
+# Number of candidate subcategories sent to the LLM in shortlist prompt mode
+SHORTLIST_K = int(os.getenv("SHORTLIST_K", "15"))
+
+
+def _stem(word):
+    """Very light suffix stripping so 'printers'/'printer' and 'connecting'/'connect' match."""
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Returns unigram and bigram features for a piece of text."""
+    words = [_stem(w) for w in _TOKEN.findall(str(text).lower()) if w not in _STOPWORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _bucket(feature, dim):
+    # crc32 is stable across processes, unlike the built-in hash()
+    return zlib.crc32(feature.encode("utf-8")) % dim
+
+
+def _term_counts(text, dim):
+    counts = {}
+    for feature in tokenize(text):
+        bucket = _bucket(feature, dim)
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+class HashingVectorizer:
+    """Hashed TF-IDF vectorizer producing L2-normalized NumPy vectors."""
+
+    def __init__(self, dim=DEFAULT_DIM):
+        self.dim = dim
+        self.idf = np.ones(dim, dtype=np.float32)
+
+    def fit(self, texts):
+        document_frequency = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            for bucket in _term_counts(text, self.dim):
+                document_frequency[bucket] += 1
+        n = len(texts)
+        self.idf = (np.log((1 + n) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self
+
+    def transform(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for bucket, count in _term_counts(text, self.dim).items():
+                matrix[i, bucket] = (1 + math.log(count)) * self.idf[bucket]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+
+class TaxonomyIndex:
+    """Scores ticket text against every taxonomy row."""
+
+    def __init__(self, rows, dim=DEFAULT_DIM, matrix=None, idf=None):
+        self.rows = list(rows)
+        if matrix is not None:
+            # Restoring a saved index: no re-vectorizing needed
+            self.vectorizer = HashingVectorizer(matrix.shape[1])
+            self.vectorizer.idf = idf
+            self.matrix = matrix
+            return
+        documents = [
+            f"{row['category']} {row['subcategory']} {row['subcategory']} {row.get('examples', '')}"
+            for row in self.rows
+        ]
+        self.vectorizer = HashingVectorizer(dim).fit(documents)
+        self.matrix = self.vectorizer.transform(documents)
+
+    def search(self, text, k=5):
+        """Returns the top-k (score, row) pairs by cosine similarity."""
+        if not self.rows:
+            return []
+        scores = self.matrix @ self.vectorizer.transform([text])[0]
+        k = min(k, len(self.rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.rows[i]) for i in top]
+
+    def classify(self, text, threshold=FAST_PATH_THRESHOLD, min_score=FAST_PATH_MIN_SCORE):
+        """Returns (row, confidence) when confident enough, else (None, confidence).
+
+        Confidence is the similarity margin between the best and the runner-up
+        row, so a ticket that matches two subcategories equally well is escalated;
+        so is one whose best match scores below min_score.
+        """
+        matches = self.search(text, k=2)
+        if not matches:
+            return None, 0.0
+        best_score, row = matches[0]
+        runner_up = matches[1][0] if len(matches) > 1 else 0.0
+        confidence = round(best_score - runner_up, 4)
+        return (row if confidence >= threshold and best_score >= min_score else None), confidence
+
+    def shortlist(self, text, k=SHORTLIST_K):
+        """Returns (category_str, subcategory_str) for the top-k candidate rows,
+        formatted like the full-taxonomy prompt, or None if nothing matches."""
+        matches = self.search(text, k)
+        if not matches or matches[0][0] <= 0:
+            return None
+        rows = [row for _, row in matches]
+        category_str = "\n".join(sorted({row["category"] for row in rows}))
+        subcategory_str = "\n".join(f"{row['category']} - {row['subcategory']}" for row in rows)
+        return category_str, subcategory_str
+
+
+def load_or_build_index(taxonomy, path=INDEX_PATH):
+    """Loads the precomputed index for this taxonomy version, building (and saving) it if needed.
+
+    Running `python taxonomy.py` at build time writes the file, so a fresh
+    process only has to read it.
+    """
+    if os.path.exists(path):
+        with np.load(path) as data:
+            if str(data["version"]) == taxonomy["version"]:
+                return TaxonomyIndex(taxonomy["rows"], matrix=data["matrix"], idf=data["idf"])
+
+    index = TaxonomyIndex(taxonomy["rows"])
+    try:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, version=taxonomy["version"], matrix=index.matrix, idf=index.vectorizer.idf)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # read-only filesystem (e.g. Lambda): the index is simply rebuilt next cold start
+    return index
@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The compiled taxonomy and its index are read from categories/ relative to the repo root
+os.chdir(ROOT)
+
+# No Gemini calls and no analytics files from test runs
+os.environ.setdefault("TICKET_LLM", "fake")
+os.environ.setdefault("CLASSIFICATION_LOG", "off")
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue, run_worker
+
+TICKETS = ["VPN drops every few minutes", "Printer on floor 3 is jammed", "Outlook crashes on attachments"]
+RESULT = {"category": "Network", "subcategory": "VPN Issues"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3, lease_seconds=60, retry_delay=10)
+
+
+def test_resubmitting_the_same_job_returns_the_existing_one(queue):
+    job_id, created = queue.submit(TICKETS)
+    assert created
+    # Case and whitespace do not make a different job
+    assert queue.submit([f"  {ticket.upper()} " for ticket in TICKETS]) == (job_id, False)
+    assert queue.submit(TICKETS, packed=True)[0] != job_id
+    keyed, _ = queue.submit(TICKETS, idempotency_key="upload-42")
+    assert queue.submit(TICKETS[:1], idempotency_key="upload-42") == (keyed, False)
+    assert queue.status(job_id)["total"] == len(TICKETS)
+
+
+def test_items_of_an_expired_lease_are_claimed_again(queue, clock):
+    queue.submit(TICKETS)
+    assert len(queue.claim(limit=10)) == 3
+    assert queue.claim(limit=10) == []
+    clock.now += 61
+    reclaimed = queue.claim(limit=10)
+    assert [item["attempts"] for item in reclaimed] == [2, 2, 2]
+
+
+def test_failed_item_is_retried_after_a_growing_backoff(queue, clock):
+    job_id, _ = queue.submit(TICKETS[:1])
+    items = queue.claim()
+    queue.finish(items, [RuntimeError("503")])
+    assert queue.claim() == []
+    clock.now += 10
+    items = queue.claim()
+    assert [item["attempts"] for item in items] == [2]
+
+    queue.finish(items, [RuntimeError("503")])
+    clock.now += 10
+    assert queue.claim() == []
+    clock.now += 10
+    assert len(queue.claim()) == 1
+    # Errors of items still being retried are not reported
+    assert queue.results(job_id)[0]["error"] is None
+
+
+def test_item_fails_after_max_attempts(queue, clock):
+    job_id, _ = queue.submit(TICKETS[:2])
+    for _ in range(3):
+        items = queue.claim()
+        queue.finish(items, [RESULT if item["idx"] == 0 else TimeoutError("timed out") for item in items])
+        clock.now += 100
+
+    status = queue.status(job_id)
+    assert (status["status"], status["done"], status["failed"], status["progress"]) == ("completed", 1, 1, 1.0)
+    assert queue.results(job_id) == [
+        {"index": 0, "status": "done", **RESULT, "error": None},
+        {"index": 1, "status": "failed", "error": "timed out"},
+    ]
+    assert queue.claim() == []
+
+
+def test_results_are_paged_in_ticket_order(queue):
+    job_id, _ = queue.submit(TICKETS)
+    assert queue.status(job_id)["status"] == "queued"
+    items = queue.claim(limit=2)
+    queue.finish(items, [RESULT] * len(items))
+    assert queue.status(job_id)["status"] == "running"
+    assert [(item["index"], item["status"]) for item in queue.results(job_id, offset=1, limit=2)] == [
+        (1, "done"), (2, "pending"),
+    ]
+    assert queue.status("unknown") is None
+
+
+def test_worker_processes_a_submitted_job(queue):
+    job_id, _ = queue.submit(TICKETS, packed=True)
+    calls = []
+
+    async def process(descriptions, packed):
+        calls.append((len(descriptions), packed))
+        return [RESULT] * len(descriptions)
+
+    async def run_until_done():
+        worker = asyncio.create_task(run_worker(queue, process, chunk_size=2, poll_interval=0.01))
+        while queue.status(job_id)["status"] != "completed":
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    asyncio.run(asyncio.wait_for(run_until_done(), 10))
+    assert calls == [(2, True), (1, True)]
@@ -0,0 +1,31 @@
+import difflib
+
+from labels import LabelIndex, label_rates
+
+ROWS = [
+    {"category": "Network", "subcategory": "VPN Issues"},
+    {"category": "Network", "subcategory": "Wi-Fi"},
+    {"category": "Hardware", "subcategory": "Printers"},
+]
+
+
+def test_exact_answer():
+    label = LabelIndex(ROWS).validate("Network", "VPN Issues")
+    assert (label.category, label.subcategory, label.match, label.similarity) == ("Network", "VPN Issues", "exact", 1.0)
+
+
+def test_wrong_category_is_recovered_from_the_subcategory_with_its_measured_similarity():
+    label = LabelIndex(ROWS).validate("Software", "VPN Issues")
+    assert (label.category, label.subcategory, label.match) == ("Network", "VPN Issues", "subcategory")
+    measured = difflib.SequenceMatcher(None, "software vpn issues", "network vpn issues", autojunk=False).ratio()
+    assert label.similarity == round(measured, 4) < 0.9
+
+
+def test_json_reply_is_parsed():
+    label = LabelIndex(ROWS).parse('{"category": "hardware", "subcategory": "printers"}')
+    assert (label.category, label.subcategory, label.match) == ("Hardware", "Printers", "normalized")
+
+
+def test_snap_rate_counts_both_kinds_of_correction():
+    rates = label_rates({"exact": 6, "subcategory": 1, "snapped": 1, "rejected": 2})
+    assert (rates["snap_rate"], rates["reject_rate"]) == (0.2, 0.2)
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import lambdaapp
+import semantic_cache
+from classification_cache import ResultCache
+from job_queue import JobQueue
+from taxonomy import TaxonomyWatcher
+
+# Scores low against the taxonomy index, so it always reaches the LLM
+LLM_TICKET = "I can't connect to the VPN from home since this morning"
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    # Fresh caches and per-version state for every test
+    monkeypatch.setattr(lambdaapp, "result_cache", ResultCache())
+    monkeypatch.setattr(semantic_cache, "_caches", {})
+    monkeypatch.setattr(lambdaapp, "taxonomy_watcher", TaxonomyWatcher(build=lambdaapp._build_state))
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(lambdaapp, "get_job_queue", lambda: queue)
+    # asyncio.Event binds to the loop it is first awaited on; each test runs its own loop
+    monkeypatch.setattr(lambdaapp, "job_wakeup", asyncio.Event())
+    return lambdaapp.app
+
+
+def run_with_deadline(coro, seconds=30):
+    """Runs coro on a fresh loop in a daemon thread; False if it has not returned by the deadline."""
+    thread = threading.Thread(target=asyncio.run, args=(coro,), daemon=True)
+    thread.start()
+    thread.join(seconds)
+    return not thread.is_alive()
+
+
+def test_shutdown_right_after_job_submit(app):
+    async def submit_then_shut_down():
+        async with lambdaapp.lifespan(app):
+            # Let the workers go idle, waiting on the wakeup event
+            await asyncio.sleep(0.2)
+            await lambdaapp.submit_job(lambdaapp.JobRequest(tickets=[{"description": "Printer on floor 3 is jammed"}]))
+            # Another submission lands as shutdown starts: workers are woken and cancelled in the same step
+            lambdaapp.job_wakeup.set()
+
+    assert run_with_deadline(submit_then_shut_down()), "lifespan shutdown did not return after a job submission"
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_classify_prompt_asks_for_the_subcategory(app, monkeypatch, streaming):
+    monkeypatch.setattr(lambdaapp, "LLM_STREAMING", streaming)
+    client = TestClient(app)
+
+    result = client.post("/classify", json={"description": LLM_TICKET}).json()
+    assert (result["tier"], result["match"]) == ("llm", "exact")
+    assert (result["category"], result["subcategory"]) == ("Network", "VPN Issues")
+    assert client.post("/classify", json={"description": LLM_TICKET}).json()["tier"] == "cache"
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_category_only_reply_is_rejected_and_not_cached(app, monkeypatch, streaming):
+    # A prompt without the subcategory: the (format-following) fake answers {"category": "Network"} only
+    template = lambdaapp.PROMPT_TEMPLATE.replace(', "subcategory": "<subcategory>"', "")
+    assert "subcategory" not in template
+    monkeypatch.setattr(lambdaapp, "PROMPT_TEMPLATE", template)
+    monkeypatch.setattr(lambdaapp, "LLM_STREAMING", streaming)
+    client = TestClient(app)
+
+    result = client.post("/classify", json={"description": LLM_TICKET}).json()
+    assert result["match"] == "rejected"
+    assert (result["category"], result["subcategory"]) == (None, None)
+    assert result["raw"] == "Network"
+    assert client.post("/classify", json={"description": LLM_TICKET}).json()["tier"] == "llm"
+
+
+def test_streamed_json_answer_stops_before_the_explanation(app, monkeypatch):
+    fake = lambdaapp.get_llm()
+    monkeypatch.setattr(fake, "explanation_tokens", 40)
+    fake.reset_stats()
+    client = TestClient(app)
+
+    lines = client.post("/classify/stream", json={"description": LLM_TICKET}).text.splitlines()
+    events = [json.loads(line) for line in lines]
+    assert [(e["event"], e.get("value")) for e in events[:2]] == [("category", "Network"), ("subcategory", "VPN Issues")]
+    assert (events[-1]["event"], events[-1]["match"]) == ("result", "exact")
+    # The stream is closed at the end of the object, before the explanation is generated
+    assert fake.stats()["output_tokens"] < 40
+
+
+def test_timeout_reports_the_limit_it_was_given():
+    async def slow():
+        await asyncio.sleep(1)
+
+    with pytest.raises(TimeoutError, match=r"after 0\.05s"):
+        asyncio.run(lambdaapp._with_timeout(slow(), timeout=0.05))
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from fake_llm import FakeLLMError, FakeRateLimitError
+from llm_client import AdaptiveConcurrency, RateLimiter, TokenBucket, is_rate_limit, is_retryable
+
+
+def limiter(**kwargs):
+    kwargs.setdefault("concurrency", AdaptiveConcurrency(1, 4, target_latency=0))
+    return RateLimiter(rpm=0, tpm=0, max_retries=2, backoff_base=0, hedge_after="off", **kwargs)
+
+
+def failing(*errors, result="ok"):
+    """A call that raises the given errors in turn, then returns result."""
+    errors = list(errors)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    call.calls = calls
+    return call
+
+
+def test_throttling_and_transient_errors_are_retryable():
+    assert is_rate_limit(FakeRateLimitError("429 Resource has been exhausted"))
+    assert is_retryable(FakeLLMError("503 unavailable"))
+    assert is_retryable(ConnectionError("reset"))
+    assert not is_rate_limit(FakeLLMError("503"))
+    assert not is_retryable(ValueError("invalid argument"))
+
+
+def test_token_bucket_makes_callers_wait_for_their_debt():
+    bucket = TokenBucket(per_minute=60, capacity=2)
+    assert bucket.reserve(2) == 0.0
+    # One unit over an empty bucket refilling one unit per second
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert not bucket.try_take(1)
+    assert TokenBucket(per_minute=0).reserve(10 ** 6) == 0.0
+
+
+def test_concurrency_is_halved_on_throttling_once_per_cooldown():
+    concurrency = AdaptiveConcurrency(1, 16, target_latency=0)
+    for _ in range(3):
+        concurrency.acquire_sync()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 8
+    # Calls that were in flight when the limit dropped do not cut it again
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 8
+    concurrency.release(latency=0.1)
+    assert concurrency.limit == pytest.approx(8 + 1 / 8)
+
+
+def test_slow_calls_cut_concurrency_but_not_below_the_minimum():
+    concurrency = AdaptiveConcurrency(3, 4, target_latency=1)
+    concurrency.acquire_sync()
+    concurrency.release(latency=5)
+    assert concurrency.limit == pytest.approx(3.6)
+
+    concurrency = AdaptiveConcurrency(3, 4)
+    concurrency.acquire_sync()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 3
+
+
+def test_transient_failures_are_retried():
+    call = failing(FakeLLMError("503"), FakeRateLimitError("429"))
+    rate_limiter = limiter()
+    assert rate_limiter.run(call, estimate=10) == "ok"
+    assert len(call.calls) == 3
+    assert {key: rate_limiter.stats()[key] for key in ("calls", "retries", "throttled")} == {
+        "calls": 3, "retries": 2, "throttled": 1,
+    }
+    assert rate_limiter.concurrency.in_flight == 0
+
+
+def test_retries_stop_after_max_retries_and_on_permanent_errors():
+    call = failing(*[FakeLLMError("503")] * 3)
+    with pytest.raises(FakeLLMError):
+        limiter().run(call, estimate=10)
+    assert len(call.calls) == 3
+
+    call = failing(ValueError("invalid argument"))
+    with pytest.raises(ValueError):
+        limiter().run(call, estimate=10)
+    assert len(call.calls) == 1
+
+
+def test_usage_beyond_the_estimate_is_charged_to_the_token_bucket():
+    rate_limiter = limiter()
+    rate_limiter.tokens = TokenBucket(per_minute=6000)
+    message = AIMessage(content="", usage_metadata={"input_tokens": 400, "output_tokens": 100, "total_tokens": 500})
+    rate_limiter.reconcile(message, estimate=100)
+    assert rate_limiter.tokens.tokens == pytest.approx(5600, abs=1)
+
+
+def test_slow_call_is_hedged_and_the_faster_answer_wins():
+    rate_limiter = limiter()
+    rate_limiter.hedge_after = "0.05"
+    started = []
+
+    async def make_call():
+        started.append(1)
+        # The first call hangs; the duplicate answers at once
+        await asyncio.sleep(5 if len(started) == 1 else 0)
+        return "hedge" if len(started) > 1 else "primary"
+
+    result = asyncio.run(asyncio.wait_for(rate_limiter.arun(make_call, estimate=10), 2))
+    assert result == "hedge"
+    assert (rate_limiter.counts["hedges"], rate_limiter.counts["hedge_wins"]) == (1, 1)
+
+
+def test_stream_is_retried_only_before_its_first_chunk():
+    attempts = []
+
+    def make_stream(fail_after):
+        def stream():
+            attempts.append(1)
+            if len(attempts) == 1:
+                if fail_after:
+                    yield "partial"
+                raise FakeLLMError("503")
+            yield "answer"
+        return stream
+
+    assert list(limiter().stream(make_stream(fail_after=False), estimate=10)) == ["answer"]
+    assert len(attempts) == 2
+
+    attempts.clear()
+    received = []
+    with pytest.raises(FakeLLMError):
+        for chunk in limiter().stream(make_stream(fail_after=True), estimate=10):
+            received.append(chunk)
+    assert (received, len(attempts)) == (["partial"], 1)
@@ -0,0 +1,55 @@
+import json
+
+from packing import format_tickets, pack_tickets, parse_packed_response
+
+
+def answer(ticket_id, category="Network", subcategory="VPN Issues"):
+    return {"id": ticket_id, "category": category, "subcategory": subcategory}
+
+
+def test_answers_in_any_order_are_matched_by_id():
+    content = json.dumps([answer("2", "Hardware", "Printers"), answer("0"), answer("1", "Software", "Email")])
+    answers = parse_packed_response(content, [0, 1, 2])
+    assert answers == {
+        "0": {"category": "Network", "subcategory": "VPN Issues"},
+        "1": {"category": "Software", "subcategory": "Email"},
+        "2": {"category": "Hardware", "subcategory": "Printers"},
+    }
+
+
+def test_missing_answers_are_left_out_for_a_retry():
+    answers = parse_packed_response(json.dumps([answer("0"), answer("2")]), [0, 1, 2])
+    assert sorted(answers) == ["0", "2"]
+
+
+def test_unknown_duplicate_and_malformed_answers_are_dropped():
+    content = json.dumps([
+        answer("7"),  # not in the pack
+        answer("0"), answer("0", "Hardware", "Printers"),  # conflicting answers for one ticket
+        {"id": "1", "subcategory": "Email"},  # no category
+        "2",
+        answer("3", subcategory=None),
+    ])
+    answers = parse_packed_response(content, [0, 1, 2, 3])
+    assert answers == {"3": {"category": "Network", "subcategory": ""}}
+
+
+def test_array_is_found_inside_surrounding_text():
+    content = "Here are the answers:\n```json\n" + json.dumps([answer("0")]) + "\n```"
+    assert list(parse_packed_response(content, [0])) == ["0"]
+
+
+def test_unparseable_reply_gives_no_answers():
+    assert parse_packed_response("Category: Network", [0]) == {}
+    assert parse_packed_response('[{"id": "0", "category": ', [0]) == {}
+
+
+def test_packs_respect_the_ticket_cap_and_token_budget():
+    tickets = [(i, "VPN drops every few minutes") for i in range(5)]
+    assert [len(pack) for pack in pack_tickets(tickets, budget=10_000, max_tickets=2)] == [2, 2, 1]
+    # A budget below one ticket's cost still gives each ticket a pack of its own
+    assert [len(pack) for pack in pack_tickets(tickets, budget=1)] == [1] * 5
+
+
+def test_tickets_are_sent_with_string_ids():
+    assert json.loads(format_tickets([(3, "Printer jammed")])) == [{"id": "3", "text": "Printer jammed"}]
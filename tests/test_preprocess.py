@@ -0,0 +1,76 @@
+from preprocess import clean_ticket, preprocess_ticket, truncate_to_budget
+from tokens import count_tokens
+
+EMAIL = """VPN disconnects every few minutes since this morning
+I cannot reach the intranet while it is down.
+2024-05-01 09:00:01 ERROR vpn tunnel reset id=1
+2024-05-01 09:00:07 ERROR vpn tunnel reset id=2
+2024-05-01 09:00:13 ERROR vpn tunnel reset id=3
+2024-05-01 09:00:19 ERROR vpn tunnel reset id=4
+2024-05-01 09:00:25 WARN retrying handshake
+2024-05-01 09:00:26 INFO tunnel up
+2024-05-01 09:00:28 ERROR auth timeout
+2024-05-01 09:00:31 INFO connected
+I cannot reach the intranet while it is down.
+
+Thanks,
+Jane Doe
+IT Coordinator | Example Corp
+
+On Mon, May 1, 2024 at 8:55 AM Helpdesk <help@example.com> wrote:
+> Please describe the problem.
+"""
+
+
+def test_quotes_signature_repeats_and_log_runs_are_removed():
+    report = preprocess_ticket(EMAIL)
+    assert report["text"].splitlines() == [
+        "VPN disconnects every few minutes since this morning",
+        "I cannot reach the intranet while it is down.",
+        # The other resets differ only by digits: repeats
+        "2024-05-01 09:00:01 ERROR vpn tunnel reset id=1",
+        "2024-05-01 09:00:25 WARN retrying handshake",
+        "[... 2 log lines omitted ...]",
+        "2024-05-01 09:00:31 INFO connected",
+    ]
+    assert report["tokens_removed"] == report["tokens_before"] - report["tokens_after"] > 0
+
+
+def test_repeated_log_lines_differing_only_by_digits_are_dropped():
+    text = "Backup job fails nightly\n" + "\n".join(f"[02:00:{s:02d}] backup error code {s}" for s in range(3))
+    assert preprocess_ticket(text)["text"].splitlines() == ["Backup job fails nightly", "[02:00:00] backup error code 0"]
+
+
+def test_forwarded_ticket_opening_with_a_header_keeps_its_text():
+    text = "From: Jane Doe\nOutlook crashes when opening attachments\n-- \nJane"
+    assert preprocess_ticket(text)["text"] == "From: Jane Doe\nOutlook crashes when opening attachments"
+
+
+def test_single_line_and_disabled_tickets_are_only_stripped():
+    assert preprocess_ticket("  Printer jammed  ")["text"] == "Printer jammed"
+    assert preprocess_ticket(EMAIL, enabled=False)["text"] == EMAIL.strip()
+
+
+def test_truncation_keeps_opening_and_error_lines_within_budget():
+    lines = ["Laptop will not boot", "It was fine yesterday"] + [f"Filler line number {i} about my day" for i in range(40)]
+    lines[30] = "Boot fails with error 0xc000000f"
+    kept = truncate_to_budget(lines, max_tokens=40)
+    assert kept[:2] == lines[:2]
+    assert "Boot fails with error 0xc000000f" in kept
+    assert "[...]" in kept
+    assert sum(count_tokens(line) + 1 for line in kept if line != "[...]") <= 40
+    # Original order is kept
+    assert kept.index("Boot fails with error 0xc000000f") > kept.index(lines[1])
+
+
+def test_long_opening_line_is_cut_at_a_word_boundary():
+    kept = truncate_to_budget(["word " * 400, "Outlook error on send"], max_tokens=40)
+    assert kept[0].endswith("word ...")
+    assert kept[-1] == "Outlook error on send"
+
+
+def test_over_budget_ticket_is_truncated_and_reported():
+    text = "Printer jammed\n" + "\n".join(f"Note {i}: the tray was refilled with paper type {i * 7}" for i in range(200))
+    report = clean_ticket(text)
+    assert report["tokens_after"] <= 512 < report["tokens_before"]
+    assert report["text"].startswith("Printer jammed")
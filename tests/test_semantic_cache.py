@@ -0,0 +1,99 @@
+import pytest
+
+from semantic_cache import SemanticCache
+
+VPN = {"category": "Network", "subcategory": "VPN Issues"}
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache("test", max_size=16)
+
+
+@pytest.mark.parametrize("stored, ticket", [
+    ("I need access to the shared drive", "I cannot access the shared drive"),
+    ("Wifi not working on laptop", "Laptop not working"),
+    ("Outlook not opening", "Excel not opening"),
+    ("My printer doesn't print", "My printer prints blank pages"),
+])
+def test_near_duplicates_with_different_labels_do_not_match(cache, stored, ticket):
+    cache.add(stored, VPN)
+    assert cache.lookup(ticket) is None
+
+
+@pytest.mark.parametrize("ticket", [
+    "Hi team, I can't connect to the VPN from home since this morning",
+    "I can't connect to the VPN from home since this morning. Thanks in advance!",
+    "Since this morning I cannot connect to VPN from home",
+])
+def test_reworded_ticket_reuses_the_label(cache, ticket):
+    cache.add("I can't connect to the VPN from home since this morning", VPN)
+    result, similarity, matched = cache.lookup(ticket)
+    assert result == VPN
+    assert similarity >= cache.threshold
+    assert matched.startswith("I can't connect")
+
+
+def test_paraphrase_with_other_word_order_is_a_hit(cache):
+    cache.add("can't connect to VPN", VPN)
+    assert cache.lookup("VPN won't connect")[0] == VPN
+    assert cache.lookup("VPN not connecting")[0] == VPN
+
+
+def test_need_access_and_cannot_access_are_a_miss(cache):
+    cache.add("need access", VPN)
+    assert cache.lookup("cannot access") is None
+
+
+def test_least_recently_used_ticket_is_evicted():
+    cache = SemanticCache("test", max_size=2)
+    cache.add("Outlook crashes when opening attachments", VPN)
+    cache.add("Printer on floor 3 is jammed", VPN)
+    assert cache.lookup("Outlook crashes when opening attachments") is not None
+    cache.add("Laptop battery drains overnight", VPN)
+    assert cache.lookup("Printer on floor 3 is jammed") is None
+    assert cache.lookup("Outlook crashes when opening attachments") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.fixture
+def saved_caches(tmp_path, monkeypatch):
+    import semantic_cache
+
+    monkeypatch.setattr(semantic_cache, "_caches", {})
+    monkeypatch.setattr(semantic_cache, "_evicted_paths", set())
+    monkeypatch.setattr(semantic_cache, "cache_path", lambda version, directory=None: str(tmp_path / f"semantic_{version}.npz"))
+    return semantic_cache
+
+
+def saved_files(directory):
+    return sorted(p.name for p in directory.iterdir())
+
+
+def test_saving_one_version_keeps_other_live_versions(saved_caches, tmp_path):
+    old, new = saved_caches.semantic_cache_for("old"), saved_caches.semantic_cache_for("new")
+    old.add("Printer on floor 3 is jammed", VPN)
+    new.add("Laptop battery drains overnight", VPN)
+    old.save()
+    new.save()
+    saved_caches.save_all()
+    assert saved_files(tmp_path) == ["semantic_new.npz", "semantic_old.npz"]
+
+    reloaded = SemanticCache("old", path=str(tmp_path / "semantic_old.npz")).load()
+    assert reloaded.lookup("Printer on floor 3 is jammed")[0] == VPN
+
+
+def test_save_all_removes_only_versions_this_process_evicted(saved_caches, tmp_path):
+    # Saved by another worker sharing the directory
+    (tmp_path / "semantic_other.npz").write_bytes(b"")
+    for version in ("v1", "v2"):
+        saved_caches.semantic_cache_for(version).save()
+    saved_caches.semantic_cache_for("v3")
+    saved_caches.save_all()
+    assert saved_files(tmp_path) == ["semantic_other.npz", "semantic_v2.npz", "semantic_v3.npz"]
+
+
+def test_save_all_without_caches_removes_nothing(saved_caches, tmp_path):
+    (tmp_path / "semantic_v1.npz").write_bytes(b"")
+    saved_caches.save_all()
+    assert saved_files(tmp_path) == ["semantic_v1.npz"]
@@ -0,0 +1,16 @@
+from taxonomy import compile_rows, compile_workbook, load_taxonomy, publish_taxonomy, rollback_taxonomy, write_workbook
+
+OLD = [{"category": "Network", "subcategory": "VPN Issues", "examples": "vpn drops"}]
+NEW = OLD + [{"category": "Hardware", "subcategory": "Printers", "examples": ""}]
+
+
+def test_rolled_back_rows_written_to_the_workbook_recompile_to_the_same_version(tmp_path):
+    path, versions_dir, workbook = tmp_path / "taxonomy.json", tmp_path / "versions", tmp_path / "categories.xlsx"
+    old = publish_taxonomy(compile_rows(OLD), path, versions_dir)
+    publish_taxonomy(compile_rows(NEW), path, versions_dir)
+
+    assert rollback_taxonomy(old, path, versions_dir) == old
+    write_workbook(load_taxonomy(path), workbook)
+    recompiled = compile_workbook(workbook)
+    assert recompiled["version"] == old
+    assert recompiled["rows"] == OLD
@@ -0,0 +1,23 @@
+from taxonomy_index import FAST_PATH_MIN_SCORE, FAST_PATH_THRESHOLD, TaxonomyIndex
+
+ROWS = [
+    {"category": "Hardware", "subcategory": "Printers", "examples": "paper tray toner cartridge"},
+    {"category": "Network", "subcategory": "VPN", "examples": "vpn tunnel drops remote access client"},
+]
+
+
+def test_clear_match_is_answered_locally():
+    row, confidence = TaxonomyIndex(ROWS).classify("Printer toner cartridge is empty")
+    assert row["subcategory"] == "Printers"
+    assert confidence >= FAST_PATH_THRESHOLD
+
+
+def test_single_weak_match_goes_to_the_llm():
+    index = TaxonomyIndex(ROWS)
+    (best, _), (runner_up, _) = index.search("toner", k=2)
+    # Far enough ahead of the runner-up, but a weak match in itself
+    assert best - runner_up >= FAST_PATH_THRESHOLD
+    assert best < FAST_PATH_MIN_SCORE
+    row, confidence = index.classify("toner")
+    assert row is None
+    assert confidence == round(best - runner_up, 4)
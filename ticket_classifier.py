@@ -0,0 +1,221 @@
+"""
+Classification pieces shared by the Streamlit pages.
+
+Home.py classifies one ticket at a time and pages/Bulk_Classify.py whole
+ticket files; both use the prompt, response parser and process-wide
+resources (result cache, classification log, taxonomy watcher, LLM client
+and chains) defined here, so a ticket classified on one page is a cache hit
+on the other, and a reworded copy of it a near-duplicate hit (semantic_cache.py).
+
+The Gemini client is created once per process (get_llm) and chains once per
+taxonomy version (get_chain), shared by every session and rerun: a rerun
+does no setup work, and the client's HTTP connections stay open between
+tickets.
+
+Tickets are classified independently, so chat history is off by default
+(CHAT_HISTORY=off). With CHAT_HISTORY=on the previous turns are sent along,
+capped at CHAT_HISTORY_MAX_MESSAGES messages and CHAT_HISTORY_MAX_TOKENS tokens
+so session memory and prompt size stay flat in long sessions.
+"""
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from classification_cache import cache_from_env
+from classification_log import log_from_env
+from labels import label_index
+from llm_client import rate_limited
+from metrics import record_cache_lookup, record_fallback, record_tier
+from semantic_cache import semantic_cache_for
+from streaming import LLM_MAX_OUTPUT_TOKENS
+from taxonomy import TaxonomyWatcher
+from taxonomy_index import load_or_build_index
+from tokens import count_tokens
+
+CHAT_HISTORY_ENABLED = os.getenv("CHAT_HISTORY", "off").lower() in ("on", "true", "1")
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "6"))
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "1000"))
+# Chains kept in the pool; a few taxonomy versions and system prompts
+CHAIN_POOL_SIZE = 8
+
+# Taxonomy is filled in per call so shortlist mode can send only the candidates
+SYSTEM_MESSAGE = """You are an expert at classifying IT support tickets.
+Classify each ticket into one of the following categories and subcategories.
+
+Categories:
+{categories}
+
+Subcategories:
+{subcategories}
+
+Respond with only a JSON object:
+{{"category": "<category>", "subcategory": "<subcategory>"}}
+Use only the provided values.
+"""
+
+
+def bounded_messages(messages, max_messages=CHAT_HISTORY_MAX_MESSAGES, max_tokens=CHAT_HISTORY_MAX_TOKENS):
+    """Returns the most recent messages that fit both caps, starting on a human turn."""
+    kept, tokens = [], 0
+    for message in reversed(messages):
+        tokens += count_tokens(str(message.content))
+        if len(kept) >= max_messages or tokens > max_tokens:
+            break
+        kept.append(message)
+    kept.reverse()
+    # Never start on an orphaned answer whose question was dropped
+    while kept and kept[0].type != "human":
+        kept.pop(0)
+    return kept
+
+
+class BoundedChatHistory(BaseChatMessageHistory):
+    """Wraps a chat history and trims it to the caps after every turn."""
+
+    def __init__(self, history, max_messages=CHAT_HISTORY_MAX_MESSAGES, max_tokens=CHAT_HISTORY_MAX_TOKENS):
+        self.history = history
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+
+    @property
+    def messages(self):
+        return self.history.messages
+
+    def add_messages(self, messages):
+        self.history.add_messages(messages)
+        current = self.history.messages
+        kept = bounded_messages(current, self.max_messages, self.max_tokens)
+        if len(kept) < len(current):
+            self.history.clear()
+            self.history.add_messages(kept)
+
+    def clear(self):
+        self.history.clear()
+
+
+def build_chain(llm, system_message=SYSTEM_MESSAGE, history_key="ticket_chat", history=CHAT_HISTORY_ENABLED,
+                **partials):
+    """Returns the classification chain: prompt | llm, plus bounded Streamlit chat
+    history when history is on. Invoke it with a configurable session_id either way.
+
+    partials pre-fill prompt variables (e.g. the taxonomy); values passed at
+    invoke time take precedence.
+    """
+    if not history:
+        prompt = ChatPromptTemplate.from_messages([("system", system_message), ("human", "{ticket_description}")])
+        return prompt.partial(**partials) | llm
+
+    from langchain_community.chat_message_histories import StreamlitChatMessageHistory
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+
+    history_prompt = ChatPromptTemplate.from_messages([
+        ("system", system_message),
+        MessagesPlaceholder("history"),
+        ("human", "{ticket_description}"),
+    ]).partial(**partials)
+    # Looked up per call, in the calling session, so one chain can serve every session
+    return RunnableWithMessageHistory(
+        history_prompt | llm,
+        lambda session_id: BoundedChatHistory(StreamlitChatMessageHistory(key=history_key)),
+        input_messages_key="ticket_description",
+        history_messages_key="history",
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llm(temperature=0.3):
+    """The process-wide Gemini client: rate-limited (see llm_client.py), in JSON mode,
+    with the completion capped at LLM_MAX_OUTPUT_TOKENS since the answer is one small object."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return rate_limited(ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=temperature, max_retries=1,
+                                               max_output_tokens=LLM_MAX_OUTPUT_TOKENS,
+                                               response_mime_type="application/json"))
+
+
+_chains = OrderedDict()
+_chains_lock = threading.Lock()
+
+
+def get_chain(taxonomy, system_message=SYSTEM_MESSAGE, history=CHAT_HISTORY_ENABLED):
+    """Returns the pooled chain for a taxonomy version, building it on first use.
+
+    The full category and subcategory lists are bound into the prompt, so
+    callers pass just ticket_description, or their own categories and
+    subcategories (shortlist mode).
+    """
+    key = (taxonomy["version"], system_message, history)
+    with _chains_lock:
+        chain = _chains.get(key)
+        if chain is None:
+            chain = _chains[key] = build_chain(
+                get_llm(), system_message, history=history,
+                categories=taxonomy["category_str"], subcategories=taxonomy["subcategory_str"],
+            )
+            while len(_chains) > CHAIN_POOL_SIZE:
+                _chains.popitem(last=False)
+        return chain
+
+
+def parse_classification(content, taxonomy):
+    """Parses a {"category", "subcategory"} reply and checks it against the taxonomy.
+
+    Returns a labels.Classification: near misses are snapped to the closest valid
+    pair, and labels matching nothing come back rejected with None fields.
+    """
+    return label_index(taxonomy).parse(content)
+
+
+@lru_cache(maxsize=None)
+def get_result_cache():
+    """Process-wide result cache shared by every session and page."""
+    return cache_from_env()
+
+
+@lru_cache(maxsize=None)
+def get_classification_log():
+    """Process-wide classification log (see classification_log.py), or None when disabled."""
+    return log_from_env()
+
+
+@lru_cache(maxsize=None)
+def get_taxonomy_watcher():
+    """Process-wide watcher: reruns pay only an os.stat to notice a newly published taxonomy."""
+    return TaxonomyWatcher(build=load_or_build_index)
+
+
+def store_result(description, taxonomy, result):
+    """Caches an LLM label for exact repeats and near-duplicates of the ticket."""
+    get_result_cache().set(description, taxonomy["version"], result)
+    semantic = semantic_cache_for(taxonomy["version"])
+    if semantic is not None:
+        semantic.add(description, result)
+
+
+def classify_without_llm(description, taxonomy, index):
+    """Tries the cache, then near-duplicates of earlier tickets, then the local index.
+
+    Returns (result, tier, confidence); result is None when the ticket needs the LLM.
+    A near-duplicate result also carries `semantic_match` (similarity and matched ticket).
+    """
+    cached = get_result_cache().get(description, taxonomy["version"])
+    record_cache_lookup(cached is not None)
+    if cached is not None:
+        record_tier("cache", taxonomy["version"])
+        return cached, "cache", None
+    semantic = semantic_cache_for(taxonomy["version"])
+    match = semantic.lookup(description) if semantic is not None else None
+    if match is not None:
+        cached, similarity, ticket = match
+        record_tier("semantic", taxonomy["version"])
+        return {**cached, "semantic_match": {"similarity": similarity, "ticket": ticket}}, "semantic", None
+    row, confidence = index.classify(description)
+    if row is not None:
+        record_tier("local", taxonomy["version"])
+        return {"category": row["category"], "subcategory": row["subcategory"]}, "local", confidence
+    record_fallback("low_confidence")
+    return None, "llm", confidence
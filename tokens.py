@@ -0,0 +1,109 @@
+"""
+Token counting shared by the classifier entry points.
+
+Uses the same tiktoken encoding as pages/Upload_Categories.py. Gemini's own
+tokenizer differs slightly, so these counts are estimates; when the encoding
+cannot be loaded (e.g. no network to fetch it) a ~4 characters per token
+approximation is used instead.
+
+Large inputs (taxonomy uploads with 100k rows) go through count_tokens_batch(),
+which encodes on TOKEN_COUNT_THREADS threads (tiktoken releases the GIL), and
+TokenCountCache, which remembers counts by content hash so only new or changed
+texts are encoded again.
+"""
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from itertools import islice
+
+ENCODING_NAME = "cl100k_base"
+TOKEN_COUNT_THREADS = int(os.getenv("TOKEN_COUNT_THREADS", str(min(8, os.cpu_count() or 1))))
+# Texts encoded per batch; bounds the memory of one encode_ordinary_batch call
+TOKEN_COUNT_BATCH = 4096
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "500000"))
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name=ENCODING_NAME):
+    """Returns the tiktoken encoder, or None if it cannot be loaded."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        return None
+
+
+def count_tokens(text, encoder=None):
+    """Counts tokens in text, falling back to a character-based estimate."""
+    if not text:
+        return 0
+    encoder = encoder or get_encoder()
+    if encoder is None:
+        return max(1, len(text) // 4)
+    return len(encoder.encode(str(text), disallowed_special=()))
+
+
+def count_tokens_batch(texts, encoder=None, num_threads=TOKEN_COUNT_THREADS):
+    """Counts tokens for many texts at once; returns a list aligned with texts."""
+    texts = ["" if text is None else str(text) for text in texts]
+    encoder = encoder or get_encoder()
+    if encoder is None:
+        return [max(1, len(text) // 4) if text else 0 for text in texts]
+    if num_threads <= 1:
+        # The thread pool behind encode_ordinary_batch only adds overhead on one core
+        return [len(encoder.encode_ordinary(text)) for text in texts]
+    counts = []
+    for start in range(0, len(texts), TOKEN_COUNT_BATCH):
+        batch = texts[start:start + TOKEN_COUNT_BATCH]
+        counts.extend(len(tokens) for tokens in encoder.encode_ordinary_batch(batch, num_threads=num_threads))
+    return counts
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCountCache:
+    """Token counts keyed by a hash of the text, bounded to max_entries (oldest dropped first)."""
+
+    def __init__(self, max_entries=TOKEN_COUNT_CACHE_SIZE, encoder=None):
+        self.max_entries = max_entries
+        self.encoder = encoder
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def count(self, texts):
+        """Returns (counts aligned with texts, number of distinct texts that had to be encoded)."""
+        texts = ["" if text is None else str(text) for text in texts]
+        keys = [_digest(text) for text in texts]
+        with self._lock:
+            missing = {key: text for key, text in zip(keys, texts) if key not in self._counts}
+        if missing:
+            counts = count_tokens_batch(list(missing.values()), self.encoder)
+            with self._lock:
+                self._counts.update(zip(missing, counts))
+                excess = len(self._counts) - self.max_entries
+                if excess > 0:
+                    for key in list(islice(self._counts, excess)):
+                        del self._counts[key]
+        with self._lock:
+            found = [self._counts.get(key) for key in keys]
+        # An entry evicted by a concurrent update is simply counted again
+        return [
+            count if count is not None else count_tokens(text, self.encoder)
+            for count, text in zip(found, texts)
+        ], len(missing)
+
+
+def record_saved_tokens(response, full_text, sent_text, key="shortlist_saved_tokens"):
+    """Adds the estimated input tokens saved by sending sent_text instead of
+    full_text to the response's usage_metadata, and returns that number."""
+    saved = max(0, count_tokens(full_text) - count_tokens(sent_text))
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        usage[key] = usage.get(key, 0) + saved
+    return saved